@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 import ujson
 
+from .Config import Config
+from .Explainer import Explainer
+from .Interface import Interface
 from .Logger import Logger
 from .RulesParser import RulesParser
+from .Targets import Targets
 
 
 class App:
@@ -11,13 +15,35 @@ class App:
     """
 
     @staticmethod
-    def run(rules_file='rules.json', verbosity=0):
+    def run(rules_file='rules.json', verbosity=0, resume=False):
         """
-        Runs the parser with a given rules file.
+        Runs the parser with a given rules file, optionally resuming the
+        previous run.
         """
         logger = Logger(verbosity=verbosity)
         logger.log('run-verbosity', verbosity)
         rules = {}
         with open(rules_file, 'r') as f:
             rules = ujson.load(f)
-        RulesParser(logger).parse(rules)
+        parser = RulesParser(logger)
+        parser.parse(rules, resume=resume)
+        parser.close()
+
+    @staticmethod
+    def explain(rules_file='rules.json', output='table',
+                configfile='magnivore.json'):
+        """
+        Explains the rulesets of a given rules file on the donor, without
+        running them. Provides the reports as a table or as JSON.
+        """
+        with open(rules_file, 'r') as f:
+            rules = ujson.load(f)
+        interface = Interface(Config(filename=configfile).get())
+        targets = Targets(interface.donor(tables=[]), Logger())
+        try:
+            reports = Explainer(targets).explain(rules)
+        finally:
+            interface.close()
+        if output == 'json':
+            return ujson.dumps(reports, indent=2, sort_keys=True)
+        return Explainer.table(reports)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from peewee import Model
+
+from .Tracker import database
+
+
+class BufferedModel(Model):
+    """
+    A model of the tracker database whose rows are buffered by each thread
+    and upserted when flushed. Flushing happens together with the tracker
+    matches, so that rows are only written once the receiver is committed.
+    """
+
+    buffers = threading.local()
+
+    class Meta:
+        database = database
+
+    @classmethod
+    def buffer(cls):
+        """
+        Provides the rows buffered by the current thread for the model
+        """
+        name = cls._meta.db_table
+        if not hasattr(cls.buffers, name):
+            setattr(cls.buffers, name, {})
+        return getattr(cls.buffers, name)
+
+    @classmethod
+    def discard(cls):
+        setattr(cls.buffers, cls._meta.db_table, {})
+
+    @classmethod
+    def flush(cls):
+        """
+        Writes the rows buffered by the current thread
+        """
+        rows = list(cls.buffer().values())
+        cls.discard()
+        if rows:
+            cls.insert_many(rows).upsert().execute()
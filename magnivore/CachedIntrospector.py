@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import pickle
+from urllib.parse import quote
+
+from peewee import MySQLDatabase, PostgresqlDatabase
+
+from playhouse.reflection import Introspector
+
+
+class CachedIntrospector(Introspector):
+    """
+    An Introspector that keeps reflected schemas in a directory, and
+    reflects the database again only when its schema fingerprint changes.
+    """
+
+    queries = {
+        'postgres': [
+            'SELECT table_name, column_name, data_type, is_nullable, '
+            'column_default FROM information_schema.columns '
+            'WHERE table_schema = current_schema() '
+            'ORDER BY table_name, ordinal_position',
+            'SELECT tablename, indexname, indexdef FROM pg_indexes '
+            'WHERE schemaname = current_schema() '
+            'ORDER BY tablename, indexname',
+            'SELECT conrelid::regclass::text, conname, '
+            'pg_get_constraintdef(oid) FROM pg_constraint '
+            'WHERE connamespace = current_schema()::regnamespace '
+            'ORDER BY 1, 2'
+        ],
+        'mysql': [
+            'SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, '
+            'COLUMN_KEY FROM information_schema.COLUMNS '
+            'WHERE TABLE_SCHEMA = DATABASE() '
+            'ORDER BY TABLE_NAME, ORDINAL_POSITION',
+            'SELECT TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME, '
+            'NON_UNIQUE FROM information_schema.STATISTICS '
+            'WHERE TABLE_SCHEMA = DATABASE() '
+            'ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX',
+            'SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, '
+            'REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME '
+            'FROM information_schema.KEY_COLUMN_USAGE '
+            'WHERE TABLE_SCHEMA = DATABASE() '
+            'ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION'
+        ],
+        'sqlite': [
+            'SELECT type, name, tbl_name, sql FROM sqlite_master '
+            'ORDER BY type, name'
+        ]
+    }
+
+    def __init__(self, metadata, schema=None, path=None):
+        super().__init__(metadata, schema=schema)
+        self.path = path
+
+    @classmethod
+    def from_database(cls, database, schema=None, path=None):
+        introspector = super().from_database(database, schema=schema)
+        introspector.path = path
+        return introspector
+
+    def _queries(self):
+        database = self.metadata.database
+        if isinstance(database, PostgresqlDatabase):
+            return self.queries['postgres']
+        elif isinstance(database, MySQLDatabase):
+            return self.queries['mysql']
+        return self.queries['sqlite']
+
+    def _filename(self):
+        return os.path.join(self.path, '{}.schema'.format(
+            quote(self.get_database_name(), safe='')))
+
+    def fingerprint(self):
+        """
+        Hashes the description of the tables, columns, indexes and
+        constraints of the database.
+        """
+        digest = hashlib.sha1()
+        for query in self._queries():
+            cursor = self.metadata.database.execute_sql(query)
+            for row in cursor.fetchall():
+                digest.update(repr(tuple(row)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self, fingerprint):
+        """
+        Loads the cached schemas, discarding them when they were reflected
+        from a different fingerprint.
+        """
+        filename = self._filename()
+        if os.path.exists(filename) is False:
+            return {}
+        with open(filename, 'rb') as f:
+            cached_fingerprint, schemas = pickle.load(f)
+        if cached_fingerprint != fingerprint:
+            return {}
+        return schemas
+
+    def _save(self, fingerprint, schemas):
+        os.makedirs(self.path, exist_ok=True)
+        filename = self._filename()
+        with open('{}.tmp'.format(filename), 'wb') as f:
+            pickle.dump((fingerprint, schemas), f)
+        os.replace('{}.tmp'.format(filename), filename)
+
+    def introspect(self, table_names=None, literal_column_names=False):
+        """
+        Reflects the database, or loads the schema from the cache when it
+        was reflected with the same fingerprint.
+        """
+        options = {'table_names': table_names,
+                   'literal_column_names': literal_column_names}
+        if self.path is None:
+            return super().introspect(**options)
+        key = (table_names and tuple(sorted(table_names)),
+               literal_column_names)
+        fingerprint = self.fingerprint()
+        schemas = self._load(fingerprint)
+        if key not in schemas:
+            schemas[key] = super().introspect(**options)
+            self._save(fingerprint, schemas)
+        return schemas[key]
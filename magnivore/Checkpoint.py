@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from peewee import BooleanField, CharField, IntegerField
+
+from .BufferedModel import BufferedModel
+
+
+class Checkpoint(BufferedModel):
+    """
+    Records the progress of a run: the rulesets that are done and, for
+    chunked rulesets, the primary key of the last committed target.
+    """
+
+    ruleset = CharField(unique=True)
+    done = BooleanField(default=False)
+    last = IntegerField(null=True)
+
+    @staticmethod
+    def key(table, index, table_rules):
+        """
+        Names a ruleset by its table and label, or by its position in the
+        table's rulesets when it has no label.
+        """
+        return '{}:{}'.format(table, table_rules.get('label', index))
+
+    @staticmethod
+    def advance(ruleset, last):
+        """
+        Records the last target of a ruleset that will be committed.
+        """
+        Checkpoint.buffer()[ruleset] = {'ruleset': ruleset, 'done': False,
+                                        'last': last}
+
+    @staticmethod
+    def complete(ruleset):
+        Checkpoint.buffer()[ruleset] = {'ruleset': ruleset, 'done': True,
+                                        'last': None}
+
+    @staticmethod
+    def progress():
+        """
+        Provides the recorded progress, keyed by ruleset
+        """
+        return {checkpoint.ruleset: checkpoint
+                for checkpoint in Checkpoint.select()}
+
+    @staticmethod
+    def clear():
+        """
+        Forgets the progress of previous runs
+        """
+        Checkpoint.discard()
+        Checkpoint.delete().execute()
@@ -2,8 +2,10 @@
 import click
 
 from .App import App
+from .Checkpoint import Checkpoint
 from .Config import Config
 from .Tracker import Tracker, database
+from .Watermark import Watermark
 
 
 class Cli:
@@ -18,7 +20,9 @@ class Cli:
     @main.command()
     @click.argument('rulesfile', required=False)
     @click.option('--verbose', '-v', count=True)
-    def run(rulesfile, verbose):
+    @click.option('--resume', is_flag=True,
+                  help='Continue from where the previous run stopped')
+    def run(rulesfile, verbose, resume):
         """
         Performs migrations using rules.json or a given file
         """
@@ -27,14 +31,34 @@ class Cli:
             kwargs['rules_file'] = rulesfile
         if verbose:
             kwargs['verbosity'] = verbose
+        if resume:
+            kwargs['resume'] = True
         App.run(**kwargs)
 
+    @staticmethod
+    @main.command()
+    @click.argument('rulesfile', required=False)
+    @click.option('--json', 'output', flag_value='json',
+                  help='Output the reports as JSON')
+    def explain(rulesfile, output):
+        """
+        Estimates the cost of each ruleset, without running them
+        """
+        kwargs = {}
+        if rulesfile:
+            kwargs['rules_file'] = rulesfile
+        if output:
+            kwargs['output'] = output
+        click.echo(App.explain(**kwargs))
+
     @main.command()
     def init():
         """
-        Initial setup for magnivore
+        Initial setup for magnivore, or upgrade of an existing setup
         """
-        database.create_tables([Tracker])
+        database.create_tables([Tracker, Checkpoint, Watermark],
+                               safe=True)
+        Tracker.upgrade()
         database.commit()
 
     @main.command(name='config-skeleton')
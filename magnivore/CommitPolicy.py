@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+class CommitPolicy:
+    """
+    Decides when a transaction is due to be committed: every given number
+    of rows, every given number of seconds, or whichever comes first.
+    Without rows and seconds, transactions are never due.
+    """
+
+    def __init__(self, rows=None, seconds=None):
+        self.rows = rows
+        self.seconds = seconds
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(rows=config.get('rows'), seconds=config.get('seconds'))
+
+    def reset(self):
+        self.count = 0
+        self.started = time.monotonic()
+
+    def due(self):
+        """
+        Counts a row and tells whether the transaction is due.
+        """
+        self.count += 1
+        if self.rows and self.count >= self.rows:
+            return True
+        if self.seconds:
+            return time.monotonic() - self.started >= self.seconds
+        return False
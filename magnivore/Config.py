@@ -22,5 +22,21 @@ class Config(Aratrum):
             'name': 'receiver.db',
             'type': 'sqlite',
             'auth': auth
-        }
+        },
+        'tracker': {
+            'backend': 'database',
+            'path': 'magnivore-tracker',
+            'batch': 300,
+            'cache': 100000,
+            'preload': False
+        },
+        'transaction': {
+            'rows': None,
+            'seconds': None
+        },
+        'schema': {
+            'cache': True,
+            'path': 'magnivore-schema'
+        },
+        'workers': 1
     }
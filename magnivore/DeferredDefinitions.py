@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from peewee import CharField, Model, TextField
+
+import ujson
+
+from .Tracker import database
+
+
+class DeferredDefinitions(Model):
+    """
+    Keeps the definitions of the indexes and foreign keys that were dropped
+    from a receiver table, until they are rebuilt. A run that is interrupted
+    in between leaves them here, so that the next one can rebuild them.
+    """
+
+    class Meta:
+        database = database
+
+    table = CharField(unique=True)
+    definitions = TextField()
+
+    @staticmethod
+    def record(table, deferred):
+        """
+        Saves the definitions recorded by the deferred indexes of a table
+        """
+        row = {'table': table,
+               'definitions': ujson.dumps(deferred.definitions())}
+        DeferredDefinitions.insert(row).upsert().execute()
+
+    @staticmethod
+    def find(table):
+        """
+        Finds the saved definitions of a table, or None when its indexes
+        were not left dropped.
+        """
+        try:
+            item = DeferredDefinitions.get(DeferredDefinitions.table == table)
+        except DeferredDefinitions.DoesNotExist:
+            return None
+        return ujson.loads(item.definitions)
+
+    @staticmethod
+    def forget(table):
+        """
+        Removes the definitions of a table once its indexes are rebuilt
+        """
+        DeferredDefinitions.delete()\
+            .where(DeferredDefinitions.table == table).execute()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from peewee import MySQLDatabase, PostgresqlDatabase
+
+
+class DeferredIndexes:
+    """
+    Drops the secondary indexes and disables the foreign keys of a receiver
+    table during a bulk load, and rebuilds them afterwards.
+
+    Postgres indexes and foreign keys are dropped and recreated from their
+    definitions. MySQL indexes that don't back a foreign key are dropped,
+    and foreign key checks are disabled. SQLite indexes are dropped and
+    foreign key enforcement is disabled.
+
+    The definitions are inspected before anything is dropped, so that they
+    can be saved, and restored when an interrupted load is resumed.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.database = model._meta.database
+        self.table = model._meta.db_table
+        self.indexes = []
+        self.foreign_keys = []
+        self.settings = {}
+        self.inspected = False
+
+    def _postgres_indexes(self):
+        cursor = self.database.execute_sql(
+            'SELECT indexname, indexdef FROM pg_indexes AS i '
+            'WHERE tablename = %s AND schemaname = current_schema() '
+            'AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c '
+            'WHERE c.conname = i.indexname) ORDER BY indexname',
+            (self.table, ))
+        return [(name, sql) for name, sql in cursor.fetchall()]
+
+    def _postgres_foreign_keys(self):
+        cursor = self.database.execute_sql(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            'WHERE conrelid = %s::regclass AND contype = %s '
+            'ORDER BY conname', (self.table, 'f'))
+        return [(name, definition) for name, definition in cursor.fetchall()]
+
+    def _mysql_indexes(self):
+        foreign_columns = set(foreign_key.column for foreign_key in
+                              self.database.get_foreign_keys(self.table))
+        indexes = []
+        for index in self.database.get_indexes(self.table):
+            if index.name == 'PRIMARY' or index.columns[0] in foreign_columns:
+                continue
+            columns = ', '.join('`{}`'.format(column)
+                                for column in index.columns)
+            sql = 'CREATE {}INDEX `{}` ON `{}` ({})'.format(
+                'UNIQUE ' if index.unique else '', index.name, self.table,
+                columns)
+            indexes.append((index.name, sql))
+        return indexes
+
+    def _sqlite_indexes(self):
+        return [(index.name, index.sql) for index in
+                self.database.get_indexes(self.table) if index.sql]
+
+    def inspect(self):
+        """
+        Records the definitions of the indexes and foreign keys.
+        """
+        if isinstance(self.database, PostgresqlDatabase):
+            self.indexes = self._postgres_indexes()
+            self.foreign_keys = self._postgres_foreign_keys()
+        elif isinstance(self.database, MySQLDatabase):
+            self.indexes = self._mysql_indexes()
+            self.foreign_keys = self.database.get_foreign_keys(self.table)
+        else:
+            self.indexes = self._sqlite_indexes()
+            self.foreign_keys = self.database.get_foreign_keys(self.table)
+        self.inspected = True
+
+    def restore(self, definitions):
+        """
+        Replaces the recorded definitions with saved ones, whose indexes
+        were dropped by an interrupted run.
+        """
+        self.indexes = [tuple(index) for index in definitions['indexes']]
+        self.foreign_keys = [tuple(foreign_key) for foreign_key in
+                             definitions['foreign-keys']]
+
+    def definitions(self):
+        return {'indexes': self.indexes, 'foreign-keys': self.foreign_keys}
+
+    def drop(self):
+        """
+        Drops the indexes and foreign keys, inspecting them first unless it
+        was already done.
+        """
+        if self.inspected is False:
+            self.inspect()
+        execute = self.database.execute_sql
+        if isinstance(self.database, PostgresqlDatabase):
+            for name, definition in self.foreign_keys:
+                execute('ALTER TABLE "{}" DROP CONSTRAINT "{}"'.format(
+                    self.table, name))
+            for name, sql in self.indexes:
+                execute('DROP INDEX "{}"'.format(name))
+        elif isinstance(self.database, MySQLDatabase):
+            cursor = execute('SELECT @@foreign_key_checks')
+            self.settings['foreign_key_checks'] = cursor.fetchone()[0]
+            execute('SET foreign_key_checks = 0')
+            for name, sql in self.indexes:
+                execute('DROP INDEX `{}` ON `{}`'.format(name, self.table))
+        else:
+            self.database.commit()
+            cursor = execute('PRAGMA foreign_keys')
+            self.settings['foreign_keys'] = cursor.fetchone()[0]
+            execute('PRAGMA foreign_keys = 0')
+            self.database.begin()
+            for name, sql in self.indexes:
+                execute('DROP INDEX "{}"'.format(name))
+
+    def rebuild(self):
+        """
+        Recreates the dropped indexes and foreign keys.
+        """
+        execute = self.database.execute_sql
+        for name, sql in self.indexes:
+            execute(sql)
+        if isinstance(self.database, PostgresqlDatabase):
+            for name, definition in self.foreign_keys:
+                execute('ALTER TABLE "{}" ADD CONSTRAINT "{}" {}'.format(
+                    self.table, name, definition))
+        elif isinstance(self.database, MySQLDatabase):
+            execute('SET foreign_key_checks = {}'.format(
+                self.settings['foreign_key_checks']))
+        else:
+            self.database.commit()
+            execute('PRAGMA foreign_keys = {}'.format(
+                self.settings['foreign_keys']))
+            self.database.begin()
+        self.indexes = []
+        self.foreign_keys = []
+        self.inspected = False
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+from peewee import MySQLDatabase, PostgresqlDatabase
+
+from .Checkpoint import Checkpoint
+from .Projection import Projection
+
+
+class Explainer:
+    """
+    Estimates the cost of rulesets without running them. The query of each
+    ruleset is built as it would be for a run and explained by the donor,
+    reporting the estimated rows, the join and condition columns that have
+    no index, and the tracker lookups the ruleset would make.
+    """
+
+    columns = ['ruleset', 'rows', 'tracker-lookups', 'missing-indexes']
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.indexes = {}
+
+    @staticmethod
+    def _postgres_plan(node, depth=0):
+        line = node['Node Type']
+        if 'Relation Name' in node:
+            line = '{} on {}'.format(line, node['Relation Name'])
+        plan = ['{}{} (rows={})'.format('  ' * depth, line, node['Plan Rows'])]
+        for child in node.get('Plans', []):
+            plan += Explainer._postgres_plan(child, depth + 1)
+        return plan
+
+    def _explain(self, query):
+        """
+        Explains a query, providing the estimated rows and the plan lines.
+        SQLite plans have no row estimates, so rows is None for them.
+        """
+        database = query.database
+        sql, params = query.sql()
+        if isinstance(database, PostgresqlDatabase):
+            cursor = database.execute_sql(
+                'EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+            node = cursor.fetchone()[0][0]['Plan']
+            return node['Plan Rows'], self._postgres_plan(node)
+        if isinstance(database, MySQLDatabase):
+            cursor = database.execute_sql('EXPLAIN {}'.format(sql), params)
+            names = [column[0] for column in cursor.description]
+            rows = 1
+            plan = []
+            for row in cursor.fetchall():
+                step = dict(zip(names, row))
+                rows *= step['rows'] or 1
+                plan.append('{}: {} key={} (rows={})'.format(
+                    step['table'], step['type'], step['key'], step['rows']))
+            return rows, plan
+        cursor = database.execute_sql('EXPLAIN QUERY PLAN {}'.format(sql),
+                                      params)
+        return None, [row[-1] for row in cursor.fetchall()]
+
+    def _indexed(self, model):
+        """
+        Finds the columns of a donor table that lead an index or belong to
+        its primary key.
+        """
+        table = model._meta.db_table
+        if table not in self.indexes:
+            database = model._meta.database
+            columns = set(database.get_primary_keys(table))
+            for index in database.get_indexes(table):
+                columns.add(index.columns[0])
+            self.indexes[table] = columns
+        return self.indexes[table]
+
+    def _filtered(self, table_rules):
+        """
+        Finds the (model, field name) pairs that a ruleset joins or filters
+        on.
+        """
+        sources = table_rules['sources']
+        models = [self.targets.source_models[source['table']]
+                  for source in sources]
+        filtered = []
+        for position, source in enumerate(sources):
+            model = models[position]
+            if position > 0:
+                on = source['on']
+                if isinstance(on, list):
+                    previous = models[position - 1]
+                    if source.get('switch'):
+                        previous = models[0]
+                    filtered += [(previous, on[0]), (model, on[1])]
+                else:
+                    filtered.append((model, on))
+            for field in source.get('conditions', {}):
+                filtered.append((model, field))
+        if table_rules.get('watermark'):
+            filtered.append((models[0], table_rules['watermark']))
+        return filtered
+
+    def _missing_indexes(self, table_rules):
+        missing = []
+        for model, field in self._filtered(table_rules):
+            column = getattr(model, field).db_column
+            if column not in self._indexed(model):
+                name = '{}.{}'.format(model._meta.db_table, column)
+                if name not in missing:
+                    missing.append(name)
+        return missing
+
+    @staticmethod
+    def _lookups(table_rules):
+        """
+        Counts the tracker lookups made for each target: one for each match
+        rule, one to find the synced item, and one to route tracked targets
+        of watermarked rulesets.
+        """
+        lookups = 0
+        for section in ['transform', 'sync-transform']:
+            for rule in table_rules.get(section, {}).values():
+                if isinstance(rule, dict) and 'match' in rule:
+                    lookups += 1
+        if 'sync' in table_rules:
+            lookups += 1
+        if table_rules.get('watermark') and 'track' in table_rules:
+            lookups += 1
+        return lookups
+
+    def ruleset(self, key, table_rules):
+        """
+        Reports on a ruleset
+        """
+        columns = None
+        if table_rules.get('projection', True) is not False:
+            columns = Projection.columns(table_rules,
+                                         self.targets.source_models)
+        query = self.targets.query(table_rules['sources'], columns=columns)
+        rows, plan = self._explain(query)
+        lookups = None
+        if rows is not None:
+            lookups = rows * self._lookups(table_rules)
+        return {
+            'ruleset': key,
+            'rows': rows,
+            'tracker-lookups': lookups,
+            'lookups-per-row': self._lookups(table_rules),
+            'missing-indexes': self._missing_indexes(table_rules),
+            'plan': plan
+        }
+
+    def explain(self, rules):
+        """
+        Reports on every ruleset, in the order of the rules. The donor
+        tables are reflected at once, as they are for a run.
+        """
+        keyed = []
+        donor_tables = set()
+        for table, rulesets in rules.items():
+            if not isinstance(rulesets, list):
+                rulesets = [rulesets]
+            for index, table_rules in enumerate(rulesets):
+                key = Checkpoint.key(table, index, table_rules)
+                keyed.append((key, table_rules))
+                for source in table_rules.get('sources', []):
+                    donor_tables.add(source['table'])
+        self.targets.source_models.load(donor_tables)
+        return [self.ruleset(key, table_rules)
+                for key, table_rules in keyed]
+
+    @classmethod
+    def table(cls, reports):
+        """
+        Formats reports as a plain text table. Unknown estimates are shown
+        as '?'.
+        """
+        lines = [cls.columns]
+        for report in reports:
+            cells = []
+            for column in cls.columns:
+                value = report[column]
+                if value is None:
+                    value = '?'
+                elif isinstance(value, list):
+                    value = ', '.join(value) or '-'
+                cells.append(str(value))
+            lines.append(cells)
+        widths = [max(len(line[i]) for line in lines)
+                  for i in range(len(cls.columns))]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in
+                                   zip(line, widths)).rstrip()
+                         for line in lines)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import deque
+
+from peewee import MySQLDatabase, PostgresqlDatabase, fn
+
+
+class IdAllocator:
+    """
+    Hands out ids for new rows of a receiver table, reserving them in
+    blocks: with a batch of nextval calls on Postgres, after the highest id
+    locked with SELECT ... FOR UPDATE on MySQL, and after the highest id on
+    SQLite, where the first write locks the database anyway.
+
+    Ids that are reserved but not used leave gaps in the table.
+
+    On MySQL the AUTO_INCREMENT counter is not moved past the reserved
+    block: moving it takes ALTER TABLE or LOCK TABLES, and both commit the
+    open transaction. The lock holds off other writers until the receiver
+    commits, but afterwards they can take reserved ids that were not used
+    yet, so tables that get ids allocated on MySQL must have no other
+    writers during the run.
+    """
+
+    def __init__(self, model, block_size=1000):
+        self.model = model
+        self.block_size = block_size
+        self.ids = deque()
+        self.highest = 0
+        self.lock = threading.Lock()
+
+    def _after(self, highest, count):
+        """
+        Provides ids following the highest one, without handing out any
+        that was already reserved.
+        """
+        start = max(highest or 0, self.highest) + 1
+        self.highest = start + count - 1
+        return list(range(start, start + count))
+
+    def reserve(self, count):
+        """
+        Reserves the given number of ids in the database.
+        """
+        database = self.model._meta.database
+        primary_key = self.model._meta.primary_key
+        table = self.model._meta.db_table
+        if isinstance(database, PostgresqlDatabase):
+            cursor = database.execute_sql(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                (table, primary_key.db_column, count))
+            return [row[0] for row in cursor.fetchall()]
+        if isinstance(database, MySQLDatabase):
+            cursor = database.execute_sql(
+                'SELECT MAX(`{}`) FROM `{}` FOR UPDATE'.format(
+                    primary_key.db_column, table))
+            return self._after(cursor.fetchone()[0], count)
+        highest = self.model.select(fn.Max(primary_key)).scalar()
+        return self._after(highest, count)
+
+    def allocate(self, count):
+        """
+        Allocates ids for the given number of rows, reserving new blocks
+        when needed.
+        """
+        with self.lock:
+            while len(self.ids) < count:
+                size = max(count - len(self.ids), self.block_size)
+                self.ids.extend(self.reserve(size))
+            return [self.ids.popleft() for i in range(count)]
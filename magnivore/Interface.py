@@ -1,48 +1,229 @@
 # -*- coding: utf-8 -*-
-from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+import os
+import sqlite3
 
-from playhouse.reflection import Introspector
+from peewee import (DatabaseError, InterfaceError, MySQLDatabase,
+                    PostgresqlDatabase, SqliteDatabase)
+
+from playhouse.pool import (PooledDatabase, PooledMySQLDatabase,
+                            PooledPostgresqlDatabase)
+
+from .CachedIntrospector import CachedIntrospector
+from .Models import Models
 
 
 class Interface:
     """
     The Interface provides interaction with database and models.
     """
+    bulk_pragmas = {
+        'journal_mode': 'memory',
+        'synchronous': 'off',
+        'cache_size': -262144,
+        'temp_store': 'memory',
+        'mmap_size': 268435456
+    }
+
     def __init__(self, config):
         self.config = config
         self.databases = {}
+        self.pragmas = {}
+        self.memory = set()
+
+    def _schema_path(self):
+        """
+        Provides the directory where reflected schemas are cached, or None
+        when the cache is disabled.
+        """
+        schema_config = self.config.get('schema', {})
+        if schema_config.get('cache'):
+            return schema_config.get('path', 'magnivore-schema')
+        return None
 
-    def _generate_models(self, db_config):
+    def _generate_models(self, db_config, tables=None):
         name = db_config['name']
         self.create_database(name, db_type=db_config['type'],
-                             auth=db_config['auth'])
-        introspector = Introspector.from_database(self.databases[name])
-        models = introspector.generate_models()
-        for (name, model) in models.items():
-            model.__str__ = Interface.string_special
+                             auth=db_config['auth'],
+                             pool=db_config.get('pool'),
+                             memory=db_config.get('memory', False))
+        if db_config.get('pragmas'):
+            self.set_pragmas(name, db_config['pragmas'])
+        introspector = CachedIntrospector.from_database(
+            self.databases[name], path=self._schema_path())
+        models = Models(introspector, Interface.string_special)
+        models.load(tables)
         return models
 
-    def create_database(self, name, db_type='sqlite', auth=None):
+    def create_database(self, name, db_type='sqlite', auth=None, pool=None,
+                        memory=False):
         """
-        Creates a databases dynamically and registers it
+        Creates a databases dynamically and registers it. With pool, the
+        Postgres and MySQL connections are pooled, using the given
+        max_connections and stale_timeout. With memory, a SQLite database
+        is copied in memory and written back to its file at every commit,
+        so that the tracker never points to items that are not on disk.
         """
         if db_type == 'postgres':
             auth['autocommit'] = False
-            self.databases[name] = PostgresqlDatabase(name, **auth)
+            if pool:
+                options = dict(pool)
+                options.update(auth)
+                self.databases[name] = PooledPostgresqlDatabase(name,
+                                                                **options)
+            else:
+                self.databases[name] = PostgresqlDatabase(name, **auth)
         elif db_type == 'mysql':
             auth['autocommit'] = False
-            self.databases[name] = MySQLDatabase(name, **auth)
+            if pool:
+                options = dict(pool)
+                options.update(auth)
+                self.databases[name] = PooledMySQLDatabase(name, **options)
+            else:
+                self.databases[name] = MySQLDatabase(name, **auth)
+        elif memory:
+            database = SqliteDatabase(':memory:', autocommit=False)
+            disk = sqlite3.connect(name)
+            self._copy(disk, database.get_conn())
+            disk.close()
+            self.databases[name] = database
+            self.memory.add(name)
+            database.begin()
         else:
             self.databases[name] = SqliteDatabase(name, autocommit=False)
             self.databases[name].begin()
 
+    @staticmethod
+    def _copy(source, target):
+        """
+        Copies a SQLite database to another connection. The backup API
+        needs Python 3.7, so older versions replay a dump instead.
+        """
+        if hasattr(source, 'backup'):
+            source.backup(target)
+        else:
+            target.executescript('\n'.join(source.iterdump()))
+
+    def _write_memory(self, name):
+        """
+        Writes an in-memory database to its file, replacing the file at
+        once so that a crash leaves the previous copy.
+        """
+        temporary = '{}.tmp'.format(name)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        disk = sqlite3.connect(temporary)
+        self._copy(self.databases[name].get_conn(), disk)
+        disk.commit()
+        disk.close()
+        os.replace(temporary, name)
+
+    def begin(self):
+        """
+        Begins a transaction on all databases. Connections belong to the
+        thread that opens them, so each worker thread begins its own.
+        """
+        for key, database in self.databases.items():
+            database.begin()
+
     def commit(self):
         """
-        Commits all transactions to all databases
+        Commits all transactions to all databases, writing in-memory
+        databases to their files
+        """
+        for key, database in self.databases.items():
+            database.commit()
+            if key in self.memory:
+                self._write_memory(key)
+            database.begin()
+
+    def release(self):
+        """
+        Closes the connections of the calling thread, leaving the other
+        threads' connections open. Anything uncommitted is rolled back.
         """
         for key, database in self.databases.items():
+            if not database.is_closed():
+                database.close()
+
+    def threadsafe(self):
+        """
+        Tells whether the databases can be used by several threads at once.
+        In-memory databases exist only on the connection that created them.
+        """
+        return self.memory == set()
+
+    def set_pragmas(self, name, pragmas):
+        """
+        Sets pragmas on a SQLite database, keeping the previous values so
+        that they can be restored. 'bulk' sets the bulk_pragmas.
+        """
+        database = self.databases[name]
+        if not isinstance(database, SqliteDatabase):
+            return
+        if pragmas == 'bulk':
+            pragmas = self.bulk_pragmas
+        previous = self.pragmas.setdefault(name, {})
+        database.commit()
+        for key, value in pragmas.items():
+            if key not in previous:
+                cursor = database.execute_sql('PRAGMA {}'.format(key))
+                previous[key] = cursor.fetchone()[0]
+            database.execute_sql('PRAGMA {} = {}'.format(key, value))
+        database.begin()
+
+    def restore_pragmas(self):
+        """
+        Restores the pragmas changed with set_pragmas
+        """
+        for name, previous in self.pragmas.items():
+            database = self.databases[name]
             database.commit()
+            for key, value in previous.items():
+                database.execute_sql('PRAGMA {} = {}'.format(key, value))
             database.begin()
+        self.pragmas = {}
+
+    def close(self):
+        """
+        Commits and closes all databases, after restoring their pragmas and
+        writing in-memory databases to their files.
+        """
+        self.restore_pragmas()
+        for name, database in self.databases.items():
+            database.commit()
+            if name in self.memory:
+                self._write_memory(name)
+            database.close()
+
+    @staticmethod
+    def _close(database):
+        """
+        Closes a dropped connection, without returning it to the pool.
+        """
+        try:
+            if isinstance(database, PooledDatabase):
+                database.manual_close()
+            else:
+                database.close()
+        except (DatabaseError, InterfaceError):
+            pass
+
+    def reconnect(self):
+        """
+        Reopens the connections that were dropped and returns the names of
+        their databases. Anything uncommitted on a dropped connection is
+        lost, so this is meant to run right after a commit.
+        """
+        reconnected = []
+        for name, database in self.databases.items():
+            try:
+                database.execute_sql('SELECT 1')
+            except (DatabaseError, InterfaceError):
+                self._close(database)
+                database.connect()
+                database.begin()
+                reconnected.append(name)
+        return reconnected
 
     def string_special(self):
         """
@@ -50,14 +231,16 @@ class Interface:
         """
         return '{}:{}'.format(self.__class__.__name__, self.id)
 
-    def donor(self):
+    def donor(self, tables=None):
         """
-        Provides a list of donor models
+        Provides a list of donor models. When tables are given, only those
+        are reflected and other models are reflected on demand.
         """
-        return self._generate_models(self.config['donor'])
+        return self._generate_models(self.config['donor'], tables=tables)
 
-    def receiver(self):
+    def receiver(self, tables=None):
         """
-        Provides a list of receiver models
+        Provides a list of receiver models. When tables are given, only
+        those are reflected and other models are reflected on demand.
         """
-        return self._generate_models(self.config['receiver'])
+        return self._generate_models(self.config['receiver'], tables=tables)
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 import re
 from decimal import Decimal
-from functools import reduce
+from functools import lru_cache
 from math import ceil, floor
+from operator import attrgetter
+
+from peewee import ForeignKeyField, Model
 
 from .Tracker import Tracker
 
@@ -11,102 +14,208 @@ class Lexicon:
     """
     A lexicon of parsing rules that can be used by various parser to apply
     rules uniformely.
+
+    Each rule can be compiled once into a callable that takes only the
+    target, so that parsers don't need to interpret the rule for every item.
     """
 
     @staticmethod
-    def _dot(item, attribute):
-        try:
-            return getattr(item, attribute)
-        except AttributeError:
-            return None
+    @lru_cache(maxsize=None)
+    def _dot_getter(rule_from):
+        """
+        Builds a getter for a dotted path, that produces None when any of
+        the attributes is missing.
+        """
+        getter = attrgetter(rule_from)
+
+        def get(target):
+            try:
+                return getter(target)
+            except AttributeError:
+                return None
+        return get
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _id_getter(cls, rule_from):
+        """
+        Builds a getter for the old id of a match. When the path ends with
+        a foreign key to a primary key, its raw value is read, so that the
+        related item is not loaded from the donor.
+        """
+        path, _, attribute = rule_from.rpartition('.')
+        parent = cls._dot_getter(path) if path else None
+        getter = cls._dot_getter(rule_from)
+
+        def get(target):
+            item = parent(target) if parent else target
+            if isinstance(item, Model):
+                field = item._meta.fields.get(attribute)
+                if isinstance(field, ForeignKeyField) and \
+                        field.to_field is field.rel_model._meta.primary_key:
+                    return item._data.get(field.name)
+            return getter(target)
+        return get
 
     @classmethod
     def _dot_reduce(cls, rule_from, target):
         """
-        A shorthand for _dot and reduce.
+        Produces the value of a dotted path on the target.
+        """
+        return cls._dot_getter(rule_from)(target)
+
+    @classmethod
+    def compile_basic(cls, rule):
+        return cls._dot_getter(rule)
+
+    @classmethod
+    def compile_factor(cls, rule):
+        getter = cls._dot_getter(rule['from'])
+        factor = Decimal(rule['factor'])
+        rounding = None
+        if 'round' in rule:
+            rounding = floor
+            if rule['round'] == 'up':
+                rounding = ceil
+
+        def apply(target):
+            value = getter(target)
+            original_type = type(value)
+            result = Decimal(value) * factor
+            if rounding:
+                return original_type(rounding(result))
+            return original_type(result)
+        return apply
+
+    @classmethod
+    def compile_format(cls, rule):
+        rule_from = rule['from']
+        getters = []
+        if type(rule_from) == list:
+            getters = [cls._dot_getter(i) for i in rule_from]
+        if type(rule_from) == str:
+            getters = [cls._dot_getter(rule_from)]
+        format_string = rule['format'].format
+
+        def apply(target):
+            return format_string(*[getter(target) for getter in getters])
+        return apply
+
+    @classmethod
+    def compile_match(cls, rule, logger):
+        getter = cls._id_getter(rule['match'])
+        match_name = rule.get('from', rule['match'])
+
+        def apply(target):
+            match = Tracker.find_match(match_name, getter(target))
+            if match:
+                return match.new
+            logger.log('match-notfound', rule, target)
+        return apply
+
+    @classmethod
+    def compile_sync(cls, rule, logger):
+        getter = cls._id_getter(rule['attribute'])
+        match_name = rule['from']
+
+        def apply(target):
+            match = Tracker.find_match(match_name, getter(target))
+            if match is None:
+                logger.log('sync-notfound', rule, target)
+                return None
+            return match.new
+        return apply
+
+    @classmethod
+    def compile_sync_many(cls, rule, logger):
+        """
+        Compiles a sync rule for batches of targets, looking up the matches
+        of a batch at once.
         """
-        return reduce(cls._dot, rule_from.split('.'), target)
+        getter = cls._id_getter(rule['attribute'])
+        match_name = rule['from']
+
+        def apply(targets):
+            old_ids = [getter(target) for target in targets]
+            new_ids = Tracker.find_matches(match_name, old_ids)
+            for target, new_id in zip(targets, new_ids):
+                if new_id is None:
+                    logger.log('sync-notfound', rule, target)
+            return new_ids
+        return apply
+
+    @staticmethod
+    def compile_static(rule):
+        value = rule['static']
+        return lambda target: value
+
+    @staticmethod
+    def compile_transform(rule):
+        transform = rule['transform']
+        rule_from = rule['from']
+        return lambda target: transform[getattr(target, rule_from)]
+
+    @classmethod
+    def compile_expression(cls, rule, logger):
+        getter = cls._dot_getter(rule['from'])
+        expression = re.compile(rule['expression'])
+
+        def apply(target):
+            result = expression.findall(getter(target))
+            if result:
+                return result[0]
+            logger.log('expression-notfound', rule, target)
+        return apply
 
     @classmethod
     def basic(cls, rule, target):
         """
         The basic-most rule, which simply produces the requested value.
         """
-        return cls._dot_reduce(rule, target)
+        return cls.compile_basic(rule)(target)
 
     @classmethod
     def factor(cls, rule, target):
         """
         The factor rule multiplies the value by a factor.
         """
-        value = cls._dot_reduce(rule['from'], target)
-        original_type = type(value)
-        result = Decimal(value) * Decimal(rule['factor'])
-        if 'round' in rule:
-            if rule['round'] == 'up':
-                return original_type(ceil(result))
-            return original_type(floor(result))
-        return original_type(result)
+        return cls.compile_factor(rule)(target)
 
     @classmethod
     def format(cls, rule, target):
         """
         The format rule produces a formatted string.
         """
-        rule_from = rule['from']
-        format_data = []
-
-        if type(rule_from) == list:
-            for i in rule_from:
-                old_value = cls._dot_reduce(i, target)
-                format_data.append(old_value)
-
-        if type(rule_from) == str:
-            old_value = cls._dot_reduce(rule_from, target)
-            format_data.append(old_value)
-        return rule['format'].format(*format_data)
+        return cls.compile_format(rule)(target)
 
     @classmethod
     def match(cls, rule, target, logger):
         """
         Match rule
         """
-        old_value = cls._dot_reduce(rule['match'], target)
-        match_name = rule['match']
-        if 'from' in rule:
-            match_name = rule['from']
-
-        match = Tracker.find_match(match_name, old_value)
-        if match:
-            return match.new
-        logger.log('match-notfound', rule, target)
+        return cls.compile_match(rule, logger)(target)
 
-    @staticmethod
-    def sync(rule, target, logger):
+    @classmethod
+    def sync(cls, rule, target, logger):
         """
         Sync rule
         """
-        old_value = getattr(target, rule['attribute'])
-        match = Tracker.find_match(rule['from'], old_value)
-        if match is None:
-            logger.log('sync-notfound', rule, target)
-            return None
-        return match.new
+        return cls.compile_sync(rule, logger)(target)
 
-    @staticmethod
-    def static(rule, target):
+    @classmethod
+    def static(cls, rule, target):
         """
         The static rule produces a constant value.
         """
-        return rule['static']
+        return cls.compile_static(rule)(target)
 
-    @staticmethod
-    def transform(rule, target):
+    @classmethod
+    def transform(cls, rule, target):
         """
         The transform rule produces different values based on the target's
         value.
         """
-        return rule['transform'][getattr(target, rule['from'])]
+        return cls.compile_transform(rule)(target)
 
     @classmethod
     def expression(cls, rule, target, logger):
@@ -114,8 +223,4 @@ class Lexicon:
         The expression rule runs a regular expression against the specified
         column.
         """
-        attribute = cls._dot_reduce(rule['from'], target)
-        result = re.findall(rule['expression'], attribute)
-        if result:
-            return result[0]
-        logger.log('expression-notfound', rule, target)
+        return cls.compile_expression(rule, logger)(target)
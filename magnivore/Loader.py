@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import binascii
+import io
+import sqlite3
+from decimal import Decimal
+
+from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+
+from .IdAllocator import IdAllocator
+
+
+class Loader:
+    """
+    Loads batches of rows in a receiver table, with one of the methods:
+    save, which saves rows one by one; insert, which uses a multi-row
+    INSERT; executemany; and copy, which uses COPY FROM STDIN on Postgres.
+
+    Every method produces the ids of the new rows, in the same order, so
+    that items can be tracked. The executemany and copy methods always
+    assign ids from an IdAllocator before loading, and the other methods
+    do so with allocate.
+    """
+
+    methods = ['save', 'insert', 'executemany', 'copy']
+
+    def __init__(self, model, method='insert', allocate=False,
+                 block_size=1000):
+        if method not in self.methods:
+            raise ValueError('Unknown loader: {}'.format(method))
+        self.model = model
+        self.method = method
+        self.allocate = allocate
+        self.allocator = IdAllocator(model, block_size=block_size)
+
+    @property
+    def database(self):
+        return self.model._meta.database
+
+    @property
+    def primary_key(self):
+        return self.model._meta.primary_key
+
+    def _quote(self, name):
+        return '{0}{1}{0}'.format(self.database.quote_char, name)
+
+    def _columns(self, rows):
+        """
+        Provides the fields of the given rows, in a fixed order.
+        """
+        return [self.model._meta.fields[name] for name in rows[0]]
+
+    def _assign(self, rows):
+        """
+        Adds reserved ids to rows that don't have one.
+        """
+        name = self.primary_key.name
+        if name in rows[0]:
+            return rows
+        ids = self.allocator.allocate(len(rows))
+        return [dict(row, **{name: new_id}) for row, new_id in zip(rows, ids)]
+
+    def save(self, rows):
+        ids = []
+        for row in rows:
+            item = self.model(**row)
+            item.save(force_insert=self.primary_key.name in row)
+            ids.append(getattr(item, self.primary_key.name))
+        return ids
+
+    def insert(self, rows):
+        """
+        Inserts rows with a single statement. Ids come from RETURNING on
+        Postgres and SQLite 3.35+, or from the range that ends (SQLite) or
+        starts (MySQL) at the last insert id. On MySQL this requires
+        innodb_autoinc_lock_mode 0 or 1 when other clients are writing to
+        the same table.
+        """
+        primary_key = self.primary_key
+        if primary_key.name in rows[0]:
+            self.model.insert_many(rows).execute()
+            return [row[primary_key.name] for row in rows]
+
+        database = self.database
+        query = self.model.insert_many(rows)
+        if isinstance(database, PostgresqlDatabase):
+            return sorted(query.return_id_list().execute())
+
+        sql, params = query.sql()
+        if isinstance(database, SqliteDatabase):
+            if sqlite3.sqlite_version_info >= (3, 35, 0):
+                sql = '{} RETURNING "{}"'.format(sql, primary_key.db_column)
+                cursor = database.execute_sql(sql, params)
+                return sorted(row[0] for row in cursor.fetchall())
+
+        cursor = database.execute_sql(sql, params)
+        first_id = cursor.lastrowid
+        if not isinstance(database, MySQLDatabase):
+            first_id = first_id - len(rows) + 1
+        return list(range(first_id, first_id + len(rows)))
+
+    def executemany(self, rows):
+        rows = self._assign(rows)
+        fields = self._columns(rows)
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            self._quote(self.model._meta.db_table),
+            ', '.join(self._quote(field.db_column) for field in fields),
+            ', '.join([self.database.interpolation] * len(fields)))
+        params = [[field.db_value(row[field.name]) for field in fields]
+                  for row in rows]
+        cursor = self.database.get_cursor()
+        cursor.executemany(sql, params)
+        return [row[self.primary_key.name] for row in rows]
+
+    @staticmethod
+    def _csv_value(value):
+        """
+        Encodes a value for COPY in CSV format. NULL is an unquoted empty
+        value, so every other value but numbers is quoted.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (int, float, Decimal)):
+            return str(value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = '\\x{}'.format(binascii.hexlify(value).decode())
+        return '"{}"'.format(str(value).replace('"', '""'))
+
+    def copy(self, rows):
+        """
+        Streams rows as CSV to COPY FROM STDIN.
+        """
+        if not isinstance(self.database, PostgresqlDatabase):
+            raise ValueError('The copy loader requires Postgres')
+        rows = self._assign(rows)
+        fields = self._columns(rows)
+        data = io.StringIO()
+        for row in rows:
+            values = [field.db_value(row[field.name]) for field in fields]
+            data.write(','.join(self._csv_value(value) for value in values))
+            data.write('\n')
+        data.seek(0)
+        sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            self._quote(self.model._meta.db_table),
+            ', '.join(self._quote(field.db_column) for field in fields))
+        cursor = self.database.get_cursor()
+        cursor.copy_expert(sql, data)
+        return [row[self.primary_key.name] for row in rows]
+
+    def load(self, rows):
+        """
+        Loads rows with the loader's method and returns their ids.
+        """
+        if self.allocate:
+            rows = self._assign(rows)
+        return getattr(self, self.method)(rows)
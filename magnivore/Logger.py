@@ -10,10 +10,31 @@ class Logger:
         'get-targets': ('debug', 'Retrieving items with query: {}'),
         'parse-table': ('info', 'Parsing table {}'),
         'parse-ruleset': ('info', 'Parsing {} ruleset'),
+        'parse-workers': ('info', 'Parsing {} tables with {} workers'),
+        'workers-ignored': ('warning', 'Ignoring {} workers: the receiver is '
+                            'SQLite or in memory'),
         'get-targets-count': ('info', 'Found {} items'),
+        'get-targets-estimate': ('info', 'Found about {} items'),
+        'get-targets-chunk': ('debug', 'Retrieved {} items up to id {}'),
         'match-notfound': ('warning', 'Match rule {} on {} has no matches'),
         'expression-notfound': ('warning', 'Expression rule {} on {} is null'),
-        'sync-notfound': ('warning', 'Sync rule {} on {} has no matches')
+        'sync-notfound': ('warning', 'Sync rule {} on {} has no matches'),
+        'sync-counts': ('info', 'Synced {} items, skipped {} unchanged'),
+        'reconnect': ('warning', 'Reconnected to {}'),
+        'defer-indexes': ('info',
+                          'Dropped {} indexes and {} foreign keys of {}'),
+        'resume-indexes': ('warning', 'Taking over the indexes of {} left '
+                           'dropped by a previous run'),
+        'rebuild-indexes': ('info', 'Rebuilt the indexes of {} in {:.2f}s'),
+        'resume-skip': ('info', 'Skipping {}, done in the previous run'),
+        'transaction-untracked': ('warning', 'Untracked rulesets without '
+                                  'chunks are committed at their end'),
+        'resume-chunk': ('info', 'Resuming {} after id {}'),
+        'watermark': ('info', 'Reading {} after {} up to {}'),
+        'tracker-upgrade': ('warning', 'Upgraded the tracker table of a '
+                            'previous version'),
+        'tracker-preload': ('debug', 'Preloading {} matches'),
+        'tracker-cache': ('info', 'Tracker cache: {} hits, {} misses')
     }
 
     def __init__(self, *args, verbosity=0, output='stdout'):
@@ -38,10 +59,20 @@ class Logger:
             handler.setLevel(level)
             self.logger.addHandler(handler)
 
+    def _event_level(self, event):
+        if event in self.events:
+            return getattr(logging, self.events[event][0].upper())
+        return logging.INFO
+
+    def enabled(self, event):
+        """
+        Tells whether an event would be logged, so that expensive arguments
+        can be skipped.
+        """
+        return self.logger.isEnabledFor(self._event_level(event))
+
     def log(self, event, *args):
         message = event
-        level = logging.INFO
         if event in self.events:
-            level = getattr(logging, self.events[event][0].upper())
             message = self.events[event][1]
-        self.logger.log(level, message.format(*args))
+        self.logger.log(self._event_level(event), message.format(*args))
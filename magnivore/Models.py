@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+
+class Models(dict):
+    """
+    The models of a database, keyed by table name. Models are reflected
+    only for the tables that are loaded, together with the tables they
+    refer to, and missing tables are reflected on demand.
+    """
+
+    def __init__(self, introspector, string_method=None):
+        super().__init__()
+        self.introspector = introspector
+        self.string_method = string_method
+
+    def dependencies(self, tables):
+        """
+        Finds the given tables and the tables they refer to, recursively.
+        """
+        metadata = self.introspector.metadata
+        found = set()
+        pending = list(tables)
+        while pending:
+            table = pending.pop()
+            if table in found:
+                continue
+            found.add(table)
+            foreign_keys = metadata.get_foreign_keys(table,
+                                                     self.introspector.schema)
+            for foreign_key in foreign_keys:
+                pending.append(foreign_key.dest_table)
+        return found
+
+    def load(self, tables=None):
+        """
+        Reflects the models for the given tables, or for all tables when
+        none are given. Loaded models are reflected again together with the
+        new ones, so that foreign keys always point to models in this set.
+        """
+        table_names = None
+        if tables is not None:
+            missing = [table for table in tables if table not in self]
+            if missing == []:
+                return
+            table_names = self.dependencies(list(self) + missing)
+        models = self.introspector.generate_models(table_names=table_names)
+        for model in models.values():
+            if self.string_method:
+                model.__str__ = self.string_method
+        self.update(models)
+
+    def __missing__(self, table):
+        self.load([table])
+        if dict.__contains__(self, table):
+            return dict.__getitem__(self, table)
+        raise KeyError(table)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+
+
+class Pipeline:
+    """
+    Runs a ruleset in three stages joined by bounded queues: a reader
+    thread fetches the targets, a transform thread computes their values,
+    and the caller loads them. Loading, tracking and committing stay in the
+    calling thread, in the same order as the targets, while the other
+    stages wait on the donor and compute ahead.
+
+    A full queue blocks the stage that feeds it. An error in any stage
+    stops the others and is raised to the caller. When a stage thread is
+    done, release is called to close its connections.
+    """
+
+    done = object()
+
+    def __init__(self, size=1000, release=None):
+        self.size = size
+        self.release = release
+        self.stopped = threading.Event()
+
+    def _put(self, items, item):
+        """
+        Puts an item in a queue, giving up when the pipeline is stopped.
+        """
+        while not self.stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, items):
+        """
+        Gets items from a queue until the stage before is done, raising
+        its error if it failed, or until the pipeline is stopped.
+        """
+        while not self.stopped.is_set():
+            try:
+                item = items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is self.done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def _stage(self, function, items, output):
+        results = None
+        try:
+            results = function(items)
+            for item in results:
+                if self._put(output, item) is False:
+                    return
+            self._put(output, self.done)
+        except Exception as error:
+            self._put(output, error)
+        finally:
+            if hasattr(results, 'close'):
+                results.close()
+            if self.release:
+                self.release()
+
+    @staticmethod
+    def _fetch(targets):
+        yield from targets
+
+    def _start(self, function, items):
+        output = queue.Queue(maxsize=self.size)
+        thread = threading.Thread(target=self._stage,
+                                  args=(function, items, output), daemon=True)
+        thread.start()
+        return thread, output
+
+    def run(self, targets, transform):
+        """
+        Yields (target, result) pairs, where result is produced by the
+        transform function.
+        """
+        def transformed(items):
+            for target in self._get(items):
+                yield target, transform(target)
+
+        self.stopped.clear()
+        reader, fetched = self._start(self._fetch, targets)
+        transformer, results = self._start(transformed, fetched)
+        try:
+            yield from self._get(results)
+        finally:
+            self.stopped.set()
+            reader.join()
+            transformer.join()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from peewee import Field, ForeignKeyField
+
+
+class Projection:
+    """
+    Works out which donor columns are read by a ruleset, so that targets can
+    be retrieved without the columns that no rule uses.
+    """
+
+    @staticmethod
+    def _rule_paths(rule):
+        """
+        Finds the dotted paths read by a rule, in the same order the
+        Transformer recognizes rules.
+        """
+        if isinstance(rule, str):
+            return [rule]
+        if 'transform' in rule or 'factor' in rule or 'format' in rule:
+            rule_from = rule['from']
+        elif 'match' in rule:
+            return [rule['match']]
+        elif 'static' in rule:
+            return []
+        elif 'expression' in rule:
+            rule_from = rule['from']
+        else:
+            return None
+        if isinstance(rule_from, list):
+            return rule_from
+        return [rule_from]
+
+    @classmethod
+    def paths(cls, table_rules):
+        """
+        Collects the paths read by the transform and sync rules, or None
+        when a rule can't be analysed.
+        """
+        paths = set()
+        for section in ['transform', 'sync-transform']:
+            for rule in (table_rules.get(section) or {}).values():
+                rule_paths = cls._rule_paths(rule)
+                if rule_paths is None:
+                    return None
+                paths.update(rule_paths)
+        if 'sync' in table_rules:
+            paths.add(table_rules['sync']['attribute'])
+        return paths
+
+    @staticmethod
+    def _model(head, sources, models):
+        """
+        Finds the joined model that is reached by the first part of a path.
+        """
+        for source, model in zip(sources[1:], models[1:]):
+            if head in (source['table'], model._meta.db_table):
+                return model
+        field = models[0]._meta.fields.get(head)
+        if isinstance(field, ForeignKeyField):
+            for model in models[1:]:
+                if field.rel_model is model:
+                    return model
+        return None
+
+    @classmethod
+    def _field(cls, path, sources, models):
+        parts = path.split('.')
+        if len(parts) == 1:
+            return models[0]._meta.fields.get(parts[0])
+        if len(parts) == 2:
+            model = cls._model(parts[0], sources, models)
+            if model is not None:
+                return model._meta.fields.get(parts[1])
+        return None
+
+    @classmethod
+    def columns(cls, table_rules, source_models):
+        """
+        Produces the fields that a ruleset needs: the primary key of each
+        source and the columns read by its rules. Produces None when all
+        the columns must be selected.
+        """
+        sources = table_rules['sources']
+        for source in sources:
+            if 'picks' in source or 'aggregation' in source:
+                return None
+        paths = cls.paths(table_rules)
+        if paths is None:
+            return None
+        models = [source_models[source['table']] for source in sources]
+        columns = {}
+        for model in models:
+            primary_key = model._meta.primary_key
+            if not isinstance(primary_key, Field):
+                return None
+            columns[(model, primary_key.name)] = primary_key
+        for path in sorted(paths):
+            field = cls._field(path, sources, models)
+            if field is None:
+                return None
+            columns[(field.model_class, field.name)] = field
+        return list(columns.values())
@@ -1,9 +1,21 @@
 # -*- coding: utf-8 -*-
+import time
+
+from peewee import SqliteDatabase
+
+from .Checkpoint import Checkpoint
+from .CommitPolicy import CommitPolicy
 from .Config import Config
+from .DeferredDefinitions import DeferredDefinitions
+from .DeferredIndexes import DeferredIndexes
 from .Interface import Interface
+from .Pipeline import Pipeline
+from .Projection import Projection
+from .Scheduler import Scheduler
 from .Targets import Targets
 from .Tracker import Tracker, tracker_interface
 from .Transformer import Transformer
+from .Watermark import Watermark
 
 
 class RulesParser():
@@ -14,45 +26,464 @@ class RulesParser():
 
     def __init__(self, logger, configfile='magnivore.json'):
         self.config = Config(filename=configfile)
-        self.interface = Interface(self.config.get())
-        self.receiver = self.interface.receiver()
-        self.targets = Targets(self.interface.donor(), logger)
+        config = self.config.get()
+        self.interface = Interface(config)
+        self.receiver = self.interface.receiver(tables=[])
+        self.targets = Targets(self.interface.donor(tables=[]), logger)
         self.logger = logger
+        self.tracker_config = config.get('tracker', {})
+        self.transaction = config.get('transaction', {})
+        self.workers = config.get('workers', 1)
+        self.progress = {}
+        Tracker.create_table(fail_silently=True)
+        if Tracker.upgrade():
+            tracker_interface.commit()
+            self.logger.log('tracker-upgrade')
+        Checkpoint.create_table(fail_silently=True)
+        Watermark.create_table(fail_silently=True)
+        DeferredDefinitions.create_table(fail_silently=True)
+        Tracker.use_cache(size=self.tracker_config.get('cache', 100000))
+        Tracker.batch_size = self.tracker_config.get('batch', 300)
+        if self.tracker_config.get('pragmas'):
+            tracker_interface.set_pragmas('magnivore.db',
+                                          self.tracker_config['pragmas'])
+        if self.tracker_config.get('backend') == 'arrays':
+            path = self.tracker_config.get('path', 'magnivore-tracker')
+            Tracker.use_arrays(path=path)
 
-    def _process(self, table, table_rules):
-        model = self.receiver[table]
-        targets = self.targets.get(table_rules['sources'])
+    @staticmethod
+    def _match_names(table_rules):
+        """
+        Finds the tracking names that are consumed by a ruleset.
+        """
+        names = set()
+        for section in ['transform', 'sync-transform']:
+            for rule in table_rules.get(section, {}).values():
+                if isinstance(rule, dict) and 'match' in rule:
+                    names.add(rule.get('from', rule['match']))
+        if 'sync' in table_rules:
+            names.add(table_rules['sync']['from'])
+        return names
+
+    @staticmethod
+    def _tables(rules):
+        """
+        Finds the receiver and donor tables referenced by the rules.
+        """
+        receiver_tables = set(rules)
+        donor_tables = set()
+        for table in rules:
+            rulesets = rules[table]
+            if not isinstance(rulesets, list):
+                rulesets = [rulesets]
+            for table_rules in rulesets:
+                for source in table_rules.get('sources', []):
+                    donor_tables.add(source['table'])
+        return receiver_tables, donor_tables
+
+    def _preload(self, table_rules):
+        if self.tracker_config.get('preload'):
+            for match_name in self._match_names(table_rules):
+                self.logger.log('tracker-preload', match_name)
+                Tracker.preload(match_name)
+
+    def _commit(self):
+        """
+        Commits the receiver before the tracker, so that matches never point
+        to uncommitted items. Dropped connections are then reopened.
+        """
+        with Tracker.lock:
+            Tracker.flush()
+            Checkpoint.flush()
+            Watermark.flush()
+            self.interface.commit()
+            tracker_interface.commit()
+            Tracker.persist()
+        for name in self.interface.reconnect():
+            self.logger.log('reconnect', name)
+
+    def _paced(self, targets, policy):
+        """
+        Yields the targets, committing whenever the policy is due. A target
+        is only requested after the previous one is written and tracked.
+        """
+        for target in targets:
+            yield target
+            if policy.due():
+                self._commit()
+                policy.reset()
+
+    @staticmethod
+    def _transform(transformer, targets):
+        for target in targets:
+            item = transformer.transform(target)
+            if item:
+                yield target, item
+
+    def _columns(self, table_rules):
+        """
+        Finds the donor columns used by a ruleset, unless projection is
+        disabled for it.
+        """
+        if table_rules.get('projection', True) is False:
+            return None
+        return Projection.columns(table_rules, self.targets.source_models)
+
+    def _release(self):
+        self.interface.release()
+        tracker_interface.release()
+
+    def _pipelined(self, table_rules, targets, function):
+        """
+        Runs the targets through a pipeline, after committing so that the
+        stage threads can see every match tracked so far.
+        """
+        size = table_rules['pipeline']
+        if size is True:
+            size = Transformer.default_batch
+        self._commit()
+        pipeline = Pipeline(size=size, release=self._release)
+        return pipeline.run(targets, function)
 
+    def _route(self, model, table_rules, targets, batch):
+        """
+        Yields the targets that were never tracked, and syncs the others
+        with the transform rules, so that rows changed since the previous
+        watermark update their items instead of being inserted again.
+        """
+        match = {'from': table_rules['track'], 'attribute': 'id'}
+        transformer = Transformer(table_rules['transform'], model,
+                                  self.logger, match=match, batch=batch,
+                                  digest=self._digest(table_rules))
+        tracked = []
+        for target in targets:
+            if Tracker.find_match(table_rules['track'], target.id) is None:
+                yield target
+            elif transformer.batch:
+                tracked.append(target)
+                if len(tracked) >= transformer.batch:
+                    transformer.sync_many(tracked)
+                    tracked = []
+            else:
+                transformer.sync(target)
+        if tracked:
+            transformer.sync_many(tracked)
+        self.logger.log('sync-counts', transformer.updated,
+                        transformer.skipped)
+
+    @staticmethod
+    def _untracked(table_rules, targets):
+        """
+        Yields the targets that were not tracked yet, so that a resumed
+        ruleset skips the items committed before it was interrupted.
+        """
+        for target in targets:
+            if Tracker.find_match(table_rules['track'], target.id) is None:
+                yield target
+
+    @staticmethod
+    def _digest(table_rules):
+        """
+        Tells whether syncs skip unchanged items, which rulesets enable
+        with digest. Digests are kept in the tracker table, so the arrays
+        backend doesn't support them.
+        """
+        if Tracker.backend is not None:
+            return False
+        return table_rules.get('digest', False)
+
+    def _process_targets(self, model, table_rules, targets, policy,
+                         stream=None, columns=None, watermark=None,
+                         resumed=False):
+        pipeline = table_rules.get('pipeline')
+        batch = table_rules.get('batch')
+        if pipeline and not batch:
+            batch = Transformer.default_batch
         if 'transform' in table_rules:
+            new_targets = targets
+            if watermark and 'track' in table_rules:
+                new_targets = self._route(model, table_rules, targets, batch)
+            elif resumed:
+                new_targets = self._untracked(table_rules, targets)
             transformations = table_rules['transform']
-            transformer = Transformer(transformations, model, self.logger)
-            for target in targets:
-                item = transformer.transform(target)
-                if item:
-                    if 'track' in table_rules:
-                        Tracker.track(table_rules['track'], target, item)
+            transformer = Transformer(transformations, model, self.logger,
+                                      batch=batch,
+                                      loader=table_rules.get('loader'),
+                                      allocate=table_rules.get('allocate-ids'))
+            if pipeline:
+                pairs = self._pipelined(table_rules, new_targets,
+                                        transformer.item_values)
+                items = transformer.load_many(self._paced(pairs, policy))
+            elif transformer.batch:
+                paced = self._paced(new_targets, policy)
+                items = transformer.transform_many(paced)
+            else:
+                paced = self._paced(new_targets, policy)
+                items = self._transform(transformer, paced)
+            for target, item in items:
+                if 'track' in table_rules:
+                    Tracker.track(table_rules['track'], target, item)
 
         if 'sync' in table_rules:
+            if stream and 'transform' in table_rules:
+                targets = self.targets.get(table_rules['sources'],
+                                           stream=stream, count=False,
+                                           columns=columns,
+                                           watermark=watermark)
             sync = table_rules['sync-transform']
             match = table_rules['sync']
-            transformer = Transformer(sync, model, self.logger, match=match)
-            for target in targets:
-                transformer.sync(target)
+            transformer = Transformer(sync, model, self.logger, match=match,
+                                      batch=batch,
+                                      digest=self._digest(table_rules))
+            if pipeline:
+                pairs = self._pipelined(table_rules, targets,
+                                        transformer.sync_values)
+                paced = self._paced(pairs, policy)
+                transformer.update_many(values for target, values in paced)
+            elif transformer.batch:
+                transformer.sync_many(self._paced(targets, policy))
+            else:
+                for target in self._paced(targets, policy):
+                    transformer.sync(target)
+            self.logger.log('sync-counts', transformer.updated,
+                            transformer.skipped)
 
-    def parse(self, rules):
+    def _watermark(self, key, table_rules):
         """
-        Transforms data from a schema to another, using a given ruleset.
+        Provides the (column, after, until) window of a watermarked ruleset:
+        past the mark of the previous run and up to the current highest
+        value, so that rows written during the run are left for the next.
         """
-        for table in rules:
-            self.logger.log('parse-table', table)
-            if type(rules[table]) == list:
-                for element in rules[table]:
-                    if 'label' in element:
-                        self.logger.log('parse-ruleset', element['label'])
-                    self._process(table, element)
-                    self.interface.commit()
-                    tracker_interface.commit()
-            else:
-                self._process(table, rules[table])
-                self.interface.commit()
+        column = table_rules['watermark']
+        sources = table_rules['sources']
+        field = getattr(self.targets.source_models[sources[0]['table']],
+                        column)
+        after = Watermark.find(key, field)
+        until = self.targets.high_water(sources, column)
+        self.logger.log('watermark', key, after, until)
+        return column, after, until
+
+    def _policy(self, table_rules):
+        """
+        Provides the commit policy of a ruleset. Chunked rulesets are only
+        committed after each chunk, where their progress is recorded, and
+        untracked transforms only at their end, since a resumed run could
+        not tell their committed items apart.
+        """
+        config = table_rules.get('transaction', self.transaction)
+        if 'chunk' in table_rules:
+            return CommitPolicy()
+        if 'transform' in table_rules and 'track' not in table_rules:
+            if config.get('rows') or config.get('seconds'):
+                self.logger.log('transaction-untracked')
+            return CommitPolicy()
+        return CommitPolicy.from_config(config)
+
+    def _process(self, table, table_rules, key=None):
+        """
+        Processes a ruleset. Chunked rulesets are committed after each chunk,
+        recording their progress, and other rulesets whenever their
+        transaction policy is due. Tracked rulesets that are resumed without
+        chunks skip the targets tracked before the interruption. Pipelined
+        rulesets are streamed, so that the reader stage runs the query.
+        Watermarked rulesets only read the rows past their previous mark,
+        and record the new one.
+        """
+        model = self.receiver[table]
+        if table_rules.get('pipeline') and table_rules.get('track'):
+            transform = {'transform': table_rules.get('transform', {})}
+            if table_rules['track'] in self._match_names(transform):
+                raise ValueError('Pipelined rulesets cannot match the items '
+                                 'they track')
+        if table_rules.get('pipeline') and table_rules.get('watermark'):
+            raise ValueError('Watermarked rulesets cannot be pipelined')
+        watermark = None
+        if table_rules.get('watermark'):
+            watermark = self._watermark(key, table_rules)
+        policy = self._policy(table_rules)
+        count = table_rules.get('count', True)
+        columns = self._columns(table_rules)
+        if 'chunk' in table_rules:
+            self._preload(table_rules)
+            after = None
+            if key in self.progress:
+                after = self.progress[key].last
+                self.logger.log('resume-chunk', key, after)
+            sources = table_rules['sources']
+            primary_key = self.targets.source_models[sources[0]['table']]\
+                ._meta.primary_key.name
+            chunks = self.targets.chunks(sources, table_rules['chunk'],
+                                         count=count, columns=columns,
+                                         after=after, watermark=watermark)
+            for targets in chunks:
+                self._process_targets(model, table_rules, targets, policy,
+                                      watermark=watermark)
+                if key:
+                    Checkpoint.advance(key, getattr(targets[-1], primary_key))
+                self._commit()
+                policy.reset()
+        else:
+            stream = table_rules.get('stream')
+            if table_rules.get('pipeline') and not stream:
+                stream = True
+            targets = self.targets.get(table_rules['sources'], stream=stream,
+                                       count=count, columns=columns,
+                                       watermark=watermark)
+            self._preload(table_rules)
+            resumed = False
+            if key and 'track' in table_rules:
+                resumed = key in self.progress and watermark is None
+                Checkpoint.advance(key, None)
+            self._process_targets(model, table_rules, targets, policy,
+                                  stream=stream, columns=columns,
+                                  watermark=watermark, resumed=resumed)
+        if watermark and watermark[2] is not None:
+            Watermark.advance(key, watermark[2])
+
+    def _defer_indexes(self, table, rulesets):
+        """
+        Drops the indexes of a receiver table when any of its rulesets asks
+        to defer them. Their definitions are saved before they are dropped,
+        and indexes left dropped by an interrupted run are always taken
+        over, so that they are rebuilt at the end of the table.
+        """
+        saved = DeferredDefinitions.find(table)
+        deferring = any(table_rules.get('defer-indexes')
+                        for table_rules in rulesets)
+        if saved is None and deferring is False:
+            return None
+        deferred = DeferredIndexes(self.receiver[table])
+        deferred.inspect()
+        if saved is None:
+            with Tracker.lock:
+                DeferredDefinitions.record(table, deferred)
                 tracker_interface.commit()
+        deferred.drop()
+        if saved is not None:
+            deferred.restore(saved)
+            self.logger.log('resume-indexes', table)
+        self.logger.log('defer-indexes', len(deferred.indexes),
+                        len(deferred.foreign_keys), table)
+        return deferred
+
+    def _rebuild_indexes(self, table, deferred):
+        """
+        Rebuilds the deferred indexes of a table and forgets their saved
+        definitions, under the tracker's lock like any other tracker write.
+        """
+        started = time.monotonic()
+        deferred.rebuild()
+        with Tracker.lock:
+            DeferredDefinitions.forget(table)
+            self._commit()
+        self.logger.log('rebuild-indexes', table,
+                        time.monotonic() - started)
+
+    def _pending(self, table, rulesets):
+        """
+        Provides the rulesets of a table with their keys, skipping the ones
+        that were done in a resumed run.
+        """
+        pending = []
+        for index, table_rules in enumerate(rulesets):
+            key = Checkpoint.key(table, index, table_rules)
+            if key in self.progress and self.progress[key].done:
+                self.logger.log('resume-skip', key)
+                continue
+            pending.append((key, table_rules))
+        return pending
+
+    def _parse_table(self, rules, table):
+        self.logger.log('parse-table', table)
+        rulesets = rules[table]
+        if not isinstance(rulesets, list):
+            rulesets = [rulesets]
+        pending = self._pending(table, rulesets)
+        pending_rules = [element for key, element in pending]
+        deferred = self._defer_indexes(table, pending_rules)
+        for key, element in pending:
+            if 'label' in element:
+                self.logger.log('parse-ruleset', element['label'])
+            self._process(table, element, key=key)
+            Checkpoint.complete(key)
+            self._commit()
+        if deferred:
+            self._rebuild_indexes(table, deferred)
+
+    def _work(self, rules, table):
+        """
+        Parses a table in a worker thread, on the thread's own connections.
+        """
+        self.interface.begin()
+        tracker_interface.begin()
+        try:
+            self._parse_table(rules, table)
+        finally:
+            self.interface.release()
+            tracker_interface.release()
+
+    @staticmethod
+    def _use_wal():
+        """
+        Switches the tracker to WAL, so that workers can read it while
+        another one commits. WAL is kept afterwards, because switching back
+        can leave stale pages in the cache of other connections.
+        """
+        tracker_interface.set_pragmas('magnivore.db', {'journal_mode': 'wal'})
+        tracker_interface.pragmas['magnivore.db'].pop('journal_mode')
+
+    def _workers(self):
+        """
+        Provides the number of workers. SQLite receivers allow only one
+        writer at a time, and in-memory databases can't be shared between
+        threads, so they are always parsed by a single worker.
+        """
+        if self.workers <= 1:
+            return 1
+        name = self.interface.config['receiver']['name']
+        receiver = self.interface.databases[name]
+        if isinstance(receiver, SqliteDatabase) or \
+                self.interface.threadsafe() is False:
+            self.logger.log('workers-ignored', self.workers)
+            return 1
+        return self.workers
+
+    def parse(self, rules, resume=False):
+        """
+        Transforms data from a schema to another, using a given ruleset.
+        With several workers, independent tables are parsed at the same
+        time, and tracker matches are written only when committing. With
+        resume, the rulesets done in the previous run are skipped and
+        chunked rulesets continue after their last committed chunk.
+        """
+        if resume:
+            self.progress = Checkpoint.progress()
+        else:
+            self.progress = {}
+            Checkpoint.clear()
+        receiver_tables, donor_tables = self._tables(rules)
+        self.receiver.load(receiver_tables)
+        self.targets.source_models.load(donor_tables)
+        workers = self._workers()
+        scheduler = Scheduler(rules, self._match_names, workers=workers)
+        if workers == 1:
+            scheduler.run(lambda table: self._parse_table(rules, table))
+        else:
+            self.logger.log('parse-workers', len(rules), workers)
+            self._commit()
+            self._use_wal()
+            Tracker.autoflush = False
+            try:
+                scheduler.run(lambda table: self._work(rules, table))
+            finally:
+                Tracker.autoflush = True
+        if Tracker.cache is not None:
+            self.logger.log('tracker-cache', Tracker.cache.hits,
+                            Tracker.cache.misses)
+
+    def close(self):
+        """
+        Closes the donor and receiver, and restores the tracker's pragmas.
+        """
+        self.interface.close()
+        tracker_interface.restore_pragmas()
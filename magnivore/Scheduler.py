@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Scheduler:
+    """
+    Runs the tables of a set of rules on a pool of workers, following the
+    dependencies between them. A table depends on another when one of them
+    tracks a name that the other consumes with match or sync, and the
+    table that comes first in the rules runs first. Tables without
+    dependencies between them can run at the same time.
+
+    The names consumed by a ruleset are found with the match_names
+    function.
+    """
+
+    def __init__(self, rules, match_names, workers=1):
+        self.rules = rules
+        self.match_names = match_names
+        self.workers = workers
+
+    def _names(self, rulesets):
+        """
+        Finds the names tracked and consumed by the rulesets of a table.
+        """
+        if not isinstance(rulesets, list):
+            rulesets = [rulesets]
+        tracked = set()
+        consumed = set()
+        for table_rules in rulesets:
+            if 'track' in table_rules:
+                tracked.add(table_rules['track'])
+            consumed.update(self.match_names(table_rules))
+        return tracked, consumed
+
+    def dependencies(self):
+        """
+        Provides the tables each table waits for.
+        """
+        tables = list(self.rules)
+        names = {table: self._names(self.rules[table]) for table in tables}
+        dependencies = {table: set() for table in tables}
+        for index, table in enumerate(tables):
+            tracked, consumed = names[table]
+            for previous in tables[:index]:
+                previous_tracked, previous_consumed = names[previous]
+                if tracked & previous_consumed or consumed & previous_tracked:
+                    dependencies[table].add(previous)
+        return dependencies
+
+    def run(self, function):
+        """
+        Calls the function with each table. With a single worker, tables
+        run one after another in the calling thread. When a table fails, no
+        further tables are started and the error is raised once the running
+        ones are done.
+        """
+        if self.workers <= 1:
+            for table in self.rules:
+                function(table)
+            return
+        waiting = self.dependencies()
+        done = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while waiting or running:
+                for table in list(waiting):
+                    if waiting[table] <= done:
+                        del waiting[table]
+                        future = executor.submit(function, table)
+                        running[future] = table
+                finished, pending = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done.add(running.pop(future))
+                    if future.exception() is not None:
+                        wait(running)
+                        raise future.exception()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+
+
+class StreamCursor:
+    """
+    Wraps a database cursor so that rows are fetched in chunks of fetch_size
+    while still being read one at a time. A release callback can be given
+    to let go of a connection opened for the cursor, once it's closed.
+    """
+
+    def __init__(self, cursor, fetch_size, release=None):
+        self.cursor = cursor
+        self.fetch_size = fetch_size
+        self.release = release
+        self.rows = deque()
+
+    @property
+    def name(self):
+        return getattr(self.cursor, 'name', None)
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, sql, params=None):
+        return self.cursor.execute(sql, params or ())
+
+    def fetchone(self):
+        if not self.rows:
+            self.rows.extend(self.cursor.fetchmany(self.fetch_size))
+            if not self.rows:
+                return None
+        return self.rows.popleft()
+
+    def close(self):
+        self.cursor.close()
+        if self.release:
+            self.release()
@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
-from peewee import fn
+from uuid import uuid4
+
+from peewee import MySQLDatabase, PostgresqlDatabase, fn, mysql
+
+from .StreamCursor import StreamCursor
 
 
 class Targets:
 
+    fetch_size = 1000
+
     def __init__(self, source_models, logger):
         self.source_models = source_models
         self.logger = logger
@@ -66,6 +72,19 @@ class Targets:
             return query.join(model, 'LEFT OUTER', on=expression)
         return query.join(model, on=expression)
 
+    def _apply_watermark(self, query, sources, watermark):
+        """
+        Limits a query to the targets whose watermark column is past the
+        previous mark and up to the current one. Either bound may be None.
+        """
+        column, after, until = watermark
+        model_field = getattr(self.source_models[sources[0]['table']], column)
+        if after is not None:
+            query = query.where(model_field > after)
+        if until is not None:
+            query = query.where(model_field <= until)
+        return query
+
     def _apply_pick(self, query, source):
         model = self.source_models[source['table']]
         selects = []
@@ -76,9 +95,91 @@ class Targets:
                 selects.append(fn.Sum(getattr(model, column)))
         return query.select(*selects)
 
-    def get(self, sources, limit=None, offset=0):
+    def _cursor(self, database, fetch_size):
         """
-        Retrieves the targets for the given joins
+        Opens a cursor that doesn't load the whole result at once: a named
+        server-side cursor on Postgres and an unbuffered one on MySQL.
+
+        A MySQL connection can't run other queries until an unbuffered
+        result is read to the end, so that cursor gets a connection of its
+        own, leaving the donor's free for lazy loads, commits and
+        reconnection checks.
+        """
+        if isinstance(database, PostgresqlDatabase):
+            name = 'magnivore_{}'.format(uuid4().hex)
+            cursor = database.get_conn().cursor(name=name, withhold=True)
+            cursor.itersize = fetch_size
+        elif isinstance(database, MySQLDatabase):
+            connection = database._connect(database.database,
+                                           **database.connect_kwargs)
+            cursor = connection.cursor(mysql.cursors.SSCursor)
+
+            def release():
+                connection.rollback()
+                database._close(connection)
+            return StreamCursor(cursor, fetch_size, release=release)
+        else:
+            cursor = database.get_cursor()
+        return StreamCursor(cursor, fetch_size)
+
+    def _stream(self, query, fetch_size):
+        """
+        Iterates over the results of a query without caching them.
+        """
+        cursor = self._cursor(query.database, fetch_size)
+        try:
+            cursor.execute(*query.sql())
+            wrapper = query._get_result_wrapper()
+            meta = query.get_query_meta()
+            results = wrapper(query.model_class, cursor, meta)
+            while True:
+                try:
+                    yield results.iterate()
+                except StopIteration:
+                    return
+        finally:
+            cursor.close()
+
+    def _estimate(self, query):
+        """
+        Estimates the number of targets from the database statistics,
+        without running the query. Produces None when there is no estimate.
+        """
+        database = query.database
+        if isinstance(database, PostgresqlDatabase):
+            sql, params = query.sql()
+            cursor = database.execute_sql(
+                'EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+            return cursor.fetchone()[0][0]['Plan']['Plan Rows']
+        if isinstance(database, MySQLDatabase):
+            cursor = database.execute_sql(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                (query.model_class._meta.db_table, ))
+            return cursor.fetchone()[0]
+        return None
+
+    def _count(self, query, count):
+        """
+        Logs the number of targets, unless count is false or the count
+        would not be logged anyway. With 'estimate', a cheap estimate is
+        used where the database provides one.
+        """
+        if not count or not self.logger.enabled('get-targets-count'):
+            return
+        if count == 'estimate':
+            estimate = self._estimate(query)
+            if estimate is not None:
+                self.logger.log('get-targets-estimate', estimate)
+                return
+        self.logger.log('get-targets-count', query.count())
+
+    def query(self, sources, limit=None, offset=0, columns=None,
+              watermark=None):
+        """
+        Builds the query for the given joins, without executing it. When
+        columns are given, only those are selected. A watermark is a
+        (column, after, until) tuple on the first source.
         """
         if len(sources) == 0:
             raise ValueError
@@ -100,22 +201,91 @@ class Targets:
 
         query = models[0]
         if picks == []:
-            query = query.select(*models)
+            query = query.select(*(columns or models))
         for pick in picks:
             query = self._apply_pick(query, pick)
 
-        sources.pop(0)
-        for source in sources:
+        for source in sources[1:]:
             query = self._apply_join(query, source, models)
 
         for condition in conditions:
             query = self._apply_condition(query, condition)
 
+        if watermark:
+            query = self._apply_watermark(query, sources, watermark)
+
         for aggregation in aggregations:
             query = self._apply_aggregation(query, aggregation)
 
         if limit:
             query = query.limit(limit).offset(offset)
+        return query
+
+    def get(self, sources, limit=None, offset=0, stream=None, count=True,
+            columns=None, watermark=None):
+        """
+        Retrieves the targets for the given joins. With stream, the targets
+        are not cached and are fetched in chunks of the given size, or of
+        fetch_size when stream is True.
+        """
+        query = self.query(sources, limit=limit, offset=offset,
+                           columns=columns, watermark=watermark)
         self.logger.log('get-targets', query)
-        self.logger.log('get-targets-count', query.count())
+        self._count(query, count)
+        if stream:
+            if stream is True:
+                stream = self.fetch_size
+            return self._stream(query, stream)
         return query.execute()
+
+    def chunks(self, sources, size, count=True, columns=None, after=None,
+               watermark=None):
+        """
+        Retrieves the targets in chunks of the given size, paging by the
+        primary key of the first source instead of using offsets. With
+        after, only targets past that primary key are retrieved.
+
+        Chunks always end with all the targets of their last key, so that
+        joins that yield several targets for a key are not cut: a full
+        chunk of a join is completed with the rest of its last key, and
+        may exceed the size.
+        """
+        for source in sources:
+            if 'picks' in source or 'aggregation' in source:
+                raise ValueError
+        query = self.query(sources, columns=columns, watermark=watermark)
+        primary_key = self.source_models[sources[0]['table']]._meta\
+            .primary_key
+        self.logger.log('get-targets', query)
+        self._count(query, count)
+        last = after
+        while True:
+            chunk_query = query
+            if last is not None:
+                chunk_query = chunk_query.where(primary_key > last)
+            chunk_query = chunk_query.order_by(primary_key).limit(size)
+            chunk = list(chunk_query.execute())
+            if chunk == []:
+                return
+            full = len(chunk) == size
+            last = getattr(chunk[-1], primary_key.name)
+            if full and len(sources) > 1:
+                chunk = [target for target in chunk
+                         if getattr(target, primary_key.name) != last]
+                chunk += list(query.where(primary_key == last).execute())
+            self.logger.log('get-targets-chunk', len(chunk), last)
+            yield chunk
+            if not full:
+                return
+
+    def high_water(self, sources, column):
+        """
+        Finds the highest value of a watermark column on the first source,
+        among the targets of the given joins.
+        """
+        for source in sources:
+            if 'aggregation' in source:
+                raise ValueError
+        model_field = getattr(self.source_models[sources[0]['table']], column)
+        query = self.query(sources).select(fn.Max(model_field))
+        return query.scalar()
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
-from peewee import CharField, IntegerField, Model
+import threading
+
+from peewee import CharField, IntegerField, Model, fn
+
+from playhouse.migrate import SchemaMigrator, migrate
 
 from .Interface import Interface
+from .TrackerArrays import TrackerArrays
+from .TrackerCache import TrackerCache
 
 
 tracker_interface = Interface({})
@@ -11,26 +17,248 @@ database = tracker_interface.databases['magnivore.db']
 
 class Tracker(Model):
 
+    cache = TrackerCache()
+    backend = None
+    batch_size = 300
+    autoflush = True
+    buffers = threading.local()
+    lock = threading.RLock()
+
     class Meta:
         database = database
+        indexes = (
+            (('match', 'old'), True),
+        )
 
     match = CharField()
     old = IntegerField()
     new = IntegerField()
+    digest = CharField(null=True)
+
+    @staticmethod
+    def buffer():
+        """
+        Provides the matches buffered by the current thread, keyed by match
+        name and old id.
+        """
+        if not hasattr(Tracker.buffers, 'matches'):
+            Tracker.buffers.matches = {}
+        return Tracker.buffers.matches
+
+    @staticmethod
+    def digest_buffer():
+        """
+        Provides the digests buffered by the current thread, as (new id,
+        digest) keyed by match name and old id.
+        """
+        if not hasattr(Tracker.buffers, 'digests'):
+            Tracker.buffers.digests = {}
+        return Tracker.buffers.digests
 
     @staticmethod
     def track(match_name, old_item, new_item):
+        """
+        Tracks an item, replacing any previous match for the same old item.
+        Matches are buffered and written in batches, or only when flushed
+        without autoflush.
+        """
         item = Tracker(match=match_name, old=old_item.id, new=new_item.id)
-        item.save()
+        if Tracker.backend is not None:
+            Tracker.backend.add(match_name, item.old, item.new)
+            return item
+        buffer = Tracker.buffer()
+        buffer[(match_name, item.old)] = item.new
+        Tracker.digest_buffer().pop((match_name, item.old), None)
+        if Tracker.cache is not None:
+            Tracker.cache.set(match_name, item.old, item.new)
+        if Tracker.autoflush and len(buffer) >= Tracker.batch_size:
+            Tracker.flush()
         return item
 
+    @staticmethod
+    def sign(match_name, old_id, new_id, digest):
+        """
+        Records the digest of the values last synced to a matched item.
+        Digests are buffered like matches.
+        """
+        buffer = Tracker.digest_buffer()
+        buffer[(match_name, old_id)] = (new_id, digest)
+        if Tracker.autoflush and len(buffer) >= Tracker.batch_size:
+            Tracker.flush()
+
+    @staticmethod
+    def digests(match_name, old_ids):
+        """
+        Finds the digests of the items matched by the given old ids, keyed
+        by old id. Items that were never synced are left out.
+        """
+        buffer = Tracker.digest_buffer()
+        digests = {}
+        missing = []
+        for old_id in old_ids:
+            if (match_name, old_id) in buffer:
+                digests[old_id] = buffer[(match_name, old_id)][1]
+            else:
+                missing.append(old_id)
+        if missing:
+            query = Tracker.select(Tracker.old, Tracker.digest)\
+                .where(Tracker.match == match_name, Tracker.old << missing,
+                       Tracker.digest.is_null(False))
+            digests.update(query.tuples())
+        return digests
+
+    @staticmethod
+    def flush():
+        """
+        Writes the matches and digests buffered by the current thread, in
+        chunks of batch_size. A new match clears the digest of its item.
+        """
+        rows = {key: {'match': key[0], 'old': key[1], 'new': new_id,
+                      'digest': None}
+                for key, new_id in Tracker.buffer().items()}
+        for key, (new_id, digest) in Tracker.digest_buffer().items():
+            rows[key] = {'match': key[0], 'old': key[1], 'new': new_id,
+                         'digest': digest}
+        rows = list(rows.values())
+        Tracker.buffers.matches = {}
+        Tracker.buffers.digests = {}
+        for i in range(0, len(rows), Tracker.batch_size):
+            chunk = rows[i:i + Tracker.batch_size]
+            Tracker.insert_many(chunk).upsert().execute()
+
     @staticmethod
     def find_match(match_name, old_id):
         """
-        Finds the match for given name and old id
+        Finds the match for given name and old id, or old item. In tracker
+        tables that were not upgraded, the latest of duplicated matches is
+        used.
         """
+        if isinstance(old_id, Model):
+            old_id = old_id._get_pk_value()
+        if Tracker.backend is not None:
+            new_id = Tracker.backend.get(match_name, old_id)
+            if new_id is None:
+                return None
+            return Tracker(match=match_name, old=old_id, new=new_id)
+        new_id = Tracker.buffer().get((match_name, old_id))
+        if new_id is None and Tracker.cache is not None:
+            new_id = Tracker.cache.get(match_name, old_id)
+        if new_id is not None:
+            return Tracker(match=match_name, old=old_id, new=new_id)
+        query = Tracker.select()\
+            .where(Tracker.match == match_name, Tracker.old == old_id)\
+            .order_by(Tracker.id.desc())
         try:
-            return Tracker.get(Tracker.match == match_name,
-                               Tracker.old == old_id)
+            match = query.get()
         except Tracker.DoesNotExist:
             return None
+        if Tracker.cache is not None:
+            Tracker.cache.set(match_name, old_id, match.new)
+        return match
+
+    @staticmethod
+    def find_matches(match_name, old_ids):
+        """
+        Finds the new ids matched by the given old ids, in the same order,
+        with None for the ones without a match. The ids that are neither
+        buffered nor cached are looked up together, in chunks of
+        batch_size.
+        """
+        if Tracker.backend is not None:
+            return [Tracker.backend.get(match_name, old_id)
+                    for old_id in old_ids]
+        buffer = Tracker.buffer()
+        found = {}
+        missing = []
+        for old_id in old_ids:
+            new_id = buffer.get((match_name, old_id))
+            if new_id is None and Tracker.cache is not None:
+                new_id = Tracker.cache.get(match_name, old_id)
+            if new_id is None:
+                missing.append(old_id)
+            else:
+                found[old_id] = new_id
+        for i in range(0, len(missing), Tracker.batch_size):
+            query = Tracker.select(Tracker.old, Tracker.new)\
+                .where(Tracker.match == match_name,
+                       Tracker.old << missing[i:i + Tracker.batch_size])
+            for old_id, new_id in query.tuples():
+                found[old_id] = new_id
+                if Tracker.cache is not None:
+                    Tracker.cache.set(match_name, old_id, new_id)
+        return [found.get(old_id) for old_id in old_ids]
+
+    @staticmethod
+    def _upgrade_digest():
+        table = Tracker._meta.db_table
+        for column in database.get_columns(table):
+            if column.name == 'digest':
+                return False
+        migrator = SchemaMigrator.from_database(database)
+        migrate(migrator.add_column(table, 'digest', CharField(null=True)))
+        return True
+
+    @staticmethod
+    def _upgrade_index():
+        for index in database.get_indexes(Tracker._meta.db_table):
+            if index.columns == ['match', 'old']:
+                return False
+        latest = Tracker.select(fn.Max(Tracker.id))\
+            .group_by(Tracker.match, Tracker.old)
+        Tracker.delete().where(Tracker.id.not_in(latest)).execute()
+        database.create_index(Tracker, ['match', 'old'], unique=True)
+        return True
+
+    @staticmethod
+    def upgrade():
+        """
+        Upgrades tracker tables created by previous versions: adds the
+        digest column, and the (match, old) index, keeping only the latest
+        of duplicated matches. Tells whether anything was changed.
+        """
+        digest = Tracker._upgrade_digest()
+        index = Tracker._upgrade_index()
+        return digest or index
+
+    @staticmethod
+    def preload(match_name):
+        """
+        Loads all the matches for the given name in the cache, followed by
+        the buffered ones
+        """
+        if Tracker.cache is None or Tracker.backend is not None:
+            return
+        query = Tracker.select(Tracker.old, Tracker.new)\
+            .where(Tracker.match == match_name)\
+            .order_by(Tracker.id)
+        Tracker.cache.preload(match_name, query.tuples())
+        buffered = [(old_id, new_id) for (name, old_id), new_id in
+                    Tracker.buffer().items() if name == match_name]
+        Tracker.cache.preload(match_name, buffered)
+
+    @staticmethod
+    def use_cache(size=None):
+        """
+        Enables the matches cache with the given size. A size of 0 disables
+        it.
+        """
+        if size == 0:
+            Tracker.cache = None
+        else:
+            Tracker.cache = TrackerCache(size=size)
+
+    @staticmethod
+    def use_arrays(path=None):
+        """
+        Keeps matches in compact arrays instead of the database, saving
+        them to the given path.
+        """
+        Tracker.backend = TrackerArrays(path=path)
+
+    @staticmethod
+    def persist():
+        """
+        Persists the matches kept by the arrays backend
+        """
+        if Tracker.backend is not None:
+            Tracker.backend.save()
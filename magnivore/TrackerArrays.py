@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from urllib.parse import quote
+
+from peewee import Model
+
+
+class TrackerArrays:
+    """
+    A compact tracker storage. Each match name has a pair of old and new id
+    columns, sorted by old id, and an append buffer that is merged in when
+    it grows past buffer_size. Matches can be added and read by several
+    threads.
+
+    Columns can be saved to a directory, one file per match name, and are
+    memory-mapped from there when first needed. Each save appends the
+    matches added since the previous one to a log next to the columns file,
+    which is compacted into it once it holds as many matches.
+    """
+
+    header = array('q', [0]).itemsize
+
+    def __init__(self, path=None, buffer_size=100000):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.columns = {}
+        self.buffers = {}
+        self.unsaved = {}
+        self.logged = {}
+        self.maps = []
+        self.lock = threading.RLock()
+
+    def _filename(self, match_name):
+        return os.path.join(self.path, '{}.tracker'.format(
+            quote(match_name, safe='')))
+
+    def _logname(self, match_name):
+        return '{}-log'.format(self._filename(match_name))
+
+    def _map(self, match_name):
+        filename = self._filename(match_name)
+        if os.path.exists(filename) is False:
+            return None
+        if os.path.getsize(filename) <= self.header:
+            return None
+        with open(filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped).cast('q')
+        size = view[0]
+        columns = (view[1:size + 1], view[size + 1:size * 2 + 1])
+        self.maps.append((mapped, (view, ) + columns))
+        return columns
+
+    def _read_log(self, match_name):
+        """
+        Reads the matches logged since the last compaction, later ones
+        replacing earlier ones. A segment cut short by a crash is ignored.
+        """
+        filename = self._logname(match_name)
+        items = {}
+        self.logged[match_name] = 0
+        if os.path.exists(filename) is False:
+            return items
+        with open(filename, 'rb') as f:
+            raw = f.read()
+        data = array('q')
+        data.frombytes(raw[:len(raw) - len(raw) % data.itemsize])
+        i = 0
+        while i < len(data):
+            size = data[i]
+            end = i + size * 2 + 1
+            if end > len(data):
+                break
+            items.update(zip(data[i + 1:i + size + 1], data[i + size + 1:end]))
+            self.logged[match_name] += size
+            i = end
+        return items
+
+    def _load(self, match_name):
+        """
+        Memory-maps the saved columns of a match name, merging in the
+        logged matches.
+        """
+        if self.path is None:
+            return None
+        columns = self._map(match_name)
+        items = self._read_log(match_name)
+        if items:
+            olds, news = columns or (array('q'), array('q'))
+            columns = self._merged(olds, news, sorted(items.items()))
+        return columns
+
+    def _columns(self, match_name):
+        if match_name not in self.columns:
+            columns = self._load(match_name)
+            if columns is None:
+                return None
+            self.columns[match_name] = columns
+        return self.columns[match_name]
+
+    @staticmethod
+    def _copy(column):
+        """
+        Copies a column, which can be memory-mapped, to an array.
+        """
+        result = array('q')
+        result.frombytes(memoryview(column).cast('B'))
+        return result
+
+    def add(self, match_name, old_id, new_id):
+        """
+        Adds a match to the append buffer.
+        """
+        with self.lock:
+            buffer = self.buffers.setdefault(match_name, {})
+            buffer[old_id] = new_id
+            if self.path is not None:
+                self.unsaved.setdefault(match_name, {})[old_id] = new_id
+            if len(buffer) >= self.buffer_size:
+                self.merge(match_name)
+
+    def get(self, match_name, old_id):
+        """
+        Finds the new id for the given match name and old id, or old item,
+        or None.
+        """
+        if old_id is None:
+            return None
+        if isinstance(old_id, Model):
+            old_id = old_id._get_pk_value()
+        with self.lock:
+            buffer = self.buffers.get(match_name)
+            if buffer and old_id in buffer:
+                return buffer[old_id]
+            columns = self._columns(match_name)
+        if columns is None:
+            return None
+        olds, news = columns
+        index = bisect_left(olds, old_id)
+        if index < len(olds) and olds[index] == old_id:
+            return news[index]
+        return None
+
+    def merge(self, match_name):
+        """
+        Merges the append buffer of a match name into its sorted columns.
+        Buffered matches replace existing ones with the same old id.
+        """
+        buffer = self.buffers.pop(match_name, None)
+        if not buffer:
+            return
+        olds, news = self._columns(match_name) or (array('q'), array('q'))
+        self.columns[match_name] = self._merged(olds, news,
+                                                sorted(buffer.items()))
+
+    def _merged(self, olds, news, items):
+        """
+        Merges sorted (old, new) items into copies of the given columns.
+        """
+        if len(olds) == 0 or items[0][0] > olds[-1]:
+            merged_olds = self._copy(olds)
+            merged_news = self._copy(news)
+            merged_olds.extend(old_id for old_id, new_id in items)
+            merged_news.extend(new_id for old_id, new_id in items)
+            return merged_olds, merged_news
+
+        merged_olds = array('q')
+        merged_news = array('q')
+        i = 0
+        for old_id, new_id in items:
+            while i < len(olds) and olds[i] < old_id:
+                merged_olds.append(olds[i])
+                merged_news.append(news[i])
+                i += 1
+            if i < len(olds) and olds[i] == old_id:
+                i += 1
+            merged_olds.append(old_id)
+            merged_news.append(new_id)
+        merged_olds.extend(self._copy(olds[i:]))
+        merged_news.extend(self._copy(news[i:]))
+        return merged_olds, merged_news
+
+    def compact(self, match_name):
+        """
+        Merges the buffer of a match name and rewrites its columns file,
+        clearing its log.
+        """
+        self.merge(match_name)
+        olds, news = self.columns[match_name]
+        filename = self._filename(match_name)
+        with open('{}.tmp'.format(filename), 'wb') as f:
+            array('q', [len(olds)]).tofile(f)
+            f.write(olds)
+            f.write(news)
+        os.replace('{}.tmp'.format(filename), filename)
+        if os.path.exists(self._logname(match_name)):
+            os.remove(self._logname(match_name))
+        self.logged[match_name] = 0
+
+    def save(self):
+        """
+        Appends the matches added since the last save to the logs, as one
+        sorted segment per match name. A log holding at least as many
+        matches as its columns is compacted, so a run writes each match a
+        bounded number of times.
+        """
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            for match_name, unsaved in self.unsaved.items():
+                columns = self._columns(match_name)
+                items = sorted(unsaved.items())
+                with open(self._logname(match_name), 'ab') as f:
+                    array('q', [len(items)]).tofile(f)
+                    array('q', [old_id for old_id, new_id in items]).tofile(f)
+                    array('q', [new_id for old_id, new_id in items]).tofile(f)
+                self.logged[match_name] = self.logged.get(match_name, 0) + \
+                    len(items)
+                size = len(columns[0]) if columns else 0
+                if self.logged[match_name] >= size:
+                    self.compact(match_name)
+            self.unsaved = {}
+
+    def close(self):
+        """
+        Releases the memory-mapped files.
+        """
+        self.columns = {}
+        for mapped, views in self.maps:
+            for view in views:
+                view.release()
+            mapped.close()
+        self.maps = []
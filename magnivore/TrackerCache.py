@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import threading
+from collections import OrderedDict
+
+
+class TrackerCache:
+    """
+    A least-recently-used cache of tracker matches, keyed by match name and
+    old id. A size of None makes the cache unbounded. The cache can be
+    shared by several threads.
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, match_name, old_id):
+        """
+        Retrieves the new id for the given match name and old id, or None
+        when it's not cached.
+        """
+        key = (match_name, old_id)
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+
+    def set(self, match_name, old_id, new_id):
+        """
+        Caches a match, evicting the least recently used one when the cache
+        is full.
+        """
+        key = (match_name, old_id)
+        with self.lock:
+            self.items[key] = new_id
+            self.items.move_to_end(key)
+            if self.size is not None and len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def preload(self, match_name, rows):
+        """
+        Fills the cache with the given (old, new) rows for a match name.
+        """
+        with self.lock:
+            for old_id, new_id in rows:
+                self.set(match_name, old_id, new_id)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
@@ -1,38 +1,106 @@
 # -*- coding: utf-8 -*-
+import hashlib
+
+from peewee import PostgresqlDatabase
+
+from playhouse.shortcuts import case, cast
+
 from .Lexicon import Lexicon
+from .Loader import Loader
+from .Tracker import Tracker
 
 
 class Transformer():
 
-    def __init__(self, transformations, model, logger, match=None):
+    default_batch = 1000
+
+    def __init__(self, transformations, model, logger, match=None,
+                 batch=None, loader=None, allocate=None, digest=False):
         self.transformations = transformations
         self.model = model
         self.match = match
         self.logger = logger
+        self.batch = batch
+        self.digest = digest
+        self.updated = 0
+        self.skipped = 0
+        if (loader or allocate) and not batch:
+            self.batch = self.default_batch
+        block_size = 1000
+        if allocate and allocate is not True:
+            block_size = allocate
+        self.loader = Loader(model, loader or 'insert',
+                             allocate=bool(allocate), block_size=block_size)
+        resolved = self._resolve(transformations)
+        self.plan = self._compile(transformations, resolved)
+        self.fields = {field.name: field for field in resolved.values()}
+        self.sync_match = None
+        self.sync_matches = None
+        if match:
+            self.sync_match = Lexicon.compile_sync(match, logger)
+            self.sync_matches = Lexicon.compile_sync_many(match, logger)
+
+    def _compile_rule(self, rule):
+        if isinstance(rule, str):
+            return Lexicon.compile_basic(rule)
+        elif 'transform' in rule:
+            return Lexicon.compile_transform(rule)
+        elif 'factor' in rule:
+            return Lexicon.compile_factor(rule)
+        elif 'format' in rule:
+            return Lexicon.compile_format(rule)
+        elif 'match' in rule:
+            return Lexicon.compile_match(rule, self.logger)
+        elif 'static' in rule:
+            return Lexicon.compile_static(rule)
+        elif 'expression' in rule:
+            return Lexicon.compile_expression(rule, self.logger)
+        raise ValueError('Unknown rule: {}'.format(rule))
+
+    def _compile(self, transformations, resolved=None):
+        """
+        Compiles the transformations into a plan of (field, rule, required)
+        entries, where rule is a callable taking the target. Items are
+        discarded when a required rule produces None. Keys resolved to a
+        receiver field are planned by the field's name, so that loaders and
+        updates find them whether they were given as fields or columns.
+        """
+        plan = []
+        resolved = resolved or {}
+        if transformations:
+            for to_field, rule in transformations.items():
+                if to_field in resolved:
+                    to_field = resolved[to_field].name
+                required = isinstance(rule, dict) and 'match' in rule
+                plan.append((to_field, self._compile_rule(rule), required))
+        return plan
+
+    def _resolve(self, transformations):
+        """
+        Finds the receiver field of each transformation, by field name or
+        by column name, as items accept both. Other keys are left out.
+        """
+        if not transformations or self.model is None:
+            return {}
+        fields = self.model._meta.fields
+        columns = {field.db_column: field for field in fields.values()}
+        resolved = {}
+        for to_field in transformations:
+            if to_field in fields:
+                resolved[to_field] = fields[to_field]
+            elif to_field in columns:
+                resolved[to_field] = columns[to_field]
+        return resolved
 
     def item_values(self, target):
         """
-        Finds the values of an item using given transformations.
+        Finds the values of an item using the compiled transformations.
         """
         values = {}
-        for to_field, rule in self.transformations.items():
-            rule_type = type(rule)
-            if rule_type == str:
-                value = Lexicon.basic(rule, target)
-            elif 'transform' in rule:
-                value = Lexicon.transform(rule, target)
-            elif 'factor' in rule:
-                value = Lexicon.factor(rule, target)
-            elif 'format' in rule:
-                value = Lexicon.format(rule, target)
-            elif 'match' in rule:
-                value = Lexicon.match(rule, target, self.logger)
-                if value is None:
-                    return None
-            elif 'static' in rule:
-                value = Lexicon.static(rule, target)
-            elif 'expression' in rule:
-                value = Lexicon.expression(rule, target, self.logger)
+        for to_field, rule, required in self.plan:
+            value = rule(target)
+            if value is None and required:
+                return None
             values[to_field] = value
         return values
 
@@ -46,18 +114,166 @@ class Transformer():
             item.save()
             return item
 
+    def _write(self, pending):
+        ids = self.loader.load([values for target, values in pending])
+        primary_key = self.model._meta.primary_key.name
+        for (target, values), new_id in zip(pending, ids):
+            item = self.model(**values)
+            setattr(item, primary_key, new_id)
+            yield target, item
+
+    def transform_many(self, targets):
+        """
+        Transforms items in batches, loading each batch with the loader.
+        Yields the targets with their new items.
+        """
+        pairs = ((target, self.item_values(target)) for target in targets)
+        yield from self.load_many(pairs)
+
+    def load_many(self, pairs):
+        """
+        Loads the items of (target, values) pairs in batches, skipping the
+        ones without values. Yields the targets with their new items.
+        """
+        pending = []
+        for target, values in pairs:
+            if values:
+                pending.append((target, values))
+            if len(pending) >= self.batch:
+                yield from self._write(pending)
+                pending = []
+        if pending:
+            yield from self._write(pending)
+
     def _set_values(self, values, item):
         for to_field, value in values.items():
             setattr(item, to_field, value)
 
+    def _db_value(self, name, value):
+        if name in self.fields:
+            return self.fields[name].db_value(value)
+        return value
+
+    def hash_values(self, values):
+        """
+        Provides a compact digest of item values, as they are written to the
+        receiver, so that related items are hashed as their ids.
+        """
+        content = repr(sorted((name, self._db_value(name, value))
+                              for name, value in values.items()))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+    def _changed(self, matches):
+        """
+        Filters out the (match id, values, old id) matches whose values
+        have the same digest as the last sync, recording the digests of the
+        others. Without digests, all matches are changed.
+        """
+        if not self.digest:
+            self.updated += len(matches)
+            return matches
+        match_name = self.match['from']
+        digests = Tracker.digests(match_name,
+                                  [old_id for _, _, old_id in matches])
+        changed = []
+        for match_id, values, old_id in matches:
+            digest = self.hash_values(values)
+            if digests.get(old_id) == digest:
+                self.skipped += 1
+                continue
+            Tracker.sign(match_name, old_id, match_id, digest)
+            changed.append((match_id, values, old_id))
+        self.updated += len(changed)
+        return changed
+
     def sync(self, target):
         """
-        Synchronizes an existing item
+        Synchronizes an existing item, unless its values are unchanged
         """
-        # TODO(vesuvium): write an integration test that uses this path
-        match_id = Lexicon.sync(self.match, target, self.logger)
-        if match_id:
+        match = self.sync_values(target)
+        if match and match[1] and self._changed([match]):
+            match_id, values, old_id = match
             item = self.model.get(self.model.id == match_id)
-            self._set_values(self.item_values(target), item)
+            self._set_values(values, item)
             item.save()
             return item
+
+    def _update(self, updates):
+        """
+        Updates items with a single statement, setting each field with a
+        CASE expression on the primary key.
+        """
+        primary_key = self.model._meta.primary_key
+        database = self.model._meta.database
+        data = {}
+        for field_name in next(iter(updates.values())):
+            field = self.model._meta.fields[field_name]
+            cases = [(item_id, field.db_value(values[field_name]))
+                     for item_id, values in updates.items()]
+            expression = case(primary_key, cases)
+            if isinstance(database, PostgresqlDatabase):
+                expression = cast(expression, field.get_column_type())
+            data[field] = expression
+        query = self.model.update(data).where(primary_key << list(updates))
+        return query.execute()
+
+    def _match_values(self, target, match_id):
+        if match_id:
+            old_id = getattr(target, self.match['attribute'])
+            return match_id, self.item_values(target), old_id
+        return None
+
+    def sync_values(self, target):
+        """
+        Finds the id of the item matching a target, its new values and the
+        old id it's matched by, or None when there is no match.
+        """
+        return self._match_values(target, self.sync_match(target))
+
+    def _sync_batch(self, targets):
+        match_ids = self.sync_matches(targets)
+        return [self._match_values(target, match_id)
+                for target, match_id in zip(targets, match_ids)]
+
+    def _sync_values_many(self, targets):
+        """
+        Yields the sync values of targets, looking up the matches of each
+        batch at once.
+        """
+        pending = []
+        for target in targets:
+            pending.append(target)
+            if len(pending) >= self.batch:
+                yield from self._sync_batch(pending)
+                pending = []
+        if pending:
+            yield from self._sync_batch(pending)
+
+    def sync_many(self, targets):
+        """
+        Synchronizes existing items in batches, finding the matches of each
+        batch with a single lookup and updating it with a single statement.
+        """
+        self.update_many(self._sync_values_many(targets))
+
+    def _update_changed(self, pending):
+        updates = {match_id: values
+                   for match_id, values, old_id in self._changed(pending)}
+        if updates:
+            self._update(updates)
+
+    def update_many(self, matches):
+        """
+        Updates items from (match id, values, old id) matches in batches.
+        Matches without values, and None in place of a match, are skipped,
+        as well as unchanged values when digests are enabled.
+        """
+        pending = []
+        for match in matches:
+            if match and match[1]:
+                pending.append(match)
+            if len(pending) >= self.batch:
+                self._update_changed(pending)
+                pending = []
+        if pending:
+            self._update_changed(pending)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from peewee import CharField
+
+from .BufferedModel import BufferedModel
+
+
+class Watermark(BufferedModel):
+    """
+    Keeps the high-water mark of each watermarked ruleset: the highest
+    value of its watermark column that was migrated. Values are stored as
+    text and converted back with the donor field.
+    """
+
+    ruleset = CharField(unique=True)
+    value = CharField(null=True)
+
+    @staticmethod
+    def find(ruleset, field):
+        """
+        Finds the mark of a ruleset as a value of the given field, or None
+        when the ruleset has never run.
+        """
+        try:
+            watermark = Watermark.get(Watermark.ruleset == ruleset)
+        except Watermark.DoesNotExist:
+            return None
+        if watermark.value is None:
+            return None
+        return field.python_value(watermark.value)
+
+    @staticmethod
+    def advance(ruleset, value):
+        Watermark.buffer()[ruleset] = {'ruleset': ruleset, 'value': str(value)}
@@ -2,10 +2,13 @@
 import os
 from unittest.mock import MagicMock
 
+from magnivore.Checkpoint import Checkpoint
 from magnivore.Config import Config
+from magnivore.DeferredDefinitions import DeferredDefinitions
 from magnivore.Interface import Interface
 from magnivore.Tracker import Tracker
 from magnivore.Transformer import Transformer
+from magnivore.Watermark import Watermark
 
 from pytest import fixture
 
@@ -62,3 +65,15 @@ def parser_dependencies(mocker):
     mocker.patch.object(Config, 'get')
     mocker.patch.object(Transformer, 'transform')
     mocker.patch.object(Tracker, 'track')
+    mocker.patch.object(Tracker, 'create_table')
+    mocker.patch.object(Tracker, 'upgrade', return_value=False)
+    mocker.patch.object(Checkpoint, 'create_table')
+    mocker.patch.object(Checkpoint, 'flush')
+    mocker.patch.object(Checkpoint, 'clear')
+    mocker.patch.object(Checkpoint, 'progress', return_value={})
+    mocker.patch.object(Watermark, 'create_table')
+    mocker.patch.object(Watermark, 'flush')
+    mocker.patch.object(DeferredDefinitions, 'create_table')
+    mocker.patch.object(DeferredDefinitions, 'find', return_value=None)
+    mocker.patch.object(DeferredDefinitions, 'record')
+    mocker.patch.object(DeferredDefinitions, 'forget')
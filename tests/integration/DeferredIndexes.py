@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from magnivore.DeferredIndexes import DeferredIndexes
+
+from peewee import CharField, Model, SqliteDatabase
+
+
+def test_drop_and_rebuild(tmpdir):
+    database = SqliteDatabase(str(tmpdir.join('indexes.db')),
+                              autocommit=False)
+
+    class Items(Model):
+        name = CharField(index=True)
+
+        class Meta:
+            database = None
+
+    Items._meta.database = database
+    database.create_tables([Items])
+    database.begin()
+    deferred = DeferredIndexes(Items)
+    deferred.drop()
+    assert database.get_indexes('items') == []
+    Items.create(name='item')
+    deferred.rebuild()
+    database.commit()
+    indexes = database.get_indexes('items')
+    assert [index.columns for index in indexes] == [['name']]
+    assert database.execute_sql('PRAGMA foreign_keys').fetchone()[0] == 0
+    database.close()
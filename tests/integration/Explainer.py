@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from magnivore.Explainer import Explainer
+from magnivore.Interface import Interface
+from magnivore.Logger import Logger
+from magnivore.Targets import Targets
+
+from peewee import SqliteDatabase
+
+from pytest import fixture
+
+
+@fixture
+def explainer(tmpdir, config):
+    path = str(tmpdir.join('explain.db'))
+    database = SqliteDatabase(path)
+    database.execute_sql('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                         'username VARCHAR(255))')
+    database.execute_sql('CREATE TABLE addresses (id INTEGER PRIMARY KEY, '
+                         'city VARCHAR(255), user_id INTEGER '
+                         'REFERENCES users (id))')
+    database.execute_sql('CREATE INDEX addresses_user_id '
+                         'ON addresses (user_id)')
+    database.execute_sql('CREATE TABLE posts (id INTEGER PRIMARY KEY, '
+                         'title VARCHAR(255), editor_id INTEGER '
+                         'REFERENCES users (id))')
+    database.close()
+    config['donor']['name'] = path
+    interface = Interface(config)
+    yield Explainer(Targets(interface.donor(tables=[]), Logger()))
+    interface.close()
+
+
+def test_explain(explainer):
+    rules = {
+        'profiles': {
+            'sources': [
+                {'table': 'users', 'conditions': {'username': 'gandalf'}},
+                {'table': 'addresses', 'on': 'user'}
+            ],
+            'transform': {'name': 'username', 'city': 'addresses.city'}
+        },
+        'articles': {
+            'label': 'posts',
+            'sources': [{'table': 'posts'}],
+            'transform': {'title': 'title', 'author': {'match': 'editor'}}
+        }
+    }
+    reports = explainer.explain(rules)
+    assert [report['ruleset'] for report in reports] == ['profiles:0',
+                                                         'articles:posts']
+    assert reports[0]['missing-indexes'] == ['users.username']
+    assert reports[0]['plan'] != []
+    assert reports[0]['rows'] is None
+    assert reports[1]['missing-indexes'] == []
+    assert reports[1]['lookups-per-row'] == 1
@@ -18,3 +18,37 @@ def test_donor(config_setup, donor_teardown):
 def test_receiver(config_setup, receiver_teardown):
     interface = Interface(config_setup.get())
     assert interface.receiver() == {}
+
+
+def test_donor_schema_cache(tmpdir, config_setup):
+    database = SqliteDatabase(str(tmpdir.join('schema.db')))
+    database.execute_sql('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                         'username VARCHAR(255))')
+    database.execute_sql('CREATE TABLE addresses (id INTEGER PRIMARY KEY, '
+                         'city VARCHAR(255), user_id INTEGER '
+                         'REFERENCES users (id))')
+    database.close()
+    config = config_setup.get()
+    config['donor']['name'] = str(tmpdir.join('schema.db'))
+    config['schema'] = {'cache': True, 'path': str(tmpdir.join('cache'))}
+    models = Interface(config).donor()
+    cached = Interface(config).donor()
+    assert len(tmpdir.join('cache').listdir()) == 1
+    assert sorted(cached) == sorted(models)
+    assert sorted(cached['addresses']._meta.fields) == ['city', 'id', 'user']
+    assert cached['addresses'].user.rel_model == cached['users']
+
+
+def test_donor_tables(tmpdir, config_setup):
+    database = SqliteDatabase(str(tmpdir.join('tables.db')))
+    database.execute_sql('CREATE TABLE users (id INTEGER PRIMARY KEY)')
+    database.execute_sql('CREATE TABLE addresses (id INTEGER PRIMARY KEY, '
+                         'user_id INTEGER REFERENCES users (id))')
+    database.execute_sql('CREATE TABLE posts (id INTEGER PRIMARY KEY)')
+    database.close()
+    config = config_setup.get()
+    config['donor']['name'] = str(tmpdir.join('tables.db'))
+    models = Interface(config).donor(tables=['addresses'])
+    assert sorted(models) == ['addresses', 'users']
+    assert models['posts']._meta.db_table == 'posts'
+    assert models['addresses'].user.rel_model == models['users']
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 from magnivore.Logger import Logger
 from magnivore.RulesParser import RulesParser
+from magnivore.Tracker import Tracker, tracker_interface
+from magnivore.Watermark import Watermark
 
-from pytest import fixture
+from peewee import SqliteDatabase
+
+from pytest import fixture, mark, raises
+
+import ujson
 
 
 @fixture
@@ -75,7 +81,532 @@ def test_transform_match(logger, config_setup, donor_setup, receiver_setup,
     rules_parser.parse(rules)
     rules_parser.parse(article_rules)
     articles = receiver_setup[1].select()
-    tracks = tracker_setup.select().where(tracker_setup.match == 'editor')
-    assert articles[0].author.id == tracks[0].new
-    assert articles[1].author.id == tracks[1].new
-    assert articles[2].author.id == tracks[2].new
+    users = donor_setup[0].select()
+    tracks = tracker_setup.select()\
+        .where(tracker_setup.match == 'editor')\
+        .order_by(tracker_setup.id.desc())
+    for i in range(3):
+        track = tracks.where(tracker_setup.old == users[i].id).get()
+        assert articles[i].author.id == track.new
+
+
+def test_transform_match_workers(mocker, logger, config_setup, donor_setup,
+                                 receiver_setup, tracker_setup, rules):
+    mocker.patch.object(RulesParser, '_workers', return_value=2)
+    rules['profiles']['track'] = 'worker'
+    rules['articles'] = {
+        'sources': [
+            {'table': 'posts'}
+        ],
+        'transform': {
+            'title': 'title',
+            'author': {
+                'match': 'editor',
+                'from': 'worker'
+            }
+        }
+    }
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    rules_parser.close()
+    users = donor_setup[0].select()
+    articles = receiver_setup[1].select()\
+        .order_by(receiver_setup[1].id.desc()).limit(3)
+    articles = list(reversed(list(articles)))
+    assert len(articles) == 3
+    for user, article in zip(users, articles):
+        track = tracker_setup.get(tracker_setup.match == 'worker',
+                                  tracker_setup.old == user.id)
+        assert article.author.id == track.new
+
+
+def test_transform_pipeline(logger, config_setup, donor_setup,
+                            receiver_setup, tracker_setup, rules):
+    rules['profiles']['track'] = 'pipelined'
+    rules['profiles']['pipeline'] = 2
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    users = donor_setup[0].select()
+    for user in users:
+        track = tracker_setup.get(tracker_setup.match == 'pipelined',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+def test_transform_batch(logger, config_setup, donor_setup, receiver_setup,
+                         tracker_setup, rules):
+    rules['profiles']['track'] = 'batched'
+    rules['profiles']['batch'] = 2
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    users = donor_setup[0].select()
+    for user in users:
+        track = tracker_setup.get(tracker_setup.match == 'batched',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+@mark.parametrize('loader', ['save', 'insert', 'executemany'])
+def test_transform_loader(logger, config_setup, donor_setup, receiver_setup,
+                          tracker_setup, rules, loader):
+    rules['profiles']['track'] = 'loaded-{}'.format(loader)
+    rules['profiles']['batch'] = 2
+    rules['profiles']['loader'] = loader
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == 'loaded-{}'.format(
+            loader), tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+        assert profile.city == user.addresses_set.get().city
+
+
+@mark.parametrize('loader', ['save', 'insert'])
+def test_transform_allocate(logger, config_setup, donor_setup,
+                            receiver_setup, tracker_setup, rules, loader):
+    match_name = 'allocated-{}'.format(loader)
+    rules['profiles']['track'] = match_name
+    rules['profiles']['loader'] = loader
+    rules['profiles']['allocate-ids'] = 2
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == match_name,
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+@mark.parametrize('batch', [None, 2])
+def test_transform_chunk(logger, config_setup, donor_setup, receiver_setup,
+                         tracker_setup, rules, batch):
+    rules['profiles']['track'] = 'chunked'
+    rules['profiles']['chunk'] = 2
+    rules['profiles']['batch'] = batch
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    users = donor_setup[0].select()
+    assert users.count() == 3
+    for user in users:
+        track = tracker_setup.get(tracker_setup.match == 'chunked',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+def test_transform_resume(mocker, logger, config_setup, donor_setup,
+                          receiver_setup, tracker_setup, rules):
+    rules['profiles']['track'] = 'resumed'
+    rules['profiles']['chunk'] = 2
+    profiles = receiver_setup[0].select().count()
+    process_targets = RulesParser._process_targets
+    calls = []
+
+    def crash(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return process_targets(*args, **kwargs)
+
+    mocker.patch.object(RulesParser, '_process_targets', autospec=True,
+                        side_effect=crash)
+    crashed = RulesParser(logger, configfile='magnivore-test.json')
+    with raises(KeyboardInterrupt):
+        crashed.parse(rules)
+    crashed.close()
+    assert receiver_setup[0].select().count() == profiles + 2
+    RulesParser._process_targets.side_effect = process_targets
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules, resume=True)
+    assert receiver_setup[0].select().count() == profiles + 3
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == 'resumed',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+@mark.parametrize('chunk, committed', [(None, 2), (3, 0)])
+def test_transform_resume_transaction(mocker, logger, config_setup,
+                                      donor_setup, receiver_setup,
+                                      tracker_setup, rules, chunk, committed):
+    """
+    Items committed by the transaction policy before an interruption are
+    not inserted again when resuming, and chunks are committed whole.
+    """
+    match_name = 'resumed-transaction-{}'.format(chunk)
+    rules['profiles']['label'] = match_name
+    rules['profiles']['track'] = match_name
+    rules['profiles']['transaction'] = {'rows': 1}
+    if chunk:
+        rules['profiles']['chunk'] = chunk
+    profiles = receiver_setup[0].select().count()
+    track = Tracker.track
+    calls = []
+
+    def crash(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return track(*args)
+
+    mocker.patch.object(Tracker, 'track', side_effect=crash)
+    crashed = RulesParser(logger, configfile='magnivore-test.json')
+    with raises(KeyboardInterrupt):
+        crashed.parse(rules)
+    crashed.interface.release()
+    tracker_interface.release()
+    assert receiver_setup[0].select().count() == profiles + committed
+    Tracker.track.side_effect = track
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules, resume=True)
+    assert receiver_setup[0].select().count() == profiles + 3
+    for user in donor_setup[0].select():
+        tracked = tracker_setup.get(tracker_setup.match == match_name,
+                                    tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == tracked.new)
+        assert profile.name == user.username
+
+
+def test_transform_resume_indexes(mocker, logger, config_setup, donor_setup,
+                                  receiver_setup, tracker_setup, rules):
+    database = receiver_setup[0]._meta.database
+    database.execute_sql('CREATE INDEX profiles_name ON profiles (name)')
+    database.commit()
+    rules['profiles']['chunk'] = 2
+    rules['profiles']['defer-indexes'] = True
+    process_targets = RulesParser._process_targets
+    calls = []
+
+    def crash(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return process_targets(*args, **kwargs)
+
+    mocker.patch.object(RulesParser, '_process_targets', autospec=True,
+                        side_effect=crash)
+    crashed = RulesParser(logger, configfile='magnivore-test.json')
+    with raises(KeyboardInterrupt):
+        crashed.parse(rules)
+    crashed.close()
+    assert database.get_indexes('profiles') == []
+    RulesParser._process_targets.side_effect = process_targets
+    del rules['profiles']['defer-indexes']
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules, resume=True)
+    indexes = database.get_indexes('profiles')
+    assert [index.name for index in indexes] == ['profiles_name']
+    database.execute_sql('DROP INDEX profiles_name')
+    database.commit()
+
+
+def test_transform_resume_memory(mocker, logger, config, config_teardown,
+                                 donor_setup, tracker_setup, rules, tmpdir):
+    """
+    In-memory receivers are written to disk before the tracker is
+    committed, so a resumed run finds every tracked item.
+    """
+    name = str(tmpdir.join('memory.db'))
+    receiver = SqliteDatabase(name)
+    receiver.execute_sql('CREATE TABLE profiles (id INTEGER PRIMARY KEY, '
+                         'name VARCHAR(255), city VARCHAR(255))')
+    receiver.close()
+    config['receiver']['name'] = name
+    config['receiver']['memory'] = True
+    with open('magnivore-test.json', 'w') as f:
+        ujson.dump(config, f)
+    rules['profiles']['track'] = 'memorized'
+    rules['profiles']['chunk'] = 2
+    process_targets = RulesParser._process_targets
+    calls = []
+
+    def crash(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return process_targets(*args, **kwargs)
+
+    mocker.patch.object(RulesParser, '_process_targets', autospec=True,
+                        side_effect=crash)
+    crashed = RulesParser(logger, configfile='magnivore-test.json')
+    with raises(KeyboardInterrupt):
+        crashed.parse(rules)
+    crashed.interface.release()
+    tracked = tracker_setup.select()\
+        .where(tracker_setup.match == 'memorized').count()
+    receiver = SqliteDatabase(name)
+    rows = receiver.execute_sql('SELECT COUNT(*) FROM profiles').fetchone()
+    receiver.close()
+    assert rows[0] == tracked == 2
+    RulesParser._process_targets.side_effect = process_targets
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules, resume=True)
+    rules_parser.close()
+    receiver = SqliteDatabase(name)
+    rows = receiver.execute_sql('SELECT COUNT(*) FROM profiles').fetchone()
+    receiver.close()
+    assert rows[0] == 3
+
+
+@fixture
+def watermark_rules():
+    return {
+        'profiles': {
+            'label': 'watermarked',
+            'sources': [{'table': 'users'}],
+            'transform': {'name': 'username', 'city': 'username'},
+            'track': 'watermarked',
+            'watermark': 'id'
+        }
+    }
+
+
+def test_transform_watermark(logger, config_setup, donor_setup,
+                             receiver_setup, tracker_setup, watermark_rules):
+    profiles = receiver_setup[0].select().count()
+    RulesParser(logger, configfile='magnivore-test.json')\
+        .parse(watermark_rules)
+    assert receiver_setup[0].select().count() == profiles + 3
+    radagast = donor_setup[0].create(username='radagast')
+    try:
+        RulesParser(logger, configfile='magnivore-test.json')\
+            .parse(watermark_rules)
+        assert receiver_setup[0].select().count() == profiles + 4
+        track = tracker_setup.get(tracker_setup.match == 'watermarked',
+                                  tracker_setup.old == radagast.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == 'radagast'
+    finally:
+        radagast.delete_instance()
+
+
+@mark.parametrize('batch', [None, 2])
+def test_transform_watermark_tracked(logger, config_setup, donor_setup,
+                                     receiver_setup, tracker_setup,
+                                     watermark_rules, batch):
+    """
+    Tracked rows inside the watermark window update their items instead of
+    being inserted again.
+    """
+    watermark_rules['profiles']['label'] = 'tracked-{}'.format(batch)
+    watermark_rules['profiles']['batch'] = batch
+    RulesParser(logger, configfile='magnivore-test.json')\
+        .parse(watermark_rules)
+    profiles = receiver_setup[0].select().count()
+    gandalf = donor_setup[0].get(donor_setup[0].username == 'gandalf')
+    gandalf.username = 'mithrandir'
+    gandalf.save()
+    try:
+        Watermark.delete().execute()
+        RulesParser(logger, configfile='magnivore-test.json')\
+            .parse(watermark_rules)
+        assert receiver_setup[0].select().count() == profiles
+        track = tracker_setup.get(tracker_setup.match == 'watermarked',
+                                  tracker_setup.old == gandalf.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == 'mithrandir'
+    finally:
+        gandalf.username = 'gandalf'
+        gandalf.save()
+
+
+@mark.parametrize('chunk', [None, 2])
+def test_transform_watermark_sync(logger, config_setup, donor_setup,
+                                  receiver_setup, tracker_setup,
+                                  watermark_rules, chunk):
+    """
+    The sync section of a watermarked ruleset runs on all the targets,
+    after the new ones were inserted.
+    """
+    match_name = 'watermark-synced-{}'.format(chunk)
+    table_rules = watermark_rules['profiles']
+    table_rules['label'] = match_name
+    table_rules['track'] = match_name
+    table_rules['sync'] = {'from': match_name, 'attribute': 'id'}
+    table_rules['sync-transform'] = {'city': {'static': 'synced'}}
+    if chunk:
+        table_rules['chunk'] = chunk
+    RulesParser(logger, configfile='magnivore-test.json')\
+        .parse(watermark_rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == match_name,
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.city == 'synced'
+
+
+@mark.parametrize('batch', [None, 2])
+def test_transform_transaction(logger, config_setup, donor_setup,
+                               receiver_setup, tracker_setup, rules, batch):
+    rules['profiles']['track'] = 'committed'
+    rules['profiles']['transaction'] = {'rows': 1}
+    rules['profiles']['batch'] = batch
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == 'committed',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == user.username
+
+
+@mark.parametrize('batch', [None, 2])
+def test_sync(logger, config_setup, donor_setup, receiver_setup,
+              tracker_setup, rules, batch):
+    rules['profiles']['track'] = 'synced'
+    sync_rules = {
+        'profiles': {
+            'sources': [
+                {'table': 'users'}
+            ],
+            'sync': {
+                'from': 'synced',
+                'attribute': 'id'
+            },
+            'sync-transform': {
+                'name': {
+                    'format': 'lord {}',
+                    'from': 'username'
+                },
+                'city': {
+                    'static': 'mordor'
+                }
+            },
+            'batch': batch
+        }
+    }
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    rules_parser.parse(sync_rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == 'synced',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.name == 'lord {}'.format(user.username)
+        assert profile.city == 'mordor'
+
+
+@mark.parametrize('batch', [None, 2])
+def test_sync_digest(logger, config_setup, donor_setup, receiver_setup,
+                     tracker_setup, rules, batch):
+    """
+    Items whose synced values are unchanged are not written again, so a
+    change made in the receiver is kept until the donor changes.
+    """
+    rules['profiles']['track'] = 'digested-{}'.format(batch)
+    sync_rules = {
+        'profiles': {
+            'sources': [{'table': 'users'}],
+            'sync': {'from': 'digested-{}'.format(batch), 'attribute': 'id'},
+            'sync-transform': {'name': 'username'},
+            'batch': batch,
+            'digest': True
+        }
+    }
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    rules_parser.parse(sync_rules)
+    users = donor_setup[0].select().order_by(donor_setup[0].id)
+    match_name = rules['profiles']['track']
+    items = []
+    for user in users:
+        track = tracker_setup.get(tracker_setup.match == match_name,
+                                  tracker_setup.old == user.id)
+        assert track.digest is not None
+        items.append(track.new)
+    profiles = receiver_setup[0]
+    profiles.update(name='edited').where(profiles.id << items).execute()
+    gandalf = users[0]
+    gandalf.username = 'mithrandir'
+    gandalf.save()
+    try:
+        rules_parser.parse(sync_rules)
+        assert profiles.get(profiles.id == items[0]).name == 'mithrandir'
+        assert profiles.get(profiles.id == items[1]).name == 'edited'
+    finally:
+        gandalf.username = 'gandalf'
+        gandalf.save()
+
+
+def test_sync_pipeline(logger, config_setup, donor_setup, receiver_setup,
+                       tracker_setup, rules):
+    rules['profiles']['track'] = 'piped'
+    sync_rules = {
+        'profiles': {
+            'sources': [
+                {'table': 'users'}
+            ],
+            'sync': {
+                'from': 'piped',
+                'attribute': 'id'
+            },
+            'sync-transform': {
+                'city': {
+                    'static': 'isengard'
+                }
+            },
+            'pipeline': True
+        }
+    }
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    rules_parser.parse(sync_rules)
+    for user in donor_setup[0].select():
+        track = tracker_setup.get(tracker_setup.match == 'piped',
+                                  tracker_setup.old == user.id)
+        profile = receiver_setup[0].get(receiver_setup[0].id == track.new)
+        assert profile.city == 'isengard'
+
+
+@mark.parametrize('options', [
+    {},
+    {'batch': 2},
+    {'batch': 2, 'loader': 'executemany'},
+    {'pipeline': 2}
+])
+def test_sync_column_key(logger, config_setup, donor_setup, receiver_setup,
+                         tracker_setup, rules, options):
+    """
+    Rules can be keyed by the column of a foreign key, both when creating
+    items and when syncing them, with any loader.
+    """
+    name = '-'.join(sorted('{}{}'.format(*option)
+                           for option in options.items()))
+    authors = 'authors-{}'.format(name)
+    keyed = 'keyed-{}'.format(name)
+    rules['profiles']['track'] = authors
+    rule = {'match': 'editor', 'from': authors}
+    article_rules = {
+        'articles': {
+            'sources': [{'table': 'posts'}],
+            'transform': {'title': 'title', 'author_id': rule},
+            'track': keyed
+        }
+    }
+    article_rules['articles'].update(options)
+    sync_rules = {
+        'articles': {
+            'sources': [{'table': 'posts'}],
+            'sync': {'from': keyed, 'attribute': 'id'},
+            'sync-transform': {'title': 'editor.username', 'author_id': rule},
+            'digest': True
+        }
+    }
+    sync_rules['articles'].update(options)
+    rules_parser = RulesParser(logger, configfile='magnivore-test.json')
+    rules_parser.parse(rules)
+    rules_parser.parse(article_rules)
+    rules_parser.parse(sync_rules)
+    articles = receiver_setup[1]
+    for post in donor_setup[2].select():
+        track = tracker_setup.get(tracker_setup.match == keyed,
+                                  tracker_setup.old == post.id)
+        author = tracker_setup.get(tracker_setup.match == authors,
+                                   tracker_setup.old == post.editor_id)
+        article = articles.get(articles.id == track.new)
+        assert article.title == post.editor.username
+        assert article.author_id == author.new
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 from magnivore.Interface import Interface
 from magnivore.Logger import Logger
+from magnivore.Projection import Projection
 from magnivore.Targets import Targets
 
+from peewee import SqliteDatabase
+
 from pytest import fixture
 
 
@@ -28,3 +31,57 @@ def test_get(interface, donor_setup, receiver_setup, tracker_setup):
     assert results[1].addresses.city == 'orthanc'
     assert results[2].username == 'elrond'
     assert results[2].addresses.city == 'rivendell'
+
+
+def test_get_stream(interface, donor_setup, receiver_setup, tracker_setup):
+    targets = Targets(interface.donor(), Logger())
+    sources = [
+        {'table': 'users'},
+        {'table': 'addresses', 'on': 'user'}
+    ]
+    results = list(targets.get(sources, stream=2))
+    assert [item.username for item in results] == ['gandalf', 'saruman',
+                                                   'elrond']
+    assert results[2].addresses.city == 'rivendell'
+
+
+def test_get_columns(interface, donor_setup, receiver_setup, tracker_setup):
+    source_models = interface.donor()
+    targets = Targets(source_models, Logger())
+    sources = [
+        {'table': 'users'},
+        {'table': 'addresses', 'on': 'user'}
+    ]
+    rules = {'sources': sources, 'transform': {'city': 'addresses.city'}}
+    columns = Projection.columns(rules, source_models)
+    results = list(targets.get(sources, columns=columns))
+    assert results[0].addresses.city == 'shire'
+    assert results[0].id is not None
+    assert results[0].username is None
+
+
+def test_chunks_join(tmpdir, config):
+    path = str(tmpdir.join('chunks.db'))
+    database = SqliteDatabase(path)
+    database.execute_sql('CREATE TABLE users (id INTEGER PRIMARY KEY, '
+                         'username VARCHAR(255))')
+    database.execute_sql('CREATE TABLE posts (id INTEGER PRIMARY KEY, '
+                         'title VARCHAR(255), user_id INTEGER '
+                         'REFERENCES users (id))')
+    for user in range(1, 4):
+        database.execute_sql('INSERT INTO users (id, username) VALUES '
+                             '(?, ?)', (user, 'user{}'.format(user)))
+        for post in range(3):
+            database.execute_sql('INSERT INTO posts (title, user_id) '
+                                 'VALUES (?, ?)', ('post', user))
+    database.commit()
+    database.close()
+    config['donor']['name'] = path
+    interface = Interface(config)
+    targets = Targets(interface.donor(), Logger())
+    sources = [{'table': 'users'}, {'table': 'posts', 'on': 'user'}]
+    chunks = list(targets.chunks(sources, 2))
+    interface.close()
+    assert sum(len(chunk) for chunk in chunks) == 9
+    for chunk in chunks:
+        assert len(chunk) % 3 == 0
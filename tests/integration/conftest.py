@@ -72,8 +72,15 @@ def receiver_teardown(request):
 
 @fixture(scope='session')
 def tracker_teardown(request):
+    """
+    Removes the tracker database, along with the WAL files left by the
+    runs with workers
+    """
     def teardown():
-        os.remove('magnivore.db')
+        tracker_database.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists('magnivore.db{}'.format(suffix)):
+                os.remove('magnivore.db{}'.format(suffix))
     request.addfinalizer(teardown)
 
 
@@ -103,5 +110,5 @@ def receiver_setup(receiver_teardown):
 
 @fixture(scope='session')
 def tracker_setup(tracker_teardown):
-    tracker_database.create_tables([Tracker])
+    tracker_database.create_tables([Tracker], safe=True)
     return Tracker
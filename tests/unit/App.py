@@ -3,6 +3,7 @@ import os
 
 from magnivore.App import App
 from magnivore.Config import Config
+from magnivore.Explainer import Explainer
 from magnivore.Interface import Interface
 from magnivore.Logger import Logger
 from magnivore.RulesParser import RulesParser
@@ -38,18 +39,32 @@ def app(mocker):
     mocker.patch.object(Interface, 'donor')
     mocker.patch.object(Interface, 'receiver')
     mocker.patch.object(RulesParser, 'parse')
+    mocker.patch.object(RulesParser, 'close')
     mocker.patch.object(ujson, 'load')
     return App
 
 
 def test_run(app, default_file):
     app.run()
-    RulesParser.parse.assert_called_with(ujson.load('rules.json'))
+    RulesParser.parse.assert_called_with(ujson.load('rules.json'),
+                                         resume=False)
+
+
+def test_run_close(app, default_file):
+    app.run()
+    assert RulesParser.close.call_count == 1
 
 
 def test_run_file(app, other_file):
     app.run('rules2.json')
-    RulesParser.parse.assert_called_with(ujson.load('rules2.json'))
+    RulesParser.parse.assert_called_with(ujson.load('rules2.json'),
+                                         resume=False)
+
+
+def test_run_resume(app, default_file):
+    app.run(resume=True)
+    RulesParser.parse.assert_called_with(ujson.load('rules.json'),
+                                         resume=True)
 
 
 def test_run_file_not_found(app):
@@ -65,3 +80,41 @@ def test_run_log(mocker, app, default_file):
     mocker.patch.object(Logger, 'log')
     app.run()
     Logger.log.assert_called_with('run-verbosity', 0)
+
+
+@fixture
+def explainer(mocker, app):
+    mocker.patch.object(Interface, 'close')
+    mocker.patch.object(Explainer, 'explain', return_value=[{'rows': 1}])
+    mocker.patch.object(Explainer, 'table')
+
+
+def test_explain(app, explainer, default_file):
+    result = app.explain()
+    Explainer.explain.assert_called_with(ujson.load('rules.json'))
+    Explainer.table.assert_called_with([{'rows': 1}])
+    assert result == Explainer.table()
+    assert Interface.close.call_count == 1
+
+
+def test_explain_file(app, explainer, other_file):
+    app.explain('rules2.json')
+    Explainer.explain.assert_called_with(ujson.load('rules2.json'))
+
+
+def test_explain_donor(app, explainer, default_file):
+    app.explain()
+    Interface.donor.assert_called_with(tables=[])
+
+
+def test_explain_json(app, explainer, default_file):
+    result = app.explain(output='json')
+    assert ujson.loads(result) == [{'rows': 1}]
+    assert Explainer.table.call_count == 0
+
+
+def test_explain_close_error(app, explainer, default_file):
+    Explainer.explain.side_effect = ValueError
+    with raises(ValueError):
+        app.explain()
+    assert Interface.close.call_count == 1
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from magnivore.BufferedModel import BufferedModel
+from magnivore.Tracker import database
+
+from peewee import CharField
+
+from pytest import fixture
+
+
+class Items(BufferedModel):
+    name = CharField(unique=True)
+
+
+class Others(BufferedModel):
+    name = CharField(unique=True)
+
+
+@fixture
+def items(mocker):
+    mocker.patch.object(Items, 'insert_many')
+    mocker.patch.object(BufferedModel, 'buffers', threading.local())
+
+
+def test_buffered_model():
+    assert Items._meta.database == database
+
+
+def test_buffer(items):
+    Items.buffer()['a'] = {'name': 'a'}
+    assert Items.buffer() == {'a': {'name': 'a'}}
+    assert Others.buffer() == {}
+
+
+def test_buffer_thread(items):
+    Items.buffer()['a'] = {'name': 'a'}
+    buffers = []
+    thread = threading.Thread(target=lambda: buffers.append(Items.buffer()))
+    thread.start()
+    thread.join()
+    assert buffers == [{}]
+
+
+def test_discard(items):
+    Items.buffer()['a'] = {'name': 'a'}
+    Items.discard()
+    assert Items.buffer() == {}
+
+
+def test_flush(items):
+    Items.buffer()['a'] = {'name': 'a'}
+    Items.flush()
+    Items.insert_many.assert_called_with([{'name': 'a'}])
+    assert Items.insert_many().upsert().execute.call_count == 1
+    assert Items.buffer() == {}
+
+
+def test_flush_empty(items):
+    Items.flush()
+    assert Items.insert_many.call_count == 0
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import pickle
+from unittest.mock import MagicMock
+
+from magnivore.CachedIntrospector import CachedIntrospector
+
+from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+
+from playhouse.reflection import Introspector
+
+from pytest import fixture, mark
+
+
+@fixture
+def introspector(tmpdir):
+    database = MagicMock(spec=SqliteDatabase, database='donor.db')
+    database.execute_sql().fetchall.return_value = [('table', 'users')]
+    metadata = MagicMock(database=database)
+    return CachedIntrospector(metadata, path=str(tmpdir))
+
+
+@fixture
+def introspect(mocker):
+    return mocker.patch.object(Introspector, 'introspect',
+                               return_value={'users': 'columns'})
+
+
+def test_from_database(tmpdir):
+    database = SqliteDatabase(':memory:')
+    result = CachedIntrospector.from_database(database, path=str(tmpdir))
+    assert isinstance(result, CachedIntrospector)
+    assert result.metadata.database == database
+    assert result.path == str(tmpdir)
+
+
+@mark.parametrize('database_class, dialect', [
+    (PostgresqlDatabase, 'postgres'),
+    (MySQLDatabase, 'mysql'),
+    (SqliteDatabase, 'sqlite')
+])
+def test_queries(introspector, database_class, dialect):
+    introspector.metadata.database = MagicMock(spec=database_class)
+    assert introspector._queries() == CachedIntrospector.queries[dialect]
+
+
+def test_filename(tmpdir, introspector):
+    introspector.metadata.database.database = 'db/name'
+    result = introspector._filename()
+    assert result == str(tmpdir.join('db%2Fname.schema'))
+
+
+def test_fingerprint(introspector):
+    result = introspector.fingerprint()
+    assert len(result) == 40
+    database = introspector.metadata.database
+    database.execute_sql.assert_called_with(
+        CachedIntrospector.queries['sqlite'][0])
+
+
+def test_fingerprint_changes(introspector):
+    result = introspector.fingerprint()
+    database = introspector.metadata.database
+    database.execute_sql().fetchall.return_value = [('table', 'posts')]
+    assert introspector.fingerprint() != result
+
+
+def test_introspect(introspector, introspect):
+    result = introspector.introspect()
+    assert result == {'users': 'columns'}
+    with open(introspector._filename(), 'rb') as f:
+        fingerprint, schemas = pickle.load(f)
+    assert fingerprint == introspector.fingerprint()
+    assert schemas == {(None, False): {'users': 'columns'}}
+
+
+def test_introspect_cached(introspector, introspect):
+    introspector.introspect()
+    result = introspector.introspect()
+    assert result == {'users': 'columns'}
+    assert introspect.call_count == 1
+
+
+def test_introspect_table_names(introspector, introspect):
+    introspector.introspect()
+    introspector.introspect(table_names=['users'])
+    introspect.assert_called_with(table_names=['users'],
+                                  literal_column_names=False)
+    assert introspect.call_count == 2
+
+
+def test_introspect_fingerprint_changed(introspector, introspect):
+    introspector.introspect()
+    database = introspector.metadata.database
+    database.execute_sql().fetchall.return_value = [('table', 'posts')]
+    introspector.introspect()
+    assert introspect.call_count == 2
+
+
+def test_introspect_no_path(introspector, introspect):
+    introspector.path = None
+    introspector.introspect()
+    introspector.introspect()
+    assert introspect.call_count == 2
+    assert introspector.metadata.database.execute_sql().fetchall.call_count \
+        == 0
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from magnivore.Checkpoint import Checkpoint
+from magnivore.Tracker import database
+
+from peewee import BooleanField, CharField, IntegerField
+
+from pytest import fixture
+
+
+@fixture
+def checkpoint(mocker):
+    mocker.patch.object(Checkpoint, 'select')
+    mocker.patch.object(Checkpoint, 'insert_many')
+    mocker.patch.object(Checkpoint, 'delete')
+    mocker.patch.object(Checkpoint, 'buffers', threading.local())
+
+
+def test_checkpoint():
+    assert isinstance(Checkpoint.ruleset, CharField)
+    assert Checkpoint.ruleset.unique is True
+    assert isinstance(Checkpoint.done, BooleanField)
+    assert isinstance(Checkpoint.last, IntegerField)
+    assert Checkpoint.last.null is True
+    assert Checkpoint._meta.database == database
+
+
+def test_checkpoint_key():
+    assert Checkpoint.key('profiles', 0, {}) == 'profiles:0'
+
+
+def test_checkpoint_key_label():
+    assert Checkpoint.key('profiles', 0, {'label': 'x'}) == 'profiles:x'
+
+
+def test_checkpoint_advance(checkpoint):
+    Checkpoint.advance('profiles:0', 10)
+    Checkpoint.advance('profiles:0', 20)
+    assert Checkpoint.buffer() == {'profiles:0': {'ruleset': 'profiles:0',
+                                                  'done': False, 'last': 20}}
+
+
+def test_checkpoint_complete(checkpoint):
+    Checkpoint.advance('profiles:0', 10)
+    Checkpoint.complete('profiles:0')
+    assert Checkpoint.buffer()['profiles:0']['done'] is True
+    assert Checkpoint.buffer()['profiles:0']['last'] is None
+
+
+def test_checkpoint_flush(checkpoint):
+    Checkpoint.complete('profiles:0')
+    Checkpoint.flush()
+    rows = [{'ruleset': 'profiles:0', 'done': True, 'last': None}]
+    Checkpoint.insert_many.assert_called_with(rows)
+    assert Checkpoint.insert_many().upsert().execute.call_count == 1
+    assert Checkpoint.buffer() == {}
+
+
+def test_checkpoint_flush_empty(checkpoint):
+    Checkpoint.flush()
+    assert Checkpoint.insert_many.call_count == 0
+
+
+def test_checkpoint_progress(checkpoint):
+    item = Checkpoint(ruleset='profiles:0', done=True)
+    Checkpoint.select.return_value = [item]
+    assert Checkpoint.progress() == {'profiles:0': item}
+
+
+def test_checkpoint_clear(checkpoint):
+    Checkpoint.advance('profiles:0', 10)
+    Checkpoint.clear()
+    assert Checkpoint.delete().execute.call_count == 1
+    assert Checkpoint.buffer() == {}
@@ -2,9 +2,11 @@
 from click.testing import CliRunner
 
 from magnivore.App import App
+from magnivore.Checkpoint import Checkpoint
 from magnivore.Cli import Cli
 from magnivore.Config import Config
 from magnivore.Tracker import Tracker, database
+from magnivore.Watermark import Watermark
 
 from pytest import fixture, mark
 
@@ -35,11 +37,32 @@ def test_cli_run_verbose(app_mock, runner, verbosity):
     App.run.assert_called_with(verbosity=1)
 
 
+def test_cli_run_resume(app_mock, runner):
+    runner.invoke(Cli.run, ['--resume'])
+    App.run.assert_called_with(resume=True)
+
+
+def test_cli_explain(mocker, runner):
+    mocker.patch.object(App, 'explain', return_value='report')
+    result = runner.invoke(Cli.explain)
+    App.explain.assert_called_with()
+    assert result.output == 'report\n'
+
+
+def test_cli_explain_options(mocker, runner):
+    mocker.patch.object(App, 'explain', return_value='report')
+    runner.invoke(Cli.explain, ['magic.json', '--json'])
+    App.explain.assert_called_with(rules_file='magic.json', output='json')
+
+
 def test_cli_init(mocker, runner):
     mocker.patch.object(database, 'create_tables')
     mocker.patch.object(database, 'commit')
+    mocker.patch.object(Tracker, 'upgrade')
     runner.invoke(Cli.init)
-    database.create_tables.assert_called_with([Tracker])
+    database.create_tables.assert_called_with([Tracker, Checkpoint,
+                                               Watermark], safe=True)
+    assert Tracker.upgrade.call_count == 1
     assert database.commit.call_count == 1
 
 
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import time
+
+from magnivore.CommitPolicy import CommitPolicy
+
+
+def test_init():
+    policy = CommitPolicy(rows=10, seconds=5)
+    assert policy.rows == 10
+    assert policy.seconds == 5
+    assert policy.count == 0
+
+
+def test_from_config():
+    policy = CommitPolicy.from_config({'rows': 10, 'seconds': 5})
+    assert policy.rows == 10
+    assert policy.seconds == 5
+
+
+def test_from_config_empty():
+    policy = CommitPolicy.from_config({})
+    assert policy.rows is None
+    assert policy.seconds is None
+
+
+def test_due_never():
+    policy = CommitPolicy()
+    assert [policy.due() for i in range(3)] == [False, False, False]
+
+
+def test_due_rows():
+    policy = CommitPolicy(rows=2)
+    assert [policy.due() for i in range(3)] == [False, True, True]
+
+
+def test_due_seconds(mocker):
+    mocker.patch.object(time, 'monotonic', side_effect=[0, 1, 5])
+    policy = CommitPolicy(seconds=5)
+    assert policy.due() is False
+    assert policy.due() is True
+
+
+def test_reset(mocker):
+    mocker.patch.object(time, 'monotonic', return_value=10)
+    policy = CommitPolicy(rows=2)
+    policy.due()
+    policy.reset()
+    assert policy.count == 0
+    assert policy.started == 10
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock
+
+from magnivore.DeferredDefinitions import DeferredDefinitions
+from magnivore.Tracker import database
+
+from peewee import CharField, TextField
+
+from pytest import fixture
+
+import ujson
+
+
+@fixture
+def definitions(mocker):
+    mocker.patch.object(DeferredDefinitions, 'get')
+    mocker.patch.object(DeferredDefinitions, 'insert')
+    mocker.patch.object(DeferredDefinitions, 'delete')
+
+
+def test_deferred_definitions():
+    assert isinstance(DeferredDefinitions.table, CharField)
+    assert DeferredDefinitions.table.unique is True
+    assert isinstance(DeferredDefinitions.definitions, TextField)
+    assert DeferredDefinitions._meta.database == database
+
+
+def test_record(definitions):
+    deferred = MagicMock()
+    deferred.definitions.return_value = {'indexes': [['a', 'CREATE']],
+                                         'foreign-keys': []}
+    DeferredDefinitions.record('profiles', deferred)
+    row = DeferredDefinitions.insert.call_args[0][0]
+    assert row['table'] == 'profiles'
+    assert ujson.loads(row['definitions']) == deferred.definitions()
+    assert DeferredDefinitions.insert().upsert().execute.call_count == 1
+
+
+def test_find(definitions):
+    item = DeferredDefinitions(table='profiles',
+                               definitions='{"indexes": []}')
+    DeferredDefinitions.get.return_value = item
+    assert DeferredDefinitions.find('profiles') == {'indexes': []}
+
+
+def test_find_none(definitions):
+    DeferredDefinitions.get.side_effect = DeferredDefinitions.DoesNotExist
+    assert DeferredDefinitions.find('profiles') is None
+
+
+def test_forget(definitions):
+    DeferredDefinitions.forget('profiles')
+    expression = DeferredDefinitions.delete().where.call_args[0][0]
+    assert expression.rhs == 'profiles'
+    assert DeferredDefinitions.delete().where().execute.call_count == 1
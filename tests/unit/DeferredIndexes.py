@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock, call
+
+from magnivore.DeferredIndexes import DeferredIndexes
+
+from peewee import (ForeignKeyMetadata, IndexMetadata, MySQLDatabase,
+                    PostgresqlDatabase, SqliteDatabase)
+
+from pytest import fixture
+
+
+def model_for(database_class):
+    model = MagicMock()
+    model._meta.database = MagicMock(spec=database_class)
+    model._meta.db_table = 'profiles'
+    return model
+
+
+@fixture
+def postgres():
+    model = model_for(PostgresqlDatabase)
+    cursor = model._meta.database.execute_sql()
+    cursor.fetchall.side_effect = [
+        [('profiles_name', 'CREATE INDEX profiles_name ON profiles (name)')],
+        [('profiles_user_fkey', 'FOREIGN KEY (user_id) REFERENCES users(id)')]
+    ]
+    model._meta.database.execute_sql.reset_mock()
+    return DeferredIndexes(model)
+
+
+@fixture
+def mysql():
+    model = model_for(MySQLDatabase)
+    database = model._meta.database
+    database.get_indexes.return_value = [
+        IndexMetadata('PRIMARY', None, ['id'], True, 'profiles'),
+        IndexMetadata('profiles_name', None, ['name', 'city'], False,
+                      'profiles'),
+        IndexMetadata('profiles_user', None, ['user_id'], False, 'profiles')
+    ]
+    database.get_foreign_keys.return_value = [
+        ForeignKeyMetadata('user_id', 'users', 'id', 'profiles')
+    ]
+    database.execute_sql().fetchone.return_value = [1]
+    database.execute_sql.reset_mock()
+    return DeferredIndexes(model)
+
+
+@fixture
+def sqlite():
+    model = model_for(SqliteDatabase)
+    database = model._meta.database
+    database.get_indexes.return_value = [
+        IndexMetadata('profiles_name', 'CREATE INDEX "profiles_name"', [],
+                      False, 'profiles'),
+        IndexMetadata('sqlite_autoindex_profiles_1', None, [], True,
+                      'profiles')
+    ]
+    database.get_foreign_keys.return_value = []
+    database.execute_sql().fetchone.return_value = [1]
+    database.execute_sql.reset_mock()
+    return DeferredIndexes(model)
+
+
+def test_init(postgres):
+    assert postgres.table == 'profiles'
+    assert postgres.database == postgres.model._meta.database
+    assert postgres.indexes == []
+
+
+def test_inspect_postgres(postgres):
+    postgres.inspect()
+    assert postgres.indexes == [
+        ('profiles_name', 'CREATE INDEX profiles_name ON profiles (name)')
+    ]
+    assert len(postgres.foreign_keys) == 1
+    assert postgres.inspected is True
+    assert postgres.database.execute_sql.call_count == 2
+
+
+def test_drop_inspected(postgres):
+    postgres.inspect()
+    postgres.drop()
+    execute = postgres.database.execute_sql
+    assert execute.call_count == 4
+    execute.assert_called_with('DROP INDEX "profiles_name"')
+
+
+def test_restore(sqlite):
+    sqlite.restore({'indexes': [['profiles_name', 'CREATE INDEX x']],
+                    'foreign-keys': []})
+    assert sqlite.indexes == [('profiles_name', 'CREATE INDEX x')]
+    assert sqlite.definitions() == {'indexes': sqlite.indexes,
+                                    'foreign-keys': []}
+
+
+def test_drop_postgres(postgres):
+    postgres.drop()
+    execute = postgres.database.execute_sql
+    execute.assert_any_call('ALTER TABLE "profiles" DROP CONSTRAINT '
+                            '"profiles_user_fkey"')
+    execute.assert_called_with('DROP INDEX "profiles_name"')
+    assert len(postgres.indexes) == 1
+    assert len(postgres.foreign_keys) == 1
+
+
+def test_rebuild_postgres(postgres):
+    postgres.drop()
+    postgres.rebuild()
+    execute = postgres.database.execute_sql
+    execute.assert_any_call('CREATE INDEX profiles_name ON profiles (name)')
+    execute.assert_called_with('ALTER TABLE "profiles" ADD CONSTRAINT '
+                               '"profiles_user_fkey" FOREIGN KEY (user_id) '
+                               'REFERENCES users(id)')
+    assert postgres.indexes == []
+
+
+def test_drop_mysql(mysql):
+    mysql.drop()
+    assert mysql.indexes == [
+        ('profiles_name',
+         'CREATE INDEX `profiles_name` ON `profiles` (`name`, `city`)')
+    ]
+    execute = mysql.database.execute_sql
+    execute.assert_any_call('SET foreign_key_checks = 0')
+    execute.assert_called_with('DROP INDEX `profiles_name` ON `profiles`')
+    assert mysql.settings == {'foreign_key_checks': 1}
+
+
+def test_rebuild_mysql(mysql):
+    mysql.drop()
+    mysql.rebuild()
+    execute = mysql.database.execute_sql
+    execute.assert_any_call('CREATE INDEX `profiles_name` ON `profiles` '
+                            '(`name`, `city`)')
+    execute.assert_called_with('SET foreign_key_checks = 1')
+
+
+def test_drop_sqlite(sqlite):
+    sqlite.drop()
+    assert sqlite.indexes == [
+        ('profiles_name', 'CREATE INDEX "profiles_name"')
+    ]
+    execute = sqlite.database.execute_sql
+    assert execute.call_args_list == [
+        call('PRAGMA foreign_keys'),
+        call('PRAGMA foreign_keys = 0'),
+        call('DROP INDEX "profiles_name"')
+    ]
+    assert sqlite.database.commit.call_count == 1
+
+
+def test_rebuild_sqlite(sqlite):
+    sqlite.drop()
+    sqlite.rebuild()
+    execute = sqlite.database.execute_sql
+    execute.assert_any_call('CREATE INDEX "profiles_name"')
+    execute.assert_called_with('PRAGMA foreign_keys = 1')
+    assert sqlite.inspected is False
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock
+
+from magnivore.Explainer import Explainer
+from magnivore.Projection import Projection
+
+from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+
+from pytest import fixture
+
+
+@fixture
+def nodes():
+    nodes = MagicMock()
+    nodes._meta.db_table = 'nodes'
+    return nodes
+
+
+@fixture
+def points():
+    points = MagicMock()
+    points._meta.db_table = 'points'
+    return points
+
+
+@fixture
+def explainer(nodes, points):
+    targets = MagicMock()
+    targets.source_models = {'nodes': nodes, 'points': points}
+    return Explainer(targets)
+
+
+@fixture
+def table_rules():
+    return {
+        'sources': [
+            {'table': 'nodes', 'conditions': {'kind': 'a'}},
+            {'table': 'points', 'on': ['id', 'node']}
+        ],
+        'transform': {'name': 'name', 'owner': {'match': 'users'}}
+    }
+
+
+@fixture
+def report():
+    return {'ruleset': 'profiles:0', 'rows': 10, 'tracker-lookups': 20,
+            'lookups-per-row': 2, 'missing-indexes': ['nodes.kind'],
+            'plan': ['SCAN nodes']}
+
+
+def test_explainer_init():
+    explainer = Explainer('targets')
+    assert explainer.targets == 'targets'
+    assert explainer.indexes == {}
+
+
+def test_explainer_explain_postgres(explainer):
+    query = MagicMock(database=MagicMock(spec=PostgresqlDatabase))
+    query.sql.return_value = ('SELECT', [1])
+    plan = {'Node Type': 'Hash Join', 'Plan Rows': 42, 'Plans': [
+        {'Node Type': 'Seq Scan', 'Relation Name': 'nodes', 'Plan Rows': 40}
+    ]}
+    query.database.execute_sql().fetchone.return_value = [[{'Plan': plan}]]
+    rows, lines = explainer._explain(query)
+    query.database.execute_sql.assert_called_with(
+        'EXPLAIN (FORMAT JSON) SELECT', [1])
+    assert rows == 42
+    assert lines == ['Hash Join (rows=42)', '  Seq Scan on nodes (rows=40)']
+
+
+def test_explainer_explain_mysql(explainer):
+    query = MagicMock(database=MagicMock(spec=MySQLDatabase))
+    query.sql.return_value = ('SELECT', [1])
+    cursor = query.database.execute_sql()
+    cursor.description = [('table', ), ('type', ), ('key', ), ('rows', )]
+    cursor.fetchall.return_value = [('nodes', 'ALL', None, 40),
+                                    ('points', 'ref', 'node', 2)]
+    rows, lines = explainer._explain(query)
+    query.database.execute_sql.assert_called_with('EXPLAIN SELECT', [1])
+    assert rows == 80
+    assert lines == ['nodes: ALL key=None (rows=40)',
+                     'points: ref key=node (rows=2)']
+
+
+def test_explainer_explain_sqlite(explainer):
+    query = MagicMock(database=MagicMock(spec=SqliteDatabase))
+    query.sql.return_value = ('SELECT', [1])
+    cursor = query.database.execute_sql()
+    cursor.fetchall.return_value = [(2, 0, 0, 'SCAN nodes')]
+    assert explainer._explain(query) == (None, ['SCAN nodes'])
+    query.database.execute_sql.assert_called_with(
+        'EXPLAIN QUERY PLAN SELECT', [1])
+
+
+def test_explainer_indexed(explainer, nodes):
+    database = nodes._meta.database
+    database.get_primary_keys.return_value = ['id']
+    database.get_indexes.return_value = [MagicMock(columns=['kind', 'x'])]
+    assert explainer._indexed(nodes) == {'id', 'kind'}
+    explainer._indexed(nodes)
+    assert database.get_indexes.call_count == 1
+
+
+def test_explainer_filtered(explainer, nodes, points, table_rules):
+    result = explainer._filtered(table_rules)
+    assert result == [(nodes, 'kind'), (nodes, 'id'), (points, 'node')]
+
+
+def test_explainer_filtered_on(explainer, points, table_rules):
+    table_rules['sources'][1]['on'] = 'node'
+    assert (points, 'node') in explainer._filtered(table_rules)
+
+
+def test_explainer_filtered_switch(explainer, nodes, points):
+    table_rules = {'sources': [{'table': 'nodes'},
+                               {'table': 'points', 'on': ['id', 'node']},
+                               {'table': 'nodes', 'on': ['id', 'parent'],
+                                'switch': True}]}
+    result = explainer._filtered(table_rules)
+    assert result[2] == (nodes, 'id')
+
+
+def test_explainer_filtered_watermark(explainer, nodes, table_rules):
+    table_rules['watermark'] = 'updated'
+    assert explainer._filtered(table_rules)[-1] == (nodes, 'updated')
+
+
+def test_explainer_missing_indexes(explainer, nodes, points, table_rules):
+    nodes.kind.db_column = 'kind'
+    nodes.id.db_column = 'id'
+    points.node.db_column = 'node'
+    explainer.indexes = {'nodes': {'id'}, 'points': set()}
+    result = explainer._missing_indexes(table_rules)
+    assert result == ['nodes.kind', 'points.node']
+
+
+def test_explainer_lookups(table_rules):
+    assert Explainer._lookups(table_rules) == 1
+
+
+def test_explainer_lookups_sync(table_rules):
+    table_rules['sync'] = {'from': 'users', 'attribute': 'id'}
+    table_rules['sync-transform'] = {'editor': {'match': 'editors'}}
+    assert Explainer._lookups(table_rules) == 3
+
+
+def test_explainer_lookups_watermark(table_rules):
+    table_rules['watermark'] = 'updated'
+    table_rules['track'] = 'profiles'
+    assert Explainer._lookups(table_rules) == 2
+
+
+def test_explainer_ruleset(mocker, explainer, table_rules):
+    mocker.patch.object(Projection, 'columns')
+    mocker.patch.object(Explainer, '_explain', return_value=(10, ['plan']))
+    mocker.patch.object(Explainer, '_missing_indexes',
+                        return_value=['nodes.kind'])
+    result = explainer.ruleset('profiles:0', table_rules)
+    explainer.targets.query.assert_called_with(table_rules['sources'],
+                                               columns=Projection.columns())
+    Explainer._explain.assert_called_with(explainer.targets.query())
+    assert result == {'ruleset': 'profiles:0', 'rows': 10,
+                      'tracker-lookups': 10, 'lookups-per-row': 1,
+                      'missing-indexes': ['nodes.kind'], 'plan': ['plan']}
+
+
+def test_explainer_ruleset_projection(mocker, explainer, table_rules):
+    mocker.patch.object(Explainer, '_explain', return_value=(None, []))
+    mocker.patch.object(Explainer, '_missing_indexes', return_value=[])
+    table_rules['projection'] = False
+    result = explainer.ruleset('profiles:0', table_rules)
+    explainer.targets.query.assert_called_with(table_rules['sources'],
+                                               columns=None)
+    assert result['tracker-lookups'] is None
+
+
+def test_explainer_explain(mocker, explainer, table_rules):
+    mocker.patch.object(Explainer, 'ruleset')
+    explainer.targets.source_models = MagicMock()
+    rules = {'profiles': [table_rules, {'label': 'x', 'sources': []}],
+             'articles': {'sources': [{'table': 'posts'}]}}
+    result = explainer.explain(rules)
+    explainer.targets.source_models.load.assert_called_with(
+        {'nodes', 'points', 'posts'})
+    keys = [call[0][0] for call in Explainer.ruleset.call_args_list]
+    assert keys == ['profiles:0', 'profiles:x', 'articles:0']
+    assert result == [Explainer.ruleset()] * 3
+
+
+def test_explainer_table(report):
+    result = Explainer.table([report])
+    assert result.split('\n') == [
+        'ruleset     rows  tracker-lookups  missing-indexes',
+        'profiles:0  10    20               nodes.kind'
+    ]
+
+
+def test_explainer_table_unknown(report):
+    report['rows'] = None
+    report['missing-indexes'] = []
+    line = Explainer.table([report]).split('\n')[1]
+    assert line.split() == ['profiles:0', '?', '20', '-']
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock
+
+from magnivore.IdAllocator import IdAllocator
+
+from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+
+from pytest import fixture, mark
+
+
+@fixture
+def model():
+    model = MagicMock()
+    model._meta.primary_key.db_column = 'id'
+    model._meta.db_table = 'items'
+    model._meta.database = MagicMock(spec=SqliteDatabase)
+    return model
+
+
+@fixture
+def allocator(model):
+    return IdAllocator(model, block_size=3)
+
+
+def test_init(model):
+    allocator = IdAllocator(model)
+    assert allocator.model == model
+    assert allocator.block_size == 1000
+    assert len(allocator.ids) == 0
+
+
+def test_reserve_postgres(allocator, model):
+    database = MagicMock(spec=PostgresqlDatabase)
+    database.execute_sql().fetchall.return_value = [(4, ), (5, )]
+    model._meta.database = database
+    assert allocator.reserve(2) == [4, 5]
+    args = database.execute_sql.call_args[0]
+    assert args[1] == ('items', 'id', 2)
+
+
+def test_reserve_mysql(allocator, model):
+    database = MagicMock(spec=MySQLDatabase)
+    database.execute_sql().fetchone.return_value = [7]
+    model._meta.database = database
+    assert allocator.reserve(2) == [8, 9]
+    database.execute_sql.assert_called_with(
+        'SELECT MAX(`id`) FROM `items` FOR UPDATE')
+
+
+@mark.parametrize('highest, ids', [(None, [1, 2]), (7, [8, 9])])
+def test_reserve_sqlite(allocator, model, highest, ids):
+    model.select().scalar.return_value = highest
+    assert allocator.reserve(2) == ids
+
+
+def test_reserve_after_reserved(allocator, model):
+    model.select().scalar.return_value = 7
+    allocator.reserve(2)
+    assert allocator.reserve(2) == [10, 11]
+
+
+def test_allocate(mocker, allocator):
+    mocker.patch.object(IdAllocator, 'reserve', return_value=[1, 2, 3])
+    assert allocator.allocate(2) == [1, 2]
+    assert allocator.allocate(1) == [3]
+    IdAllocator.reserve.assert_called_once_with(3)
+
+
+def test_allocate_more_than_block(mocker, allocator):
+    mocker.patch.object(IdAllocator, 'reserve', return_value=[1, 2, 3, 4])
+    assert allocator.allocate(4) == [1, 2, 3, 4]
+    IdAllocator.reserve.assert_called_with(4)
+
+
+def test_allocate_new_block(mocker, allocator):
+    mocker.patch.object(IdAllocator, 'reserve')
+    IdAllocator.reserve.side_effect = [[1, 2, 3], [4, 5, 6]]
+    allocator.allocate(2)
+    assert allocator.allocate(2) == [3, 4]
+    IdAllocator.reserve.assert_called_with(3)
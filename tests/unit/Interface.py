@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
+import os
+import sqlite3
 from unittest.mock import MagicMock
 
+from magnivore.CachedIntrospector import CachedIntrospector
 from magnivore.Interface import Interface
+from magnivore.Models import Models
 
-from peewee import MySQLDatabase, PostgresqlDatabase, SqliteDatabase
+from peewee import (MySQLDatabase, OperationalError, PostgresqlDatabase,
+                    SqliteDatabase)
 
-from playhouse.reflection import Introspector
+from playhouse.pool import PooledMySQLDatabase, PooledPostgresqlDatabase
 
 from pytest import fixture, mark
 
@@ -27,6 +32,20 @@ def test_create_database(interface, name, db_type, instance):
     assert database.autocommit is False
 
 
+@mark.parametrize('db_type, instance', [
+    ('postgres', PooledPostgresqlDatabase),
+    ('mysql', PooledMySQLDatabase)
+])
+def test_create_database_pool(interface, db_type, instance):
+    pool = {'max_connections': 4, 'stale_timeout': 300}
+    interface.create_database('magnivore', db_type, {}, pool=pool)
+    database = interface.databases['magnivore']
+    assert isinstance(database, instance)
+    assert database.max_connections == 4
+    assert database.stale_timeout == 300
+    assert database.autocommit is False
+
+
 def test_create_database_sqlite(interface):
     interface.create_database('magnivore')
     database = interface.databases['magnivore']
@@ -49,6 +68,34 @@ def test_commit(interface):
     assert interface.databases['test'].begin.call_count == 1
 
 
+def test_begin(interface):
+    interface.databases['test'] = MagicMock()
+    interface.begin()
+    assert interface.databases['test'].begin.call_count == 1
+    assert interface.databases['test'].commit.call_count == 0
+
+
+def test_release(interface):
+    interface.databases['test'] = MagicMock()
+    interface.databases['test'].is_closed.return_value = False
+    interface.release()
+    assert interface.databases['test'].commit.call_count == 0
+    assert interface.databases['test'].close.call_count == 1
+
+
+def test_release_closed(interface):
+    interface.databases['test'] = MagicMock()
+    interface.databases['test'].is_closed.return_value = True
+    interface.release()
+    assert interface.databases['test'].close.call_count == 0
+
+
+def test_threadsafe(interface):
+    assert interface.threadsafe() is True
+    interface.memory.add('test')
+    assert interface.threadsafe() is False
+
+
 def test_string_special(interface):
     interface.id = None
     assert interface.string_special() == 'Interface:None'
@@ -56,9 +103,10 @@ def test_string_special(interface):
 
 @mark.parametrize('method', ['donor', 'receiver'])
 def test_donor_and_receiver_result(mocker, method, config, interface):
-    mocker.patch.object(Introspector, 'from_database')
+    mocker.patch.object(CachedIntrospector, 'from_database')
     model = type('model', (object,), {})
-    Introspector.from_database().generate_models.return_value = {'m': model}
+    introspector = CachedIntrospector.from_database()
+    introspector.generate_models.return_value = {'m': model}
     result = getattr(interface, method)()
     assert result == {'m': model}
     assert model.__str__ == Interface.string_special
@@ -72,4 +120,203 @@ def test_donor_and_receiver_db(mocker, method, config, interface):
     db_config = config[method]
     Interface.create_database.assert_called_with(db_config['name'],
                                                  db_type=db_config['type'],
-                                                 auth=db_config['auth'])
+                                                 auth=db_config['auth'],
+                                                 pool=None, memory=False)
+
+
+def test_schema_path(interface):
+    interface.config['schema'] = {'cache': True, 'path': 'schemas'}
+    assert interface._schema_path() == 'schemas'
+
+
+def test_schema_path_default(interface):
+    interface.config['schema'] = {'cache': True}
+    assert interface._schema_path() == 'magnivore-schema'
+
+
+def test_schema_path_disabled(interface):
+    interface.config['schema'] = {'cache': False}
+    assert interface._schema_path() is None
+
+
+def test_schema_path_missing(interface):
+    assert interface._schema_path() is None
+
+
+def test_generate_models_schema_path(mocker, config, interface):
+    mocker.patch.object(CachedIntrospector, 'from_database')
+    mocker.patch.object(Interface, '_schema_path', return_value='schemas')
+    CachedIntrospector.from_database().generate_models.return_value = {}
+    interface.donor()
+    database = interface.databases[config['donor']['name']]
+    CachedIntrospector.from_database.assert_called_with(database,
+                                                        path='schemas')
+
+
+@mark.parametrize('method', ['donor', 'receiver'])
+def test_donor_and_receiver_tables(mocker, method, interface):
+    mocker.patch.object(CachedIntrospector, 'from_database')
+    introspector = CachedIntrospector.from_database()
+    introspector.metadata.get_foreign_keys.return_value = []
+    result = getattr(interface, method)(tables=['users'])
+    introspector.generate_models.assert_called_with(table_names={'users'})
+    assert isinstance(result, Models)
+
+
+def test_donor_pool(mocker, config, interface):
+    mocker.patch.object(Interface, 'create_database')
+    mocker.patch.object(CachedIntrospector, 'from_database')
+    config['donor']['pool'] = {'max_connections': 4}
+    interface.databases = {'donor.db': MagicMock()}
+    interface.donor()
+    args = Interface.create_database.call_args[1]
+    assert args['pool'] == {'max_connections': 4}
+
+
+def test_reconnect(interface):
+    database = MagicMock()
+    interface.databases['test'] = database
+    assert interface.reconnect() == []
+    database.execute_sql.assert_called_with('SELECT 1')
+    assert database.connect.call_count == 0
+
+
+def test_reconnect_dropped(interface):
+    database = MagicMock()
+    database.execute_sql.side_effect = OperationalError
+    interface.databases['test'] = database
+    assert interface.reconnect() == ['test']
+    assert database.close.call_count == 1
+    assert database.connect.call_count == 1
+    assert database.begin.call_count == 1
+
+
+def test_reconnect_close_fails(interface):
+    database = MagicMock()
+    database.execute_sql.side_effect = OperationalError
+    database.close.side_effect = OperationalError
+    interface.databases['test'] = database
+    assert interface.reconnect() == ['test']
+    assert database.connect.call_count == 1
+
+
+def test_reconnect_pooled(interface):
+    database = MagicMock(spec=PooledPostgresqlDatabase)
+    database.execute_sql.side_effect = OperationalError
+    interface.databases['test'] = database
+    interface.reconnect()
+    assert database.manual_close.call_count == 1
+    assert database.close.call_count == 0
+
+
+@fixture
+def sqlite_database(mocker):
+    database = MagicMock(spec=SqliteDatabase)
+    database.execute_sql().fetchone.return_value = ['delete']
+    database.execute_sql.reset_mock()
+    return database
+
+
+def test_set_pragmas(interface, sqlite_database):
+    interface.databases['test'] = sqlite_database
+    interface.set_pragmas('test', {'journal_mode': 'memory'})
+    sqlite_database.execute_sql.assert_any_call('PRAGMA journal_mode')
+    sqlite_database.execute_sql.assert_called_with(
+        'PRAGMA journal_mode = memory')
+    assert interface.pragmas == {'test': {'journal_mode': 'delete'}}
+    assert sqlite_database.commit.call_count == 1
+    assert sqlite_database.begin.call_count == 1
+
+
+def test_set_pragmas_bulk(interface, sqlite_database):
+    interface.databases['test'] = sqlite_database
+    interface.set_pragmas('test', 'bulk')
+    assert sorted(interface.pragmas['test']) == sorted(Interface.bulk_pragmas)
+
+
+def test_set_pragmas_keeps_original(interface, sqlite_database):
+    interface.databases['test'] = sqlite_database
+    interface.set_pragmas('test', {'journal_mode': 'memory'})
+    sqlite_database.execute_sql().fetchone.return_value = ['memory']
+    interface.set_pragmas('test', {'journal_mode': 'off'})
+    assert interface.pragmas == {'test': {'journal_mode': 'delete'}}
+
+
+def test_set_pragmas_not_sqlite(interface):
+    database = MagicMock(spec=PostgresqlDatabase)
+    interface.databases['test'] = database
+    interface.set_pragmas('test', 'bulk')
+    assert database.execute_sql.call_count == 0
+    assert interface.pragmas == {}
+
+
+def test_restore_pragmas(interface, sqlite_database):
+    interface.databases['test'] = sqlite_database
+    interface.pragmas = {'test': {'journal_mode': 'delete'}}
+    interface.restore_pragmas()
+    sqlite_database.execute_sql.assert_called_with(
+        'PRAGMA journal_mode = delete')
+    assert interface.pragmas == {}
+
+
+def test_donor_pragmas(mocker, config, interface):
+    mocker.patch.object(Interface, 'create_database')
+    mocker.patch.object(Interface, 'set_pragmas')
+    mocker.patch.object(CachedIntrospector, 'from_database')
+    config['donor']['pragmas'] = 'bulk'
+    interface.databases = {'donor.db': MagicMock()}
+    interface.donor()
+    Interface.set_pragmas.assert_called_with('donor.db', 'bulk')
+
+
+def test_close(mocker, interface):
+    mocker.patch.object(Interface, 'restore_pragmas')
+    database = MagicMock()
+    interface.databases['test'] = database
+    interface.close()
+    assert Interface.restore_pragmas.call_count == 1
+    assert database.commit.call_count == 1
+    assert database.close.call_count == 1
+
+
+def test_create_database_memory(tmpdir):
+    name = str(tmpdir.join('memory.db'))
+    disk = SqliteDatabase(name)
+    disk.execute_sql('CREATE TABLE items (id INTEGER PRIMARY KEY)')
+    disk.close()
+    interface = Interface({})
+    interface.create_database(name, memory=True)
+    database = interface.databases[name]
+    assert database.database == ':memory:'
+    assert database.get_tables() == ['items']
+    database.execute_sql('INSERT INTO items (id) VALUES (1)')
+    interface.close()
+    disk = SqliteDatabase(name)
+    assert disk.execute_sql('SELECT id FROM items').fetchall() == [(1, )]
+    disk.close()
+
+
+def test_commit_memory(tmpdir):
+    name = str(tmpdir.join('memory.db'))
+    SqliteDatabase(name).execute_sql('CREATE TABLE items (id INTEGER)')
+    interface = Interface({})
+    interface.create_database(name, memory=True)
+    interface.databases[name].execute_sql('INSERT INTO items VALUES (1)')
+    interface.commit()
+    disk = SqliteDatabase(name)
+    assert disk.execute_sql('SELECT id FROM items').fetchall() == [(1, )]
+    disk.close()
+    assert os.path.exists('{}.tmp'.format(name)) is False
+    interface.close()
+
+
+def test_copy_dump():
+    source = sqlite3.connect(':memory:')
+    source.execute('CREATE TABLE items (id INTEGER)')
+    source.execute('INSERT INTO items VALUES (1)')
+    source.commit()
+    dump = MagicMock(spec=['iterdump'])
+    dump.iterdump.side_effect = source.iterdump
+    target = sqlite3.connect(':memory:')
+    Interface._copy(dump, target)
+    assert target.execute('SELECT id FROM items').fetchall() == [(1, )]
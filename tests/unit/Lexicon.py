@@ -6,9 +6,21 @@ from unittest.mock import MagicMock
 from magnivore.Lexicon import Lexicon
 from magnivore.Tracker import Tracker
 
+from peewee import CharField, ForeignKeyField, Model
+
 from pytest import mark
 
 
+class Users(Model):
+    username = CharField(unique=True)
+
+
+class Posts(Model):
+    editor = ForeignKeyField(Users)
+    reviewer = ForeignKeyField(Users, to_field=Users.username,
+                               related_name='reviews')
+
+
 def test_lexicon_basic():
     target = MagicMock()
     result = Lexicon.basic('field', target)
@@ -210,14 +222,15 @@ def test_lexicon_expression(logger):
 
 
 def test_lexicon_expression_dot(mocker, logger):
-    mocker.patch.object(re, 'findall')
+    mocker.patch.object(re, 'compile')
     rule = {
         'expression': '(?<=\s).*',
         'from': 'user.email'
     }
     target = MagicMock(email='clutter email@provider.com')
     Lexicon.expression(rule, target, logger)
-    re.findall.assert_called_with(rule['expression'], target.user.email)
+    re.compile.assert_called_with(rule['expression'])
+    re.compile().findall.assert_called_with(target.user.email)
 
 
 def test_lexicon_expression_none(logger):
@@ -229,3 +242,71 @@ def test_lexicon_expression_none(logger):
     result = Lexicon.expression(rule, target, logger)
     logger.log.assert_called_with('expression-notfound', rule, target)
     assert result is None
+
+
+def test_lexicon_dot_getter_cached():
+    assert Lexicon._dot_getter('a.b') is Lexicon._dot_getter('a.b')
+
+
+@mark.parametrize('rule, expected', [
+    ('value', [1, 2]),
+    ({'from': 'value', 'factor': 2}, [2, 4]),
+    ({'from': 'value', 'format': '<{}>'}, ['<1>', '<2>'])
+])
+def test_lexicon_compiled_reuse(rule, expected):
+    targets = [MagicMock(value=1), MagicMock(value=2)]
+    if isinstance(rule, str):
+        compiled = Lexicon.compile_basic(rule)
+    elif 'factor' in rule:
+        compiled = Lexicon.compile_factor(rule)
+    else:
+        compiled = Lexicon.compile_format(rule)
+    assert [compiled(target) for target in targets] == expected
+
+
+def test_lexicon_compile_match(mocker, logger):
+    mocker.patch.object(Tracker, 'find_match')
+    compiled = Lexicon.compile_match({'match': 'editor'}, logger)
+    target = MagicMock()
+    result = compiled(target)
+    Tracker.find_match.assert_called_with('editor', target.editor)
+    assert result == Tracker.find_match().new
+
+
+def test_lexicon_match_foreign_key(mocker, logger):
+    mocker.patch.object(Tracker, 'find_match')
+    mocker.patch.object(Users, 'get')
+    Lexicon.match({'match': 'editor'}, Posts(editor=3), logger)
+    Tracker.find_match.assert_called_with('editor', 3)
+    assert Users.get.call_count == 0
+
+
+def test_lexicon_match_foreign_key_dot(mocker, logger):
+    mocker.patch.object(Tracker, 'find_match')
+    target = MagicMock(post=Posts(editor=3))
+    Lexicon.match({'match': 'post.editor'}, target, logger)
+    Tracker.find_match.assert_called_with('post.editor', 3)
+
+
+def test_lexicon_match_foreign_key_to_field(mocker, logger):
+    mocker.patch.object(Tracker, 'find_match')
+    mocker.patch.object(Users, 'get')
+    Lexicon.match({'match': 'reviewer'}, Posts(reviewer='gandalf'), logger)
+    Tracker.find_match.assert_called_with('reviewer', Users.get())
+
+
+def test_lexicon_compile_sync_many(mocker, logger):
+    mocker.patch.object(Tracker, 'find_matches', return_value=[5, None])
+    rule = {'from': 'editor_id', 'attribute': 'id'}
+    targets = [MagicMock(id=1), MagicMock(id=2)]
+    result = Lexicon.compile_sync_many(rule, logger)(targets)
+    Tracker.find_matches.assert_called_with('editor_id', [1, 2])
+    assert result == [5, None]
+    logger.log.assert_called_once_with('sync-notfound', rule, targets[1])
+
+
+def test_lexicon_sync_foreign_key(mocker, logger):
+    mocker.patch.object(Tracker, 'find_match')
+    rule = {'from': 'editors', 'attribute': 'editor'}
+    Lexicon.sync(rule, Posts(editor=3), logger)
+    Tracker.find_match.assert_called_with('editors', 3)
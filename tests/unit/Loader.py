@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from magnivore.IdAllocator import IdAllocator
+from magnivore.Loader import Loader
+
+from peewee import (CharField, IntegerField, Model, MySQLDatabase,
+                    PostgresqlDatabase, SqliteDatabase)
+
+from pytest import fixture, mark, raises
+
+
+class Items(Model):
+    name = CharField()
+    size = IntegerField(db_column='item_size')
+
+
+@fixture
+def model():
+    model = MagicMock()
+    model._meta.primary_key.name = 'id'
+    model._meta.primary_key.db_column = 'id'
+    model._meta.db_table = 'items'
+    return model
+
+
+@fixture
+def loader(model):
+    return Loader(model)
+
+
+@fixture
+def items(mocker):
+    database = MagicMock(spec=PostgresqlDatabase, quote_char='"',
+                         interpolation='%s')
+    mocker.patch.object(Items._meta, 'database', database)
+    return Items
+
+
+def test_init(model):
+    loader = Loader(model, 'copy')
+    assert loader.model == model
+    assert loader.method == 'copy'
+
+
+def test_init_allocator(model):
+    loader = Loader(model, allocate=True, block_size=50)
+    assert loader.allocate is True
+    assert loader.allocator.model == model
+    assert loader.allocator.block_size == 50
+
+
+def test_load_allocate(mocker, model):
+    mocker.patch.object(IdAllocator, 'allocate', return_value=[4])
+    loader = Loader(model, allocate=True)
+    assert loader.load([{'a': 1}]) == [4]
+    model.insert_many.assert_called_with([{'a': 1, 'id': 4}])
+
+
+def test_init_unknown(model):
+    with raises(ValueError):
+        Loader(model, 'unknown')
+
+
+@mark.parametrize('database, ids', [
+    (SqliteDatabase, [13, 14, 15]),
+    (MySQLDatabase, [15, 16, 17])
+])
+def test_insert(mocker, loader, database, ids):
+    mocker.patch.object(sqlite3, 'sqlite_version_info', (3, 8, 0))
+    database = MagicMock(spec=database)
+    database.execute_sql().lastrowid = 15
+    loader.model._meta.database = database
+    loader.model.insert_many().sql.return_value = ('INSERT', [])
+    rows = [{'a': 1}, {'a': 2}, {'a': 3}]
+    result = loader.insert(rows)
+    loader.model.insert_many.assert_called_with(rows)
+    database.execute_sql.assert_called_with('INSERT', [])
+    assert result == ids
+
+
+def test_insert_sqlite_returning(mocker, loader):
+    mocker.patch.object(sqlite3, 'sqlite_version_info', (3, 35, 0))
+    database = MagicMock(spec=SqliteDatabase)
+    database.execute_sql().fetchall.return_value = [(6, ), (5, )]
+    loader.model._meta.database = database
+    loader.model.insert_many().sql.return_value = ('INSERT', [])
+    result = loader.insert([{'a': 1}, {'a': 2}])
+    database.execute_sql.assert_called_with('INSERT RETURNING "id"', [])
+    assert result == [5, 6]
+
+
+def test_insert_postgres(loader):
+    database = MagicMock(spec=PostgresqlDatabase)
+    loader.model._meta.database = database
+    query = loader.model.insert_many().return_id_list()
+    query.execute.return_value = [8, 7]
+    assert loader.insert([{'a': 1}, {'a': 2}]) == [7, 8]
+
+
+def test_insert_with_ids(loader):
+    rows = [{'id': 4, 'a': 1}, {'id': 9, 'a': 2}]
+    assert loader.insert(rows) == [4, 9]
+    assert loader.model.insert_many().execute.call_count == 1
+
+
+def test_save(loader):
+    loader.model.return_value.id = 3
+    assert loader.save([{'a': 1}]) == [3]
+    loader.model.assert_called_with(a=1)
+    loader.model().save.assert_called_with(force_insert=False)
+
+
+def test_save_with_ids(loader):
+    loader.save([{'id': 3, 'a': 1}])
+    loader.model().save.assert_called_with(force_insert=True)
+
+
+def test_assign(mocker, loader):
+    mocker.patch.object(IdAllocator, 'allocate', return_value=[4, 5])
+    result = loader._assign([{'a': 1}, {'a': 2}])
+    assert result == [{'a': 1, 'id': 4}, {'a': 2, 'id': 5}]
+
+
+def test_assign_with_ids(mocker, loader):
+    mocker.patch.object(IdAllocator, 'allocate')
+    rows = [{'id': 1}]
+    assert loader._assign(rows) == rows
+    assert IdAllocator.allocate.call_count == 0
+
+
+def test_executemany(mocker, items):
+    mocker.patch.object(IdAllocator, 'allocate', return_value=[4, 5])
+    loader = Loader(items, 'executemany')
+    result = loader.load([{'name': 'a', 'size': 1}, {'name': 'b', 'size': 2}])
+    assert result == [4, 5]
+    cursor = items._meta.database.get_cursor()
+    cursor.executemany.assert_called_with(
+        'INSERT INTO "items" ("name", "item_size", "id") '
+        'VALUES (%s, %s, %s)',
+        [['a', 1, 4], ['b', 2, 5]])
+
+
+@mark.parametrize('value, encoded', [
+    (None, ''),
+    ('', '""'),
+    ('say "hi"', '"say ""hi"""'),
+    (3, '3'),
+    (Decimal('1.5'), '1.5'),
+    (True, 't'),
+    (b'\x01\xff', '"\\x01ff"'),
+    (bytearray(b'\x01\xff'), '"\\x01ff"'),
+    (memoryview(b'\x01\xff'), '"\\x01ff"')
+])
+def test_csv_value(value, encoded):
+    assert Loader._csv_value(value) == encoded
+
+
+def test_copy(mocker, items):
+    mocker.patch.object(IdAllocator, 'allocate', return_value=[4, 5])
+    loader = Loader(items, 'copy')
+    rows = [{'name': 'a', 'size': 1}, {'name': None, 'size': 2}]
+    assert loader.load(rows) == [4, 5]
+    cursor = items._meta.database.get_cursor()
+    sql, data = cursor.copy_expert.call_args[0]
+    assert sql == ('COPY "items" ("name", "item_size", "id") '
+                   'FROM STDIN WITH (FORMAT csv)')
+    assert data.read() == '"a",1,4\n,2,5\n'
+
+
+def test_copy_not_postgres(model):
+    model._meta.database = MagicMock(spec=SqliteDatabase)
+    with raises(ValueError):
+        Loader(model, 'copy').load([{'a': 1}])
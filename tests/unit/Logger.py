@@ -72,3 +72,16 @@ def test_log_custom_event(logger):
     logger.events = {}
     logger.log('my-event', 'world')
     logger.logger.log.assert_called_with(logging.INFO, 'my-event')
+
+
+def test_enabled(logger):
+    logger.events = {'my-event': ('debug', 'hello {}')}
+    result = logger.enabled('my-event')
+    logger.logger.isEnabledFor.assert_called_with(logging.DEBUG)
+    assert result == logger.logger.isEnabledFor()
+
+
+def test_enabled_custom_event(logger):
+    logger.events = {}
+    logger.enabled('my-event')
+    logger.logger.isEnabledFor.assert_called_with(logging.INFO)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from unittest.mock import MagicMock
+
+from magnivore.Models import Models
+
+from pytest import fixture, raises
+
+
+ForeignKey = namedtuple('ForeignKey', ['dest_table'])
+
+
+@fixture
+def introspector():
+    introspector = MagicMock(schema=None)
+    foreign_keys = {
+        'addresses': [ForeignKey('users')],
+        'posts': [ForeignKey('users'), ForeignKey('posts')]
+    }
+    get_foreign_keys = introspector.metadata.get_foreign_keys
+    get_foreign_keys.side_effect = lambda table, schema: foreign_keys.get(
+        table, [])
+    return introspector
+
+
+@fixture
+def models(introspector):
+    return Models(introspector)
+
+
+def test_dependencies(models):
+    result = models.dependencies(['addresses', 'posts'])
+    assert result == {'addresses', 'posts', 'users'}
+
+
+def test_load(models, introspector):
+    model = type('model', (object,), {})
+    introspector.generate_models.return_value = {'users': model}
+    models.load(['users'])
+    introspector.generate_models.assert_called_with(table_names={'users'})
+    assert models == {'users': model}
+
+
+def test_load_all(models, introspector):
+    models.load()
+    introspector.generate_models.assert_called_with(table_names=None)
+
+
+def test_load_loaded(models, introspector):
+    models['users'] = MagicMock()
+    models.load(['users'])
+    assert introspector.generate_models.call_count == 0
+
+
+def test_load_reloads(models, introspector):
+    models['users'] = MagicMock()
+    models.load(['posts'])
+    introspector.generate_models.assert_called_with(
+        table_names={'users', 'posts'})
+
+
+def test_load_string_method(introspector):
+    model = type('model', (object,), {})
+    introspector.generate_models.return_value = {'users': model}
+    string_method = MagicMock()
+    Models(introspector, string_method).load(['users'])
+    assert model.__str__ == string_method
+
+
+def test_missing(models, introspector):
+    model = MagicMock()
+    introspector.generate_models.return_value = {'addresses': model}
+    assert models['addresses'] == model
+    introspector.generate_models.assert_called_with(
+        table_names={'addresses', 'users'})
+
+
+def test_missing_table(models, introspector):
+    introspector.generate_models.return_value = {}
+    with raises(KeyError):
+        models['missing']
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import threading
+from unittest.mock import MagicMock
+
+from magnivore.Pipeline import Pipeline
+
+from pytest import fixture, raises
+
+
+@fixture
+def pipeline():
+    return Pipeline(size=2)
+
+
+def test_pipeline_init():
+    pipeline = Pipeline()
+    assert pipeline.size == 1000
+    assert pipeline.release is None
+
+
+def test_pipeline_run(pipeline):
+    result = list(pipeline.run(range(10), lambda target: target * 2))
+    assert result == [(i, i * 2) for i in range(10)]
+
+
+def test_pipeline_run_threads(pipeline):
+    threads = []
+
+    def targets():
+        threads.append(threading.current_thread())
+        yield 1
+
+    def transform(target):
+        threads.append(threading.current_thread())
+
+    list(pipeline.run(targets(), transform))
+    assert threading.current_thread() not in threads
+    assert threads[0] != threads[1]
+
+
+def test_pipeline_run_release():
+    release = MagicMock()
+    pipeline = Pipeline(release=release)
+    list(pipeline.run([1], lambda target: target))
+    assert release.call_count == 2
+
+
+def test_pipeline_run_backpressure(pipeline):
+    fetched = []
+
+    def targets():
+        for i in range(100):
+            fetched.append(i)
+            yield i
+
+    results = pipeline.run(targets(), lambda target: target)
+    next(results)
+    assert len(fetched) < 100
+    results.close()
+
+
+def test_pipeline_run_reader_error(pipeline):
+    def targets():
+        yield 1
+        raise ValueError
+
+    with raises(ValueError):
+        list(pipeline.run(targets(), lambda target: target))
+
+
+def test_pipeline_run_transform_error(pipeline):
+    def transform(target):
+        raise KeyError
+
+    with raises(KeyError):
+        list(pipeline.run(range(10), transform))
+
+
+def test_pipeline_run_stopped(pipeline):
+    closed = []
+
+    def targets():
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            closed.append(True)
+
+    results = pipeline.run(targets(), lambda target: target)
+    next(results)
+    results.close()
+    assert pipeline.stopped.is_set()
+    assert closed == [True]
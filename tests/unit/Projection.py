@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from magnivore.Projection import Projection
+
+from peewee import CharField, ForeignKeyField, Model, SqliteDatabase
+
+from pytest import fixture, mark
+
+
+database = SqliteDatabase(':memory:')
+
+
+class Users(Model):
+    username = CharField()
+    bio = CharField()
+
+    class Meta:
+        database = database
+
+
+class Addresses(Model):
+    city = CharField()
+    street = CharField()
+    user = ForeignKeyField(Users)
+
+    class Meta:
+        database = database
+
+
+@fixture
+def source_models():
+    return {'users': Users, 'addresses': Addresses}
+
+
+@fixture
+def table_rules():
+    return {
+        'sources': [
+            {'table': 'users'},
+            {'table': 'addresses', 'on': 'user'}
+        ],
+        'transform': {
+            'name': 'username',
+            'city': 'addresses.city'
+        }
+    }
+
+
+@mark.parametrize('rule, paths', [
+    ('username', ['username']),
+    ({'transform': {}, 'from': 'bio'}, ['bio']),
+    ({'factor': 2, 'from': 'bio'}, ['bio']),
+    ({'format': '{} {}', 'from': ['bio', 'username']}, ['bio', 'username']),
+    ({'match': 'addresses.user', 'from': 'editor'}, ['addresses.user']),
+    ({'static': 'value'}, []),
+    ({'expression': '.*', 'from': 'bio'}, ['bio']),
+    ({'unknown': True}, None)
+])
+def test_rule_paths(rule, paths):
+    assert Projection._rule_paths(rule) == paths
+
+
+def test_paths(table_rules):
+    table_rules['sync-transform'] = {'name': 'bio'}
+    table_rules['sync'] = {'from': 'editor', 'attribute': 'id'}
+    result = Projection.paths(table_rules)
+    assert result == {'username', 'addresses.city', 'bio', 'id'}
+
+
+def test_paths_unknown(table_rules):
+    table_rules['transform']['name'] = {'unknown': True}
+    assert Projection.paths(table_rules) is None
+
+
+def test_columns(table_rules, source_models):
+    result = Projection.columns(table_rules, source_models)
+    assert [(field.model_class, field.name) for field in result] == [
+        (Users, 'id'), (Addresses, 'id'), (Addresses, 'city'),
+        (Users, 'username')
+    ]
+
+
+def test_columns_foreign_key(table_rules, source_models):
+    table_rules['sources'] = [
+        {'table': 'addresses'},
+        {'table': 'users', 'on': ['user', 'id']}
+    ]
+    table_rules['transform'] = {'name': 'user.username'}
+    result = Projection.columns(table_rules, source_models)
+    assert [(field.model_class, field.name) for field in result] == [
+        (Addresses, 'id'), (Users, 'id'), (Users, 'username')
+    ]
+
+
+@mark.parametrize('path', ['missing', 'addresses.missing', 'posts.title',
+                           'addresses.user.username'])
+def test_columns_unknown_path(table_rules, source_models, path):
+    table_rules['transform']['name'] = path
+    assert Projection.columns(table_rules, source_models) is None
+
+
+@mark.parametrize('key', ['picks', 'aggregation'])
+def test_columns_picks(table_rules, source_models, key):
+    table_rules['sources'][0][key] = {}
+    assert Projection.columns(table_rules, source_models) is None
@@ -1,13 +1,24 @@
 # -*- coding: utf-8 -*-
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 
+from magnivore.Checkpoint import Checkpoint
+from magnivore.CommitPolicy import CommitPolicy
+from magnivore.Config import Config
+from magnivore.DeferredDefinitions import DeferredDefinitions
+from magnivore.DeferredIndexes import DeferredIndexes
 from magnivore.Interface import Interface
+from magnivore.Models import Models
+from magnivore.Pipeline import Pipeline
+from magnivore.Projection import Projection
 from magnivore.RulesParser import RulesParser
 from magnivore.Targets import Targets
 from magnivore.Tracker import Tracker, tracker_interface
 from magnivore.Transformer import Transformer
+from magnivore.Watermark import Watermark
 
-from pytest import fixture
+from peewee import SqliteDatabase
+
+from pytest import fixture, raises
 
 
 @fixture
@@ -43,11 +54,20 @@ def points():
 
 
 @fixture
-def rules_parser(mocker, parser_dependencies, nodes, points, logger):
+def rules_parser(mocker, parser_dependencies, config, nodes, points, logger):
+    Config.get.return_value = config
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'backend', None)
+    mocker.patch.object(Tracker, 'batch_size')
+    mocker.patch.object(Tracker, 'flush')
     mocker.patch.object(Interface, 'commit')
     mocker.patch.object(tracker_interface, 'commit')
-    Interface.donor.return_value = {'nodes': nodes, 'points': points}
-    Interface.receiver.return_value = {'profiles': MagicMock()}
+    donor = Models(MagicMock())
+    donor.update({'nodes': nodes, 'points': points})
+    receiver = Models(MagicMock())
+    receiver['profiles'] = MagicMock()
+    Interface.donor.return_value = donor
+    Interface.receiver.return_value = receiver
     return RulesParser(logger)
 
 
@@ -59,17 +79,78 @@ def targets(mocker):
     return targets_list
 
 
-def test_rules_parser_init_configfile(parser_dependencies):
+def test_rules_parser_init_configfile(mocker, parser_dependencies):
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'batch_size')
     RulesParser(None, configfile='whatever.json')
 
 
+def test_rules_parser_init_upgrade(rules_parser, logger):
+    Tracker.create_table.assert_called_with(fail_silently=True)
+    assert Tracker.upgrade.call_count == 1
+    assert tracker_interface.commit.call_count == 0
+    assert logger.log.call_count == 0
+
+
+def test_rules_parser_init_upgraded(mocker, parser_dependencies, logger):
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'batch_size')
+    mocker.patch.object(tracker_interface, 'commit')
+    Tracker.upgrade.return_value = True
+    RulesParser(logger)
+    assert tracker_interface.commit.call_count == 1
+    logger.log.assert_called_with('tracker-upgrade')
+
+
+def test_rules_parser_init_cache(rules_parser):
+    assert Tracker.cache.size == 100000
+
+
+def test_rules_parser_init_batch(rules_parser):
+    assert Tracker.batch_size == 300
+
+
+def test_rules_parser_init_cache_size(mocker, parser_dependencies, config):
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'batch_size')
+    config['tracker'] = {'cache': 0}
+    Config.get.return_value = config
+    RulesParser(None)
+    assert Tracker.cache is None
+
+
+def test_rules_parser_init_arrays(mocker, parser_dependencies, config):
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'batch_size')
+    mocker.patch.object(Tracker, 'backend')
+    config['tracker'] = {'backend': 'arrays', 'path': 'tracker'}
+    Config.get.return_value = config
+    RulesParser(None)
+    assert Tracker.backend.path == 'tracker'
+
+
+def test_match_names(rules):
+    rules['profiles']['transform']['author'] = {'match': 'editor'}
+    rules['profiles']['transform']['user'] = {'match': 'user', 'from': 'u'}
+    rules['profiles']['sync'] = {'from': 'synced', 'attribute': 'id'}
+    result = RulesParser._match_names(rules['profiles'])
+    assert result == {'editor', 'u', 'synced'}
+
+
 def test_parse(rules_parser, targets, rules):
     rules_parser.parse(rules)
     Transformer.transform.assert_called_with(targets[0])
+    assert Tracker.flush.call_count == 1
     assert Interface.commit.call_count == 1
     assert tracker_interface.commit.call_count == 1
 
 
+def test_parse_save_arrays(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Tracker, 'backend')
+    rules_parser.parse(rules)
+    assert Tracker.backend.save.call_count == 1
+
+
 def test_parse_list(rules_parser, targets, list_rules):
     rules_parser.parse(list_rules)
     Transformer.transform.assert_called_with(targets[0])
@@ -95,7 +176,7 @@ def test_parse_track_none(rules_parser, targets, rules):
 def test_parse_sync(mocker, rules_parser, targets, rules):
     mocker.patch.object(Transformer, 'sync')
     rules['profiles']['sync-transform'] = rules['profiles']['transform']
-    rules['profiles']['sync'] = 'trackingname'
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
     del rules['profiles']['transform']
     rules_parser.parse(rules)
     Transformer.sync.assert_called_with(targets[0])
@@ -103,11 +184,625 @@ def test_parse_sync(mocker, rules_parser, targets, rules):
 
 def test_parse_log_table(rules_parser, logger, targets, rules):
     rules_parser.parse(rules)
-    logger.log.assert_called_with('parse-table', 'profiles')
+    logger.log.assert_any_call('parse-table', 'profiles')
 
 
 def test_parse_log_label(rules_parser, logger, targets, list_rules):
     list_rules['profiles'][0]['label'] = 'label'
     list_rules['profiles'][1]['label'] = 'label'
     rules_parser.parse(list_rules)
-    logger.log.assert_called_with('parse-ruleset', 'label')
+    logger.log.assert_any_call('parse-ruleset', 'label')
+
+
+def test_parse_preload(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Tracker, 'preload')
+    rules_parser.tracker_config = {'preload': True}
+    rules['profiles']['transform']['author'] = {'match': 'editor'}
+    rules_parser.parse(rules)
+    Tracker.preload.assert_called_with('editor')
+
+
+def test_parse_preload_disabled(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Tracker, 'preload')
+    rules['profiles']['transform']['author'] = {'match': 'editor'}
+    rules_parser.parse(rules)
+    assert Tracker.preload.call_count == 0
+
+
+def test_parse_log_cache(rules_parser, logger, targets, rules):
+    rules_parser.parse(rules)
+    logger.log.assert_called_with('tracker-cache', Tracker.cache.hits,
+                                  Tracker.cache.misses)
+
+
+def test_parse_batch(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Transformer, 'transform_many')
+    item = MagicMock()
+    Transformer.transform_many.return_value = [(targets[0], item)]
+    rules['profiles']['batch'] = 100
+    rules['profiles']['track'] = 'trackingname'
+    rules_parser.parse(rules)
+    assert list(Transformer.transform_many.call_args[0][0]) == targets
+    assert Transformer.transform.call_count == 0
+    Tracker.track.assert_called_with('trackingname', targets[0], item)
+
+
+def test_parse_sync_batch(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Transformer, 'sync_many')
+    rules['profiles']['sync-transform'] = rules['profiles']['transform']
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
+    rules['profiles']['batch'] = 100
+    del rules['profiles']['transform']
+    rules_parser.parse(rules)
+    assert list(Transformer.sync_many.call_args[0][0]) == targets
+
+
+def test_parse_stream(rules_parser, targets, rules):
+    rules['profiles']['stream'] = 500
+    rules_parser.parse(rules)
+    Targets.get.assert_called_with(rules['profiles']['sources'], stream=500,
+                                   count=True, columns=None, watermark=None)
+
+
+def test_parse_stream_sync(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Transformer, 'sync')
+    rules['profiles']['sync-transform'] = rules['profiles']['transform']
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
+    rules['profiles']['stream'] = True
+    rules_parser.parse(rules)
+    assert Targets.get.call_count == 2
+    Transformer.sync.assert_called_with(targets[0])
+
+
+def test_parse_sync_cached(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Transformer, 'sync')
+    rules['profiles']['sync-transform'] = rules['profiles']['transform']
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
+    rules_parser.parse(rules)
+    assert Targets.get.call_count == 1
+
+
+def test_parse_chunk(mocker, rules_parser, nodes, targets, rules):
+    mocker.patch.object(Targets, 'chunks', return_value=[targets, targets])
+    nodes._meta.primary_key.name = 'id'
+    rules['profiles']['chunk'] = 2
+    rules_parser.parse(rules)
+    Targets.chunks.assert_called_with(rules['profiles']['sources'], 2,
+                                      count=True, columns=None, after=None,
+                                      watermark=None)
+    assert Transformer.transform.call_count == 2
+    assert Tracker.flush.call_count == 3
+    assert Targets.get.call_count == 0
+
+
+def test_parse_count(rules_parser, targets, rules):
+    rules['profiles']['count'] = 'estimate'
+    rules_parser.parse(rules)
+    Targets.get.assert_called_with(rules['profiles']['sources'], stream=None,
+                                   count='estimate', columns=None,
+                                   watermark=None)
+
+
+def test_parse_projection(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Projection, 'columns')
+    rules_parser.parse(rules)
+    Projection.columns.assert_called_with(rules['profiles'],
+                                          rules_parser.targets.source_models)
+    Targets.get.assert_called_with(rules['profiles']['sources'], stream=None,
+                                   count=True, columns=Projection.columns(),
+                                   watermark=None)
+
+
+def test_parse_projection_disabled(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Projection, 'columns')
+    rules['profiles']['projection'] = False
+    rules_parser.parse(rules)
+    assert Projection.columns.call_count == 0
+
+
+def test_rules_parser_init_models(rules_parser):
+    Interface.donor.assert_called_with(tables=[])
+    Interface.receiver.assert_called_with(tables=[])
+
+
+def test_tables(rules, list_rules):
+    rules['articles'] = list_rules['profiles']
+    receiver_tables, donor_tables = RulesParser._tables(rules)
+    assert receiver_tables == {'profiles', 'articles'}
+    assert donor_tables == {'nodes', 'points'}
+
+
+def test_parse_load_models(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Models, 'load')
+    rules_parser.parse(rules)
+    assert Models.load.call_args_list == [
+        call({'profiles'}),
+        call({'nodes', 'points'})
+    ]
+
+
+def test_parse_reconnect(mocker, rules_parser, logger, targets, rules):
+    mocker.patch.object(Interface, 'reconnect', return_value=['donor.db'])
+    rules_parser.parse(rules)
+    logger.log.assert_any_call('reconnect', 'donor.db')
+
+
+def test_parse_transaction_rows(rules_parser, targets, rules):
+    targets.extend([MagicMock(), MagicMock()])
+    rules['profiles']['track'] = 'profiles'
+    rules['profiles']['transaction'] = {'rows': 2}
+    rules_parser.parse(rules)
+    assert Tracker.flush.call_count == 2
+    assert Interface.commit.call_count == 2
+
+
+def test_parse_transaction_config(rules_parser, targets, rules):
+    targets.append(MagicMock())
+    rules['profiles']['track'] = 'profiles'
+    rules_parser.transaction = {'rows': 1}
+    rules_parser.parse(rules)
+    assert Interface.commit.call_count == 3
+
+
+def test_parse_transaction_ruleset(rules_parser, targets, rules):
+    targets.append(MagicMock())
+    rules['profiles']['track'] = 'profiles'
+    rules_parser.transaction = {'rows': 1}
+    rules['profiles']['transaction'] = {}
+    rules_parser.parse(rules)
+    assert Interface.commit.call_count == 1
+
+
+def test_parse_transaction_untracked(rules_parser, logger, targets, rules):
+    targets.append(MagicMock())
+    rules['profiles']['transaction'] = {'rows': 1}
+    rules_parser.parse(rules)
+    assert Interface.commit.call_count == 1
+    logger.log.assert_any_call('transaction-untracked')
+
+
+def test_parse_transaction_chunk(mocker, rules_parser, nodes, targets,
+                                 rules):
+    mocker.patch.object(Targets, 'chunks', return_value=[targets])
+    nodes._meta.primary_key.name = 'id'
+    targets.append(MagicMock())
+    rules['profiles']['track'] = 'profiles'
+    rules['profiles']['chunk'] = 2
+    rules['profiles']['transaction'] = {'rows': 1}
+    rules_parser.parse(rules)
+    assert Interface.commit.call_count == 2
+
+
+def test_parse_resume_tracked(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Tracker, 'find_match')
+    Tracker.find_match.side_effect = [MagicMock(), None]
+    targets.append(MagicMock())
+    rules['profiles']['track'] = 'profiles'
+    Checkpoint.progress.return_value = {'profiles:0': MagicMock(done=False)}
+    rules_parser.parse(rules, resume=True)
+    Tracker.find_match.assert_called_with('profiles', targets[1].id)
+    Transformer.transform.assert_called_once_with(targets[1])
+
+
+def test_parse_tracked_advance(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Checkpoint, 'advance')
+    rules['profiles']['track'] = 'profiles'
+    rules_parser.parse(rules)
+    Checkpoint.advance.assert_called_with('profiles:0', None)
+
+
+def test_paced(mocker, rules_parser):
+    mocker.patch.object(RulesParser, '_commit')
+    policy = CommitPolicy(rows=2)
+    result = rules_parser._paced([1, 2, 3], policy)
+    assert next(result) == 1
+    assert next(result) == 2
+    assert RulesParser._commit.call_count == 0
+    assert next(result) == 3
+    assert RulesParser._commit.call_count == 1
+    assert policy.count == 0
+
+
+def test_rules_parser_init_tracker_pragmas(mocker, parser_dependencies,
+                                           config):
+    mocker.patch.object(Tracker, 'cache')
+    mocker.patch.object(Tracker, 'batch_size')
+    mocker.patch.object(tracker_interface, 'set_pragmas')
+    config['tracker'] = {'pragmas': 'bulk'}
+    Config.get.return_value = config
+    RulesParser(MagicMock())
+    tracker_interface.set_pragmas.assert_called_with('magnivore.db', 'bulk')
+
+
+def test_close(mocker, rules_parser):
+    mocker.patch.object(Interface, 'close')
+    mocker.patch.object(tracker_interface, 'restore_pragmas')
+    rules_parser.close()
+    assert Interface.close.call_count == 1
+    assert tracker_interface.restore_pragmas.call_count == 1
+
+
+@fixture
+def deferred(mocker):
+    mocker.patch.object(DeferredIndexes, 'inspect')
+    mocker.patch.object(DeferredIndexes, 'drop')
+    mocker.patch.object(DeferredIndexes, 'rebuild')
+
+
+def test_parse_defer_indexes(rules_parser, logger, targets, rules, deferred):
+    rules['profiles']['defer-indexes'] = True
+    rules_parser.parse(rules)
+    assert DeferredIndexes.drop.call_count == 1
+    assert DeferredIndexes.rebuild.call_count == 1
+    assert Interface.commit.call_count == 2
+    logger.log.assert_any_call('defer-indexes', 0, 0, 'profiles')
+    assert logger.log.call_args_list[-2][0][0] == 'rebuild-indexes'
+
+
+def test_parse_defer_indexes_saved(rules_parser, targets, rules, deferred):
+    rules['profiles']['defer-indexes'] = True
+    rules_parser.parse(rules)
+    assert DeferredIndexes.inspect.call_count == 1
+    assert DeferredDefinitions.record.call_args[0][0] == 'profiles'
+    assert tracker_interface.commit.call_count == 3
+    DeferredDefinitions.forget.assert_called_with('profiles')
+
+
+def test_parse_defer_indexes_forget_locked(mocker, rules_parser, targets,
+                                           rules, deferred):
+    lock = mocker.patch.object(Tracker, 'lock')
+    held = []
+    DeferredDefinitions.forget.side_effect = lambda table: held.append(
+        lock.__enter__.call_count - lock.__exit__.call_count)
+    rules['profiles']['defer-indexes'] = True
+    rules_parser.parse(rules)
+    assert held == [1]
+
+
+def test_parse_defer_indexes_resume(rules_parser, logger, targets, rules,
+                                    deferred):
+    saved = {'indexes': [['profiles_name', 'CREATE']], 'foreign-keys': []}
+    DeferredDefinitions.find.return_value = saved
+    rules_parser.parse(rules, resume=True)
+    assert DeferredDefinitions.record.call_count == 0
+    assert DeferredIndexes.drop.call_count == 1
+    assert DeferredIndexes.rebuild.call_count == 1
+    logger.log.assert_any_call('resume-indexes', 'profiles')
+    logger.log.assert_any_call('defer-indexes', 1, 0, 'profiles')
+
+
+def test_parse_defer_indexes_resume_done(rules_parser, targets, rules,
+                                         deferred):
+    Checkpoint.progress.return_value = {'profiles:0': MagicMock(done=True)}
+    DeferredDefinitions.find.return_value = {'indexes': [],
+                                             'foreign-keys': []}
+    rules_parser.parse(rules, resume=True)
+    assert Transformer.transform.call_count == 0
+    assert DeferredIndexes.rebuild.call_count == 1
+
+
+def test_parse_defer_indexes_list(rules_parser, targets, list_rules,
+                                  deferred):
+    list_rules['profiles'][1] = dict(list_rules['profiles'][1])
+    list_rules['profiles'][1]['defer-indexes'] = True
+    rules_parser.parse(list_rules)
+    assert DeferredIndexes.drop.call_count == 1
+    assert DeferredIndexes.rebuild.call_count == 1
+
+
+def test_parse_defer_indexes_disabled(rules_parser, targets, rules,
+                                      deferred):
+    rules_parser.parse(rules)
+    assert DeferredIndexes.drop.call_count == 0
+    assert DeferredIndexes.inspect.call_count == 0
+
+
+def test_parse_loader(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Transformer, 'transform_many', return_value=[])
+    rules['profiles']['loader'] = 'copy'
+    rules_parser.parse(rules)
+    assert Transformer.transform_many.call_count == 1
+    assert Transformer.transform.call_count == 0
+
+
+@fixture
+def workers(mocker, rules_parser):
+    mocker.patch.object(Interface, 'begin')
+    mocker.patch.object(Interface, 'release')
+    mocker.patch.object(tracker_interface, 'begin')
+    mocker.patch.object(tracker_interface, 'release')
+    mocker.patch.object(tracker_interface, 'set_pragmas')
+    mocker.patch.object(tracker_interface, 'pragmas',
+                        {'magnivore.db': {'journal_mode': 'delete'}})
+    rules_parser.workers = 2
+    name = rules_parser.interface.config['receiver']['name']
+    rules_parser.interface.databases[name] = MagicMock()
+    return rules_parser
+
+
+def test_workers(workers):
+    assert workers._workers() == 2
+
+
+def test_workers_single(rules_parser):
+    assert rules_parser._workers() == 1
+
+
+def test_workers_sqlite(workers, logger):
+    name = workers.interface.config['receiver']['name']
+    workers.interface.databases[name] = MagicMock(spec=SqliteDatabase)
+    assert workers._workers() == 1
+    logger.log.assert_called_with('workers-ignored', 2)
+
+
+def test_workers_memory(workers):
+    workers.interface.memory.add('donor.db')
+    assert workers._workers() == 1
+
+
+def test_parse_workers(workers, logger, targets, rules):
+    workers.parse(rules)
+    Transformer.transform.assert_called_with(targets[0])
+    logger.log.assert_any_call('parse-workers', 1, 2)
+    tracker_interface.set_pragmas.assert_called_with('magnivore.db',
+                                                     {'journal_mode': 'wal'})
+    assert tracker_interface.pragmas == {'magnivore.db': {}}
+    assert Interface.begin.call_count == 1
+    assert Interface.release.call_count == 1
+    assert tracker_interface.release.call_count == 1
+    assert Tracker.autoflush is True
+
+
+def test_parse_workers_autoflush(mocker, workers, targets, rules):
+    mocker.patch.object(RulesParser, '_process',
+                        side_effect=lambda *args, **kwargs: autoflush.append(
+                            Tracker.autoflush))
+    autoflush = []
+    workers.parse(rules)
+    assert autoflush == [False]
+
+
+def test_parse_workers_error(mocker, workers, targets, rules):
+    mocker.patch.object(RulesParser, '_process', side_effect=ValueError)
+    with raises(ValueError):
+        workers.parse(rules)
+    assert Interface.release.call_count == 1
+    assert Tracker.autoflush is True
+
+
+@fixture
+def pipelined(mocker, rules_parser, rules):
+    mocker.patch.object(Pipeline, 'run', side_effect=lambda targets, function:
+                        [(target, function(target)) for target in targets])
+    mocker.patch.object(Interface, 'release')
+    mocker.patch.object(tracker_interface, 'release')
+    rules['profiles']['pipeline'] = True
+    return rules_parser
+
+
+def test_parse_pipeline(mocker, pipelined, targets, rules):
+    mocker.patch.object(Transformer, 'item_values')
+    mocker.patch.object(Transformer, 'load_many', return_value=[])
+    pipelined.parse(rules)
+    Transformer.item_values.assert_called_with(targets[0])
+    pairs = list(Transformer.load_many.call_args[0][0])
+    assert pairs == [(targets[0], Transformer.item_values())]
+    assert Interface.commit.call_count == 2
+
+
+def test_parse_pipeline_size(mocker, pipelined, targets, rules):
+    mocker.patch.object(Pipeline, '__init__', return_value=None)
+    mocker.patch.object(Transformer, 'load_many', return_value=[])
+    rules['profiles']['pipeline'] = 50
+    pipelined.parse(rules)
+    Pipeline.__init__.assert_called_with(size=50,
+                                         release=pipelined._release)
+
+
+def test_parse_pipeline_batch(mocker, pipelined, targets, rules):
+    mocker.patch.object(Transformer, '__init__', return_value=None)
+    mocker.patch.object(Transformer, 'load_many', return_value=[])
+    mocker.patch.object(Transformer, 'item_values', create=True)
+    pipelined.parse(rules)
+    assert Transformer.__init__.call_args[1]['batch'] == 1000
+
+
+def test_parse_pipeline_sync(mocker, pipelined, targets, rules):
+    mocker.patch.object(Transformer, 'sync_values')
+    mocker.patch.object(Transformer, 'update_many')
+    rules['profiles']['sync-transform'] = rules['profiles']['transform']
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
+    del rules['profiles']['transform']
+    pipelined.parse(rules)
+    values = list(Transformer.update_many.call_args[0][0])
+    assert values == [Transformer.sync_values()]
+
+
+def test_parse_pipeline_own_track(pipelined, targets, rules):
+    rules['profiles']['track'] = 'profiles'
+    rules['profiles']['transform']['parent'] = {'match': 'parent',
+                                                'from': 'profiles'}
+    with raises(ValueError):
+        pipelined.parse(rules)
+
+
+def test_release(mocker, rules_parser):
+    mocker.patch.object(Interface, 'release')
+    mocker.patch.object(tracker_interface, 'release')
+    rules_parser._release()
+    assert Interface.release.call_count == 1
+    assert tracker_interface.release.call_count == 1
+
+
+def test_parse_pipeline_stream(mocker, pipelined, targets, rules):
+    mocker.patch.object(Transformer, 'load_many', return_value=[])
+    pipelined.parse(rules)
+    assert Targets.get.call_args[1]['stream'] is True
+
+
+def test_parse_checkpoint_clear(rules_parser, targets, rules):
+    rules_parser.parse(rules)
+    assert Checkpoint.clear.call_count == 1
+    assert Checkpoint.progress.call_count == 0
+
+
+def test_parse_checkpoint_complete(mocker, rules_parser, targets, rules):
+    mocker.patch.object(Checkpoint, 'complete')
+    rules_parser.parse(rules)
+    Checkpoint.complete.assert_called_with('profiles:0')
+    assert Checkpoint.flush.call_count == 1
+
+
+def test_parse_checkpoint_chunk(mocker, rules_parser, nodes, targets, rules):
+    mocker.patch.object(Checkpoint, 'advance')
+    mocker.patch.object(Targets, 'chunks', return_value=[targets])
+    nodes._meta.primary_key.name = 'id'
+    rules['profiles']['chunk'] = 2
+    rules_parser.parse(rules)
+    Checkpoint.advance.assert_called_with('profiles:0', targets[0].id)
+
+
+def test_parse_resume(rules_parser, logger, targets, rules):
+    done = Checkpoint(ruleset='profiles:0', done=True)
+    Checkpoint.progress.return_value = {'profiles:0': done}
+    rules_parser.parse(rules, resume=True)
+    assert Checkpoint.clear.call_count == 0
+    assert Transformer.transform.call_count == 0
+    logger.log.assert_any_call('resume-skip', 'profiles:0')
+
+
+def test_parse_resume_list(rules_parser, targets, list_rules):
+    done = Checkpoint(ruleset='profiles:0', done=True)
+    Checkpoint.progress.return_value = {'profiles:0': done}
+    rules_parser.parse(list_rules, resume=True)
+    assert Transformer.transform.call_count == 1
+
+
+def test_parse_resume_chunk(mocker, rules_parser, logger, nodes, targets,
+                            rules):
+    mocker.patch.object(Targets, 'chunks', return_value=[])
+    progress = Checkpoint(ruleset='profiles:0', done=False, last=5)
+    Checkpoint.progress.return_value = {'profiles:0': progress}
+    rules['profiles']['chunk'] = 2
+    rules_parser.parse(rules, resume=True)
+    assert Targets.chunks.call_args[1]['after'] == 5
+    logger.log.assert_any_call('resume-chunk', 'profiles:0', 5)
+
+
+def test_rules_parser_init_checkpoint(rules_parser):
+    Checkpoint.create_table.assert_called_with(fail_silently=True)
+
+
+def test_rules_parser_init_watermark(rules_parser):
+    Watermark.create_table.assert_called_with(fail_silently=True)
+
+
+@fixture
+def watermark(mocker, rules):
+    mocker.patch.object(Watermark, 'find', return_value=5)
+    mocker.patch.object(Watermark, 'advance')
+    mocker.patch.object(Targets, 'high_water', return_value=9)
+    rules['profiles']['watermark'] = 'updated'
+
+
+def test_parse_watermark(rules_parser, logger, nodes, targets, rules,
+                         watermark):
+    rules_parser.parse(rules)
+    Watermark.find.assert_called_with('profiles:0', nodes.updated)
+    Targets.high_water.assert_called_with(rules['profiles']['sources'],
+                                          'updated')
+    assert Targets.get.call_args[1]['watermark'] == ('updated', 5, 9)
+    Watermark.advance.assert_called_with('profiles:0', 9)
+    logger.log.assert_any_call('watermark', 'profiles:0', 5, 9)
+    assert Watermark.flush.call_count == 1
+
+
+def test_parse_watermark_empty(rules_parser, targets, rules, watermark):
+    Targets.high_water.return_value = None
+    rules_parser.parse(rules)
+    assert Watermark.advance.call_count == 0
+
+
+def test_parse_watermark_chunk(mocker, rules_parser, nodes, targets, rules,
+                               watermark):
+    mocker.patch.object(Targets, 'chunks', return_value=[targets])
+    nodes._meta.primary_key.name = 'id'
+    rules['profiles']['chunk'] = 2
+    rules_parser.parse(rules)
+    assert Targets.chunks.call_args[1]['watermark'] == ('updated', 5, 9)
+    Watermark.advance.assert_called_with('profiles:0', 9)
+
+
+def test_parse_watermark_pipeline(rules_parser, targets, rules, watermark):
+    rules['profiles']['pipeline'] = True
+    with raises(ValueError):
+        rules_parser.parse(rules)
+
+
+@fixture
+def tracked(mocker, targets, rules, watermark):
+    mocker.patch.object(Tracker, 'find_match')
+    mocker.patch.object(Transformer, 'sync')
+    mocker.patch.object(Transformer, 'sync_many')
+    Tracker.find_match.side_effect = [MagicMock(), None]
+    targets.append(MagicMock())
+    rules['profiles']['track'] = 'profiles'
+
+
+def test_parse_watermark_tracked(rules_parser, targets, rules, tracked):
+    rules_parser.parse(rules)
+    Tracker.find_match.assert_called_with('profiles', targets[1].id)
+    Transformer.sync.assert_called_with(targets[0])
+    Transformer.transform.assert_called_with(targets[1])
+
+
+def test_parse_watermark_tracked_batch(mocker, rules_parser, targets, rules,
+                                       tracked):
+    mocker.patch.object(Transformer, 'transform_many',
+                        side_effect=lambda targets: list(targets) and [])
+    rules['profiles']['batch'] = 10
+    rules_parser.parse(rules)
+    Transformer.sync_many.assert_called_with([targets[0]])
+    assert Transformer.sync.call_count == 0
+
+
+@fixture
+def sync_rules(mocker, rules):
+    mocker.patch.object(Transformer, 'sync')
+    rules['profiles']['sync-transform'] = rules['profiles']['transform']
+    rules['profiles']['sync'] = {'from': 'trackingname', 'attribute': 'id'}
+    del rules['profiles']['transform']
+    return rules
+
+
+def test_parse_sync_digest(mocker, rules_parser, targets, sync_rules):
+    init = mocker.spy(Transformer, '__init__')
+    sync_rules['profiles']['digest'] = True
+    rules_parser.parse(sync_rules)
+    assert init.call_args[1]['digest'] is True
+
+
+def test_parse_sync_digest_default(mocker, rules_parser, targets,
+                                   sync_rules):
+    init = mocker.spy(Transformer, '__init__')
+    rules_parser.parse(sync_rules)
+    assert init.call_args[1]['digest'] is False
+
+
+def test_parse_sync_digest_arrays(mocker, rules_parser, targets, sync_rules):
+    init = mocker.spy(Transformer, '__init__')
+    sync_rules['profiles']['digest'] = True
+    Tracker.backend = MagicMock()
+    rules_parser.parse(sync_rules)
+    assert init.call_args[1]['digest'] is False
+
+
+def test_parse_sync_counts(rules_parser, logger, targets, sync_rules):
+    rules_parser.parse(sync_rules)
+    logger.log.assert_any_call('sync-counts', 0, 0)
+
+
+def test_parse_watermark_tracked_counts(rules_parser, logger, targets, rules,
+                                        tracked):
+    rules_parser.parse(rules)
+    logger.log.assert_any_call('sync-counts', 0, 0)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from magnivore.RulesParser import RulesParser
+from magnivore.Scheduler import Scheduler
+
+from pytest import fixture, raises
+
+
+@fixture
+def rules():
+    return {
+        'users': {'track': 'users'},
+        'tags': {'track': 'tags'},
+        'profiles': [
+            {'transform': {'user': {'match': 'users'}}},
+            {'track': 'profiles'}
+        ],
+        'posts': {
+            'transform': {'tag': {'match': 'tags'}},
+            'sync': {'from': 'profiles'}
+        }
+    }
+
+
+@fixture
+def scheduler(rules):
+    return Scheduler(rules, RulesParser._match_names, workers=2)
+
+
+def test_scheduler_init(rules):
+    scheduler = Scheduler(rules, RulesParser._match_names)
+    assert scheduler.rules == rules
+    assert scheduler.match_names == RulesParser._match_names
+    assert scheduler.workers == 1
+
+
+def test_scheduler_names(scheduler, rules):
+    result = scheduler._names(rules['profiles'])
+    assert result == ({'profiles'}, {'users'})
+
+
+def test_scheduler_dependencies(scheduler):
+    result = scheduler.dependencies()
+    assert result == {'users': set(), 'tags': set(), 'profiles': {'users'},
+                      'posts': {'tags', 'profiles'}}
+
+
+def test_scheduler_dependencies_order():
+    rules = {'profiles': {'transform': {'user': {'match': 'users'}}},
+             'users': {'track': 'users'}}
+    scheduler = Scheduler(rules, RulesParser._match_names)
+    assert scheduler.dependencies() == {'profiles': set(),
+                                        'users': {'profiles'}}
+
+
+def test_scheduler_dependencies_self():
+    rules = {'users': {'track': 'users',
+                       'transform': {'parent': {'match': 'users'}}}}
+    scheduler = Scheduler(rules, RulesParser._match_names)
+    assert scheduler.dependencies() == {'users': set()}
+
+
+def test_scheduler_run_single(rules):
+    scheduler = Scheduler(rules, RulesParser._match_names)
+    threads = []
+    scheduler.run(lambda table: threads.append((table,
+                                                threading.current_thread())))
+    assert threads == [(table, threading.current_thread())
+                       for table in rules]
+
+
+def test_scheduler_run(scheduler):
+    order = []
+    scheduler.run(order.append)
+    assert sorted(order) == ['posts', 'profiles', 'tags', 'users']
+    assert order.index('users') < order.index('profiles')
+    assert order.index('profiles') < order.index('posts')
+    assert order.index('tags') < order.index('posts')
+
+
+def test_scheduler_run_concurrent():
+    rules = {'users': {}, 'tags': {}}
+    barrier = threading.Barrier(2, timeout=5)
+    scheduler = Scheduler(rules, RulesParser._match_names, workers=2)
+    scheduler.run(lambda table: barrier.wait())
+    assert barrier.broken is False
+
+
+def test_scheduler_run_error(scheduler):
+    order = []
+
+    def function(table):
+        if table == 'users':
+            raise ValueError(table)
+        order.append(table)
+
+    with raises(ValueError):
+        scheduler.run(function)
+    assert 'profiles' not in order
+    assert 'posts' not in order
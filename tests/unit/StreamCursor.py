@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from unittest.mock import MagicMock
+
+from magnivore.StreamCursor import StreamCursor
+
+from pytest import fixture
+
+
+@fixture
+def cursor():
+    cursor = MagicMock()
+    cursor.fetchmany.side_effect = [[1, 2], [3], []]
+    return StreamCursor(cursor, 2)
+
+
+def test_fetchone(cursor):
+    rows = [cursor.fetchone() for i in range(4)]
+    assert rows == [1, 2, 3, None]
+    cursor.cursor.fetchmany.assert_called_with(2)
+    assert cursor.cursor.fetchmany.call_count == 3
+
+
+def test_execute(cursor):
+    cursor.execute('SELECT', [1])
+    cursor.cursor.execute.assert_called_with('SELECT', [1])
+
+
+def test_execute_no_params(cursor):
+    cursor.execute('SELECT')
+    cursor.cursor.execute.assert_called_with('SELECT', ())
+
+
+def test_description(cursor):
+    assert cursor.description == cursor.cursor.description
+
+
+def test_name(cursor):
+    assert cursor.name == cursor.cursor.name
+
+
+def test_name_none():
+    assert StreamCursor(object(), 2).name is None
+
+
+def test_close(cursor):
+    cursor.close()
+    assert cursor.cursor.close.call_count == 1
+
+
+def test_close_release():
+    release = MagicMock()
+    cursor = StreamCursor(MagicMock(), 2, release=release)
+    cursor.close()
+    assert cursor.cursor.close.call_count == 1
+    assert release.call_count == 1
@@ -3,9 +3,10 @@ from unittest.mock import MagicMock, call
 
 from magnivore.Targets import Targets
 
-from peewee import fn
+from peewee import (IntegerField, MySQLDatabase, PostgresqlDatabase,
+                    PrimaryKeyField, SqliteDatabase, fn)
 
-from pytest import fixture, raises
+from pytest import fixture, mark, raises
 
 
 @fixture
@@ -221,3 +222,253 @@ def test_get_log_targets_count(targets, sources, nodes_query, logger):
     targets.get(sources)
     calls = [call.logger.log('get-targets-count', nodes_query.join().count())]
     logger.log.assert_has_calls(calls)
+
+
+def test_get_sources_unchanged(targets, sources):
+    targets.get(sources)
+    assert len(sources) == 2
+
+
+def test_query(targets, sources, nodes_query):
+    result = targets.query(sources)
+    assert result == nodes_query.join()
+    assert nodes_query.join().execute.call_count == 0
+
+
+def test_get_stream(mocker, targets, sources, nodes_query):
+    mocker.patch.object(Targets, '_stream')
+    result = targets.get(sources, stream=50)
+    Targets._stream.assert_called_with(nodes_query.join(), 50)
+    assert result == Targets._stream()
+    assert nodes_query.join().execute.call_count == 0
+
+
+def test_get_stream_default(mocker, targets, sources, nodes_query):
+    mocker.patch.object(Targets, '_stream')
+    targets.get(sources, stream=True)
+    Targets._stream.assert_called_with(nodes_query.join(), 1000)
+
+
+def test_cursor_postgres(targets):
+    database = MagicMock(spec=PostgresqlDatabase)
+    result = targets._cursor(database, 50)
+    kwargs = database.get_conn().cursor.call_args[1]
+    assert kwargs['name'].startswith('magnivore_')
+    assert kwargs['withhold'] is True
+    assert result.cursor.itersize == 50
+    assert result.fetch_size == 50
+
+
+def test_cursor_mysql(mocker, targets):
+    mysql = mocker.patch('magnivore.Targets.mysql')
+    database = MagicMock(spec=MySQLDatabase, database='donor',
+                         connect_kwargs={'user': 'donor'})
+    result = targets._cursor(database, 50)
+    database._connect.assert_called_with('donor', user='donor')
+    connection = database._connect()
+    connection.cursor.assert_called_with(mysql.cursors.SSCursor)
+    assert result.cursor == connection.cursor()
+    assert database.get_conn.call_count == 0
+
+
+def test_cursor_mysql_close(mocker, targets):
+    mocker.patch('magnivore.Targets.mysql')
+    database = MagicMock(spec=MySQLDatabase, database='donor',
+                         connect_kwargs={})
+    targets._cursor(database, 50).close()
+    connection = database._connect()
+    assert connection.cursor().close.call_count == 1
+    assert connection.rollback.call_count == 1
+    database._close.assert_called_with(connection)
+
+
+def test_cursor_sqlite(targets):
+    database = MagicMock(spec=SqliteDatabase)
+    result = targets._cursor(database, 50)
+    assert result.cursor == database.get_cursor()
+
+
+def test_stream(mocker, targets):
+    mocker.patch.object(Targets, '_cursor')
+    query = MagicMock()
+    query.sql.return_value = ('SELECT', [])
+    wrapper = query._get_result_wrapper()()
+    wrapper.iterate.side_effect = [1, 2, StopIteration]
+    result = list(targets._stream(query, 50))
+    Targets._cursor.assert_called_with(query.database, 50)
+    Targets._cursor().execute.assert_called_with('SELECT', [])
+    assert result == [1, 2]
+    assert Targets._cursor().close.call_count == 1
+
+
+@fixture
+def primary_key(nodes):
+    primary_key = PrimaryKeyField()
+    primary_key.name = 'id'
+    nodes._meta.primary_key = primary_key
+    return primary_key
+
+
+def test_chunks(targets, sources, nodes_query, primary_key):
+    query = nodes_query
+    first = [MagicMock(id=1), MagicMock(id=2)]
+    second = [MagicMock(id=3)]
+    query.order_by().limit().execute.return_value = first
+    query.where().order_by().limit().execute.return_value = second
+    result = list(targets.chunks(sources[:1], 2))
+    assert result == [first, second]
+    query.order_by.assert_called_with(primary_key)
+    query.order_by().limit.assert_called_with(2)
+    assert query.where.call_args[0][0].rhs == 2
+
+
+def test_chunks_join(targets, sources, nodes_query, primary_key):
+    query = nodes_query.join()
+    first = [MagicMock(id=1), MagicMock(id=2)]
+    rest = [MagicMock(id=2), MagicMock(id=2)]
+    query.order_by().limit().execute.return_value = first
+    query.where().execute.return_value = rest
+    query.where().order_by().limit().execute.return_value = []
+    result = list(targets.chunks(sources, 2))
+    assert result == [[first[0]] + rest]
+    expressions = [args[0][0] for args in query.where.call_args_list[-2:]]
+    assert (expressions[0].op, expressions[0].rhs) == ('=', 2)
+    assert (expressions[1].op, expressions[1].rhs) == ('>', 2)
+
+
+def test_chunks_after(targets, sources, nodes_query, primary_key):
+    query = nodes_query.join()
+    chunk = [MagicMock(id=6)]
+    query.where().order_by().limit().execute.return_value = chunk
+    result = list(targets.chunks(sources, 2, after=5))
+    assert result == [chunk]
+    assert query.where.call_args[0][0].rhs == 5
+
+
+def test_chunks_empty(targets, sources, nodes_query, primary_key):
+    query = nodes_query.join()
+    query.order_by().limit().execute.return_value = [MagicMock(id=1)]
+    query.where().order_by().limit().execute.return_value = []
+    result = list(targets.chunks(sources, 1))
+    assert len(result) == 1
+
+
+def test_chunks_log(targets, logger, sources, nodes_query, primary_key):
+    query = nodes_query.join()
+    query.order_by().limit().execute.return_value = [MagicMock(id=1)]
+    list(targets.chunks(sources, 2))
+    logger.log.assert_called_with('get-targets-chunk', 1, 1)
+
+
+@mark.parametrize('key', ['picks', 'aggregation'])
+def test_chunks_picks(targets, sources, key):
+    sources[0][key] = {}
+    with raises(ValueError):
+        list(targets.chunks(sources, 2))
+
+
+def test_get_count(targets, logger, sources, nodes_query):
+    targets.get(sources)
+    logger.enabled.assert_called_with('get-targets-count')
+    logger.log.assert_called_with('get-targets-count',
+                                  nodes_query.join().count())
+
+
+def test_get_count_disabled(targets, logger, sources, nodes_query):
+    logger.enabled.return_value = False
+    targets.get(sources)
+    assert nodes_query.join().count.call_count == 0
+
+
+def test_get_count_false(targets, logger, sources, nodes_query):
+    targets.get(sources, count=False)
+    assert nodes_query.join().count.call_count == 0
+
+
+def test_get_count_estimate(mocker, targets, logger, sources, nodes_query):
+    mocker.patch.object(Targets, '_estimate', return_value=42)
+    targets.get(sources, count='estimate')
+    Targets._estimate.assert_called_with(nodes_query.join())
+    logger.log.assert_called_with('get-targets-estimate', 42)
+    assert nodes_query.join().count.call_count == 0
+
+
+def test_get_count_estimate_none(mocker, targets, logger, sources,
+                                 nodes_query):
+    mocker.patch.object(Targets, '_estimate', return_value=None)
+    targets.get(sources, count='estimate')
+    assert nodes_query.join().count.call_count == 1
+
+
+def test_estimate_postgres(targets):
+    query = MagicMock(database=MagicMock(spec=PostgresqlDatabase))
+    query.sql.return_value = ('SELECT', [1])
+    cursor = query.database.execute_sql()
+    cursor.fetchone.return_value = [[{'Plan': {'Plan Rows': 42}}]]
+    assert targets._estimate(query) == 42
+    query.database.execute_sql.assert_called_with(
+        'EXPLAIN (FORMAT JSON) SELECT', [1])
+
+
+def test_estimate_mysql(targets):
+    query = MagicMock(database=MagicMock(spec=MySQLDatabase))
+    query.database.execute_sql().fetchone.return_value = [42]
+    assert targets._estimate(query) == 42
+    args = query.database.execute_sql.call_args[0]
+    assert args[1] == (query.model_class._meta.db_table, )
+
+
+def test_estimate_sqlite(targets):
+    query = MagicMock(database=MagicMock(spec=SqliteDatabase))
+    assert targets._estimate(query) is None
+
+
+def test_get_columns(targets, sources, nodes):
+    columns = [nodes.id, nodes.name]
+    targets.get(sources, columns=columns)
+    nodes.select.assert_called_with(nodes.id, nodes.name)
+
+
+@fixture
+def updated(nodes):
+    nodes.updated = IntegerField()
+    nodes.updated.name = 'updated'
+    return nodes.updated
+
+
+def test_query_watermark(targets, sources, nodes_query, updated):
+    query = nodes_query.join()
+    result = targets.query(sources, watermark=('updated', 5, 9))
+    assert query.where.call_args[0][0].op == '>'
+    assert query.where.call_args[0][0].rhs == 5
+    assert query.where().where.call_args[0][0].op == '<='
+    assert query.where().where.call_args[0][0].rhs == 9
+    assert result == query.where().where()
+
+
+def test_query_watermark_first(targets, sources, nodes_query, updated):
+    query = nodes_query.join()
+    targets.query(sources, watermark=('updated', None, 9))
+    assert query.where.call_count == 1
+    assert query.where.call_args[0][0].rhs == 9
+
+
+def test_get_watermark(mocker, targets, sources):
+    mocker.patch.object(Targets, 'query')
+    targets.get(sources, watermark=('updated', 5, 9))
+    Targets.query.assert_called_with(sources, limit=None, offset=0,
+                                     columns=None,
+                                     watermark=('updated', 5, 9))
+
+
+def test_high_water(targets, sources, nodes_query, updated):
+    query = nodes_query.join().select()
+    result = targets.high_water(sources, 'updated')
+    assert nodes_query.join().select.call_args[0][0].name == 'Max'
+    assert result == query.scalar()
+
+
+def test_high_water_aggregation(targets, sources):
+    sources[0]['aggregation'] = {}
+    with raises(ValueError):
+        targets.high_water(sources, 'updated')
@@ -1,42 +1,367 @@
 # -*- coding: utf-8 -*-
+import threading
 from unittest.mock import MagicMock
 
-from magnivore.Tracker import Tracker
+from magnivore.Tracker import Tracker, database
+from magnivore.TrackerCache import TrackerCache
 
-from peewee import CharField, IntegerField
+from peewee import CharField, IntegerField, Model
 
 from pytest import fixture
 
 
 @fixture
 def tracker(mocker):
-    mocker.patch.object(Tracker, 'get')
-    mocker.patch.object(Tracker, 'save')
+    mocker.patch.object(Tracker, 'select')
+    mocker.patch.object(Tracker, 'insert')
+    mocker.patch.object(Tracker, 'insert_many')
+    mocker.patch.object(Tracker, 'delete')
+    mocker.patch.object(Tracker, 'cache', TrackerCache())
+    mocker.patch.object(Tracker, 'backend', None)
+    mocker.patch.object(Tracker, 'buffers', threading.local())
+    mocker.patch.object(Tracker, 'batch_size', 2)
+    mocker.patch.object(Tracker, 'autoflush', True)
+
+
+@fixture
+def arrays(tracker):
+    Tracker.use_arrays()
 
 
 def test_tracker():
+    assert isinstance(Tracker.digest, CharField)
+    assert Tracker.digest.null is True
     assert isinstance(Tracker.new, IntegerField)
     assert isinstance(Tracker.old, IntegerField)
     assert isinstance(Tracker.match, CharField)
 
 
+def test_tracker_indexes():
+    assert list(Tracker._meta.indexes) == [(('match', 'old'), True)]
+
+
 def test_tracker_track(tracker):
     old_item = MagicMock(id=1)
     new_item = MagicMock(id=2)
     result = Tracker.track('name', old_item, new_item)
-    assert Tracker.save.call_count == 1
+    assert Tracker.buffer() == {('name', 1): 2}
     assert result.match == 'name'
     assert result.old == 1
     assert result.new == 2
 
 
+def test_tracker_track_batch(tracker):
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=2))
+    Tracker.track('name', MagicMock(id=3), MagicMock(id=4))
+    rows = [{'match': 'name', 'old': 1, 'new': 2, 'digest': None},
+            {'match': 'name', 'old': 3, 'new': 4, 'digest': None}]
+    Tracker.insert_many.assert_called_with(rows)
+    assert Tracker.buffer() == {}
+
+
+def test_tracker_track_no_autoflush(tracker):
+    Tracker.autoflush = False
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=2))
+    Tracker.track('name', MagicMock(id=3), MagicMock(id=4))
+    assert Tracker.insert_many.call_count == 0
+    assert len(Tracker.buffer()) == 2
+
+
+def test_tracker_track_replace(tracker):
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=2))
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=3))
+    assert Tracker.buffer() == {('name', 1): 3}
+
+
+def test_tracker_flush(tracker):
+    Tracker.buffer().update({('name', i): i * 10 for i in range(3)})
+    Tracker.flush()
+    Tracker.insert_many.assert_called_with([{'match': 'name', 'old': 2,
+                                             'new': 20, 'digest': None}])
+    assert Tracker.insert_many().upsert().execute.call_count == 2
+    assert Tracker.buffer() == {}
+
+
+def test_tracker_buffer_thread(tracker):
+    Tracker.buffer()[('name', 1)] = 2
+    buffers = []
+    thread = threading.Thread(target=lambda: buffers.append(Tracker.buffer()))
+    thread.start()
+    thread.join()
+    assert buffers == [{}]
+
+
+def test_tracker_flush_empty(tracker):
+    Tracker.flush()
+    assert Tracker.insert_many.call_count == 0
+
+
+def test_tracker_track_cache(tracker):
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=2))
+    assert Tracker.cache.get('name', 1) == 2
+
+
 def test_tracker_find_match(tracker):
     result = Tracker.find_match('match_name', 100)
     match_expression = (Tracker.match == 'match_name')
     old_expression = (Tracker.old == 100)
-    assert result == Tracker.get(match_expression, old_expression)
+    Tracker.select().where.assert_called_with(match_expression,
+                                              old_expression)
+    query = Tracker.select().where().order_by()
+    assert result == query.get()
+
+
+def test_tracker_find_match_cached(tracker):
+    Tracker.cache.set('match_name', 100, 200)
+    result = Tracker.find_match('match_name', 100)
+    assert result.new == 200
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_match_fills_cache(tracker):
+    Tracker.find_match('match_name', 100)
+    query = Tracker.select().where().order_by()
+    assert Tracker.cache.get('match_name', 100) == query.get().new
+
+
+def test_tracker_find_match_buffered(mocker, tracker):
+    mocker.patch.object(Tracker, 'flush')
+    Tracker.cache = None
+    Tracker.buffer()[('match_name', 100)] = 200
+    result = Tracker.find_match('match_name', 100)
+    assert result.new == 200
+    assert Tracker.flush.call_count == 0
+    assert Tracker.select.call_count == 0
+
+
+class Users(Model):
+    pass
+
+
+def test_tracker_find_match_item(mocker, tracker):
+    Tracker.cache = None
+    Tracker.track('editor', MagicMock(id=1), MagicMock(id=2))
+    result = Tracker.find_match('editor', Users(id=1))
+    assert result.new == 2
+    assert result.old == 1
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_match_item_cached(tracker):
+    Tracker.cache.set('editor', 1, 2)
+    result = Tracker.find_match('editor', Users(id=1))
+    assert result.new == 2
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_match_item_fills_cache(tracker):
+    Tracker.find_match('editor', Users(id=1))
+    query = Tracker.select().where().order_by()
+    assert Tracker.cache.get('editor', 1) == query.get().new
+    assert list(Tracker.cache.items) == [('editor', 1)]
+
+
+def test_tracker_find_match_no_cache(tracker):
+    Tracker.cache = None
+    result = Tracker.find_match('match_name', 100)
+    assert result == Tracker.select().where().order_by().get()
 
 
 def test_tracker_match_not_found(tracker):
-    Tracker.get.side_effect = Tracker.DoesNotExist()
+    Tracker.select().where().order_by().get.side_effect = Tracker.DoesNotExist
     assert Tracker.find_match('match_name', 100) is None
+
+
+@fixture
+def upgraded(mocker):
+    digest = MagicMock()
+    digest.name = 'digest'
+    mocker.patch.object(database, 'get_columns', return_value=[digest])
+    mocker.patch.object(Tracker, '_upgrade_index', return_value=False)
+    return mocker.patch('magnivore.Tracker.migrate')
+
+
+def test_tracker_upgrade(mocker, tracker):
+    mocker.patch.object(database, 'get_indexes', return_value=[])
+    mocker.patch.object(database, 'create_index')
+    mocker.patch.object(Tracker, '_upgrade_digest', return_value=False)
+    assert Tracker.upgrade() is True
+    assert Tracker.delete().where().execute.call_count == 1
+    database.create_index.assert_called_with(Tracker, ['match', 'old'],
+                                             unique=True)
+
+
+def test_tracker_upgrade_indexed(mocker, tracker):
+    index = MagicMock(columns=['match', 'old'])
+    mocker.patch.object(database, 'get_indexes', return_value=[index])
+    mocker.patch.object(database, 'create_index')
+    mocker.patch.object(Tracker, '_upgrade_digest', return_value=False)
+    assert Tracker.upgrade() is False
+    assert database.create_index.call_count == 0
+
+
+def test_tracker_upgrade_digest(tracker, upgraded):
+    database.get_columns.return_value = []
+    assert Tracker.upgrade() is True
+    operation = upgraded.call_args[0][0]
+    assert operation.method == 'add_column'
+    assert operation.args[:2] == ('tracker', 'digest')
+    assert operation.args[2].null is True
+
+
+def test_tracker_upgrade_digest_present(tracker, upgraded):
+    assert Tracker.upgrade() is False
+    assert upgraded.call_count == 0
+
+
+def test_tracker_sign(tracker):
+    Tracker.autoflush = False
+    Tracker.sign('name', 1, 10, 'abc')
+    assert Tracker.digest_buffer() == {('name', 1): (10, 'abc')}
+
+
+def test_tracker_sign_autoflush(tracker):
+    Tracker.sign('name', 1, 10, 'abc')
+    Tracker.sign('name', 2, 20, 'def')
+    assert Tracker.insert_many.call_count == 1
+    assert Tracker.digest_buffer() == {}
+
+
+def test_tracker_track_clears_digest(tracker):
+    Tracker.autoflush = False
+    Tracker.sign('name', 1, 10, 'abc')
+    Tracker.track('name', MagicMock(id=1), MagicMock(id=11))
+    assert Tracker.digest_buffer() == {}
+
+
+def test_tracker_flush_digests(tracker):
+    Tracker.buffer()[('name', 1)] = 10
+    Tracker.digest_buffer()[('name', 1)] = (10, 'abc')
+    Tracker.flush()
+    Tracker.insert_many.assert_called_with([{'match': 'name', 'old': 1,
+                                             'new': 10, 'digest': 'abc'}])
+    assert Tracker.digest_buffer() == {}
+
+
+def test_tracker_digests(tracker):
+    query = Tracker.select().where()
+    query.tuples.return_value = [(2, 'def')]
+    Tracker.digest_buffer()[('name', 1)] = (10, 'abc')
+    result = Tracker.digests('name', [1, 2, 3])
+    assert result == {1: 'abc', 2: 'def'}
+    expression = Tracker.select().where.call_args[0][1]
+    assert expression.rhs == [2, 3]
+
+
+def test_tracker_digests_buffered(tracker):
+    Tracker.digest_buffer()[('name', 1)] = (10, 'abc')
+    assert Tracker.digests('name', [1]) == {1: 'abc'}
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_matches(tracker):
+    Tracker.select().where().tuples.return_value = [(2, 20)]
+    Tracker.buffer()[('name', 1)] = 10
+    result = Tracker.find_matches('name', [1, 2, 3])
+    assert result == [10, 20, None]
+    expression = Tracker.select().where.call_args[0][1]
+    assert expression.rhs == [2, 3]
+    assert Tracker.cache.get('name', 2) == 20
+
+
+def test_tracker_find_matches_cached(tracker):
+    Tracker.cache.set('name', 1, 10)
+    assert Tracker.find_matches('name', [1]) == [10]
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_matches_chunks(tracker):
+    Tracker.select().where().tuples.return_value = []
+    Tracker.find_matches('name', [1, 2, 3])
+    expression = Tracker.select().where.call_args[0][1]
+    assert expression.rhs == [3]
+
+
+def test_tracker_find_matches_arrays(arrays):
+    Tracker.backend.add('name', 1, 2)
+    assert Tracker.find_matches('name', [1, 3]) == [2, None]
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_preload(tracker):
+    query = Tracker.select().where().order_by()
+    query.tuples.return_value = [(1, 10), (2, 20)]
+    Tracker.preload('match_name')
+    Tracker.select().where.assert_called_with(Tracker.match == 'match_name')
+    assert Tracker.cache.get('match_name', 2) == 20
+
+
+def test_tracker_preload_buffered(tracker):
+    query = Tracker.select().where().order_by()
+    query.tuples.return_value = [(1, 10)]
+    Tracker.buffer()[('match_name', 1)] = 11
+    Tracker.buffer()[('other_name', 2)] = 22
+    Tracker.preload('match_name')
+    assert Tracker.cache.get('match_name', 1) == 11
+    assert Tracker.cache.get('other_name', 2) is None
+
+
+def test_tracker_preload_item(tracker):
+    query = Tracker.select().where().order_by()
+    query.tuples.return_value = [(1, 10)]
+    Tracker.preload('editor')
+    Tracker.select.reset_mock()
+    assert Tracker.find_match('editor', Users(id=1)).new == 10
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_preload_no_cache(tracker):
+    Tracker.cache = None
+    Tracker.preload('match_name')
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_use_cache(tracker):
+    Tracker.use_cache(size=10)
+    assert Tracker.cache.size == 10
+
+
+def test_tracker_use_cache_disabled(tracker):
+    Tracker.use_cache(size=0)
+    assert Tracker.cache is None
+
+
+def test_tracker_track_arrays(arrays):
+    result = Tracker.track('name', MagicMock(id=1), MagicMock(id=2))
+    assert Tracker.buffer() == {}
+    assert Tracker.backend.get('name', 1) == 2
+    assert result.new == 2
+
+
+def test_tracker_find_match_arrays(arrays):
+    Tracker.backend.add('name', 1, 2)
+    result = Tracker.find_match('name', 1)
+    assert result.match == 'name'
+    assert result.old == 1
+    assert result.new == 2
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_find_match_arrays_none(arrays):
+    assert Tracker.find_match('name', 1) is None
+
+
+def test_tracker_preload_arrays(arrays):
+    Tracker.preload('match_name')
+    assert Tracker.select.call_count == 0
+
+
+def test_tracker_use_arrays(tracker):
+    Tracker.use_arrays(path='tracker')
+    assert Tracker.backend.path == 'tracker'
+
+
+def test_tracker_persist(mocker, tracker):
+    Tracker.backend = MagicMock()
+    Tracker.persist()
+    assert Tracker.backend.save.call_count == 1
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+import os
+from array import array
+
+from magnivore.TrackerArrays import TrackerArrays
+
+from peewee import Model
+
+from pytest import fixture
+
+
+class Users(Model):
+    pass
+
+
+@fixture
+def arrays():
+    return TrackerArrays(buffer_size=3)
+
+
+@fixture
+def saved_arrays(tmpdir):
+    arrays = TrackerArrays(path=str(tmpdir))
+    for i in range(10):
+        arrays.add('editor', i * 2, i + 100)
+    arrays.save()
+    return TrackerArrays(path=str(tmpdir))
+
+
+def test_init():
+    arrays = TrackerArrays()
+    assert arrays.path is None
+    assert arrays.buffer_size == 100000
+
+
+def test_add(arrays):
+    arrays.add('editor', 1, 10)
+    assert arrays.buffers['editor'] == {1: 10}
+    assert arrays.unsaved == {}
+
+
+def test_add_unsaved(tmpdir):
+    arrays = TrackerArrays(path=str(tmpdir))
+    arrays.add('editor', 1, 10)
+    assert arrays.unsaved == {'editor': {1: 10}}
+
+
+def test_add_merge(arrays):
+    for i in range(3):
+        arrays.add('editor', i, i + 10)
+    assert arrays.buffers == {}
+    assert arrays.columns['editor'] == (array('q', [0, 1, 2]),
+                                        array('q', [10, 11, 12]))
+
+
+def test_get(arrays):
+    arrays.add('editor', 1, 10)
+    assert arrays.get('editor', 1) == 10
+
+
+def test_get_item(arrays):
+    for i in range(5):
+        arrays.add('editor', i, i + 10)
+    assert arrays.get('editor', Users(id=1)) == 11
+    assert arrays.get('editor', Users(id=4)) == 14
+
+
+def test_get_merged(arrays):
+    for i in range(5):
+        arrays.add('editor', i, i + 10)
+    assert arrays.get('editor', 1) == 11
+    assert arrays.get('editor', 4) == 14
+
+
+def test_get_none(arrays):
+    arrays.add('editor', 1, 10)
+    assert arrays.get('editor', 2) is None
+    assert arrays.get('editor', None) is None
+    assert arrays.get('author', 1) is None
+
+
+def test_merge_unsorted(arrays):
+    for old_id in [8, 2, 6]:
+        arrays.add('editor', old_id, old_id * 10)
+    for old_id in [5, 1, 9]:
+        arrays.add('editor', old_id, old_id * 10)
+    olds, news = arrays.columns['editor']
+    assert olds == array('q', [1, 2, 5, 6, 8, 9])
+    assert news == array('q', [10, 20, 50, 60, 80, 90])
+
+
+def test_merge_replaces(arrays):
+    for old_id in [1, 2, 3]:
+        arrays.add('editor', old_id, old_id)
+    arrays.add('editor', 2, 200)
+    arrays.merge('editor')
+    assert arrays.get('editor', 2) == 200
+    assert len(arrays.columns['editor'][0]) == 3
+
+
+def test_save(tmpdir):
+    arrays = TrackerArrays(path=str(tmpdir))
+    arrays.add('editor', 1, 10)
+    arrays.save()
+    assert os.path.exists(os.path.join(str(tmpdir), 'editor.tracker'))
+    assert os.path.exists(os.path.join(str(tmpdir),
+                                       'editor.tracker-log')) is False
+    assert arrays.unsaved == {}
+
+
+def test_save_log(saved_arrays, tmpdir):
+    filename = os.path.join(str(tmpdir), 'editor.tracker')
+    size = os.path.getsize(filename)
+    saved_arrays.add('editor', 5, 500)
+    saved_arrays.save()
+    assert os.path.getsize(filename) == size
+    assert os.path.getsize('{}-log'.format(filename)) == 3 * 8
+    assert saved_arrays.logged['editor'] == 1
+    saved_arrays.close()
+
+
+def test_save_compact(saved_arrays, tmpdir):
+    for i in range(10):
+        saved_arrays.add('editor', i * 2 + 1, i + 200)
+    saved_arrays.save()
+    filename = os.path.join(str(tmpdir), 'editor.tracker')
+    assert os.path.exists('{}-log'.format(filename)) is False
+    assert os.path.getsize(filename) == (1 + 20 * 2) * 8
+    assert saved_arrays.logged['editor'] == 0
+    saved_arrays.close()
+
+
+def test_load_log(saved_arrays, tmpdir):
+    saved_arrays.add('editor', 4, 400)
+    saved_arrays.save()
+    saved_arrays.add('editor', 4, 440)
+    saved_arrays.add('editor', 7, 700)
+    saved_arrays.save()
+    saved_arrays.close()
+    arrays = TrackerArrays(path=str(tmpdir))
+    assert arrays.get('editor', 4) == 440
+    assert arrays.get('editor', 7) == 700
+    assert arrays.get('editor', 6) == 103
+    assert arrays.logged['editor'] == 3
+    arrays.close()
+
+
+def test_load_log_truncated(saved_arrays, tmpdir):
+    saved_arrays.add('editor', 5, 500)
+    saved_arrays.save()
+    saved_arrays.close()
+    with open(os.path.join(str(tmpdir), 'editor.tracker-log'), 'ab') as f:
+        array('q', [2, 9]).tofile(f)
+        f.write(b'\x01')
+    arrays = TrackerArrays(path=str(tmpdir))
+    assert arrays.get('editor', 5) == 500
+    assert arrays.get('editor', 9) is None
+    assert arrays.logged['editor'] == 1
+    arrays.close()
+
+
+def test_save_no_path(arrays):
+    arrays.add('editor', 1, 10)
+    arrays.save()
+    assert arrays.buffers['editor'] == {1: 10}
+
+
+def test_load(saved_arrays):
+    assert saved_arrays.get('editor', 4) == 102
+    assert saved_arrays.get('editor', 18) == 109
+    assert saved_arrays.get('editor', 3) is None
+    assert len(saved_arrays.maps) == 1
+    saved_arrays.close()
+
+
+def test_load_missing(saved_arrays):
+    assert saved_arrays.get('author', 4) is None
+
+
+def test_load_and_merge(saved_arrays, tmpdir):
+    saved_arrays.add('editor', 5, 500)
+    saved_arrays.add('editor', 30, 300)
+    saved_arrays.save()
+    saved_arrays.close()
+    arrays = TrackerArrays(path=str(tmpdir))
+    assert arrays.get('editor', 5) == 500
+    assert arrays.get('editor', 30) == 300
+    assert arrays.get('editor', 6) == 103
+    arrays.close()
+
+
+def test_match_name_quoted(tmpdir):
+    arrays = TrackerArrays(path=str(tmpdir))
+    arrays.add('a/b', 1, 10)
+    arrays.save()
+    assert TrackerArrays(path=str(tmpdir)).get('a/b', 1) == 10
+
+
+def test_close(saved_arrays):
+    saved_arrays.get('editor', 4)
+    saved_arrays.close()
+    assert saved_arrays.maps == []
+    assert saved_arrays.columns == {}
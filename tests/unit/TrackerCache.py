@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from magnivore.TrackerCache import TrackerCache
+
+from pytest import fixture
+
+
+@fixture
+def cache():
+    return TrackerCache(size=2)
+
+
+def test_init():
+    cache = TrackerCache()
+    assert cache.size == 100000
+    assert cache.hits == 0
+    assert cache.misses == 0
+
+
+def test_get(cache):
+    cache.set('editor', 1, 10)
+    assert cache.get('editor', 1) == 10
+    assert cache.hits == 1
+
+
+def test_get_miss(cache):
+    assert cache.get('editor', 1) is None
+    assert cache.misses == 1
+
+
+def test_get_match_name(cache):
+    cache.set('editor', 1, 10)
+    assert cache.get('author', 1) is None
+
+
+def test_set_overwrite(cache):
+    cache.set('editor', 1, 10)
+    cache.set('editor', 1, 20)
+    assert cache.get('editor', 1) == 20
+
+
+def test_set_eviction(cache):
+    cache.set('editor', 1, 10)
+    cache.set('editor', 2, 20)
+    cache.set('editor', 3, 30)
+    assert cache.get('editor', 1) is None
+    assert cache.get('editor', 3) == 30
+
+
+def test_set_eviction_lru(cache):
+    cache.set('editor', 1, 10)
+    cache.set('editor', 2, 20)
+    cache.get('editor', 1)
+    cache.set('editor', 3, 30)
+    assert cache.get('editor', 1) == 10
+    assert cache.get('editor', 2) is None
+
+
+def test_set_unbounded():
+    cache = TrackerCache(size=None)
+    for i in range(10):
+        cache.set('editor', i, i)
+    assert len(cache.items) == 10
+
+
+def test_preload(cache):
+    cache.preload('editor', [(1, 10), (2, 20)])
+    assert cache.get('editor', 1) == 10
+    assert cache.get('editor', 2) == 20
+
+
+def test_clear(cache):
+    cache.set('editor', 1, 10)
+    cache.get('editor', 1)
+    cache.clear()
+    assert cache.items == {}
+    assert cache.hits == 0
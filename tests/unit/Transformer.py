@@ -2,9 +2,13 @@
 from unittest.mock import MagicMock
 
 from magnivore.Lexicon import Lexicon
+from magnivore.Loader import Loader
+from magnivore.Tracker import Tracker
 from magnivore.Transformer import Transformer
 
-from pytest import fixture
+from peewee import CharField, ForeignKeyField, Model, PostgresqlDatabase
+
+from pytest import fixture, mark, raises
 
 
 @fixture
@@ -15,121 +19,112 @@ def transformations():
 
 
 @fixture
-def transformer(transformations, logger):
-    return Transformer(transformations, MagicMock(), logger, match='match')
+def match():
+    return {'from': 'tracked', 'attribute': 'id'}
+
+
+@fixture
+def transformer(mocker, transformations, logger, match):
+    mocker.patch.object(Lexicon, 'compile_sync')
+    mocker.patch.object(Lexicon, 'compile_sync_many')
+    return Transformer(transformations, MagicMock(), logger, match=match)
 
 
 def test_init(logger):
-    assert Transformer(None, None, logger).match is None
+    transformer = Transformer(None, None, logger)
+    assert transformer.match is None
+    assert transformer.digest is False
+    assert transformer.updated == 0
+    assert transformer.skipped == 0
 
 
-def test_init_match(logger):
-    assert Transformer(None, None, logger, 'match').match == 'match'
+def test_init_match(mocker, logger):
+    mocker.patch.object(Lexicon, 'compile_sync')
+    mocker.patch.object(Lexicon, 'compile_sync_many')
+    transformer = Transformer(None, None, logger, 'match')
+    assert transformer.match == 'match'
+    Lexicon.compile_sync.assert_called_with('match', logger)
+    assert transformer.sync_match == Lexicon.compile_sync()
+    Lexicon.compile_sync_many.assert_called_with('match', logger)
+    assert transformer.sync_matches == Lexicon.compile_sync_many()
 
 
-def test_item_values(mocker, transformer):
-    mocker.patch.object(Lexicon, 'basic')
-    target = MagicMock()
-    values = transformer.item_values(target)
-    Lexicon.basic.assert_called_with('nodesfield', target)
-    assert values['profilefield'] == Lexicon.basic()
+def test_init_plan(mocker, logger):
+    mocker.patch.object(Lexicon, 'compile_basic')
+    transformer = Transformer({'field': 'other'}, None, logger)
+    Lexicon.compile_basic.assert_called_with('other')
+    assert transformer.plan == [('field', Lexicon.compile_basic(), False)]
 
 
-def test_item_values_transform(mocker, transformer):
-    mocker.patch.object(Lexicon, 'transform')
-    transformations = {
-        'age': {
-            'transform': {}
-        }
-    }
-    transformer.transformations = transformations
-    target = MagicMock()
-    values = transformer.item_values(target)
-    Lexicon.transform.assert_called_with(transformations['age'], target)
-    assert values['age'] == Lexicon.transform()
+def test_init_plan_unknown(logger):
+    with raises(ValueError):
+        Transformer({'field': {'unknown': 'rule'}}, None, logger)
 
 
-def test_item_values_format(mocker, transformer):
-    mocker.patch.object(Lexicon, 'format')
-    transformations = {
-        'age': {
-            'format': {}
-        }
-    }
-    transformer.transformations = transformations
+def test_item_values(mocker, logger):
+    mocker.patch.object(Lexicon, 'compile_basic')
+    transformer = Transformer({'profilefield': 'nodesfield'}, None, logger)
     target = MagicMock()
     values = transformer.item_values(target)
-    Lexicon.format.assert_called_with(transformations['age'], target)
-    assert values['age'] == Lexicon.format()
+    Lexicon.compile_basic().assert_called_with(target)
+    assert values['profilefield'] == Lexicon.compile_basic()()
 
 
-def test_item_values_match(mocker, transformer, logger):
-    mocker.patch.object(Lexicon, 'match')
+def test_item_values_real(logger):
     transformations = {
-        'age': {
-            'match': {}
-        }
+        'name': 'username',
+        'city': 'address.city',
+        'greeting': {'format': 'hi {}', 'from': 'username'},
+        'kind': {'static': 'user'}
     }
-    transformer.transformations = transformations
+    transformer = Transformer(transformations, None, logger)
+    target = MagicMock(username='gandalf')
+    target.address.city = 'shire'
+    values = transformer.item_values(target)
+    assert values == {'name': 'gandalf', 'city': 'shire',
+                      'greeting': 'hi gandalf', 'kind': 'user'}
+
+
+@mark.parametrize('rule, compiler', [
+    ({'transform': {}}, 'compile_transform'),
+    ({'factor': {}}, 'compile_factor'),
+    ({'format': {}}, 'compile_format'),
+    ({'static': {}}, 'compile_static')
+])
+def test_item_values_rules(mocker, logger, rule, compiler):
+    mocker.patch.object(Lexicon, compiler)
+    transformer = Transformer({'age': rule}, None, logger)
     target = MagicMock()
     values = transformer.item_values(target)
-    Lexicon.match.assert_called_with(transformations['age'], target, logger)
-    assert values['age'] == Lexicon.match()
-
-
-def test_item_values_match_none(mocker, transformer):
-    mocker.patch.object(Lexicon, 'match')
-    Lexicon.match.return_value = None
-    transformations = {
-        'age': {
-            'match': {}
-        }
-    }
-    transformer.transformations = transformations
-    assert transformer.item_values(MagicMock()) is None
-
-
-def test_item_values_static(mocker, transformer):
-    mocker.patch.object(Lexicon, 'static')
-    transformations = {
-        'age': {
-            'static': {}
-        }
-    }
+    getattr(Lexicon, compiler).assert_called_with(rule)
+    getattr(Lexicon, compiler)().assert_called_with(target)
+    assert values['age'] == getattr(Lexicon, compiler)()()
+
+
+@mark.parametrize('rule, compiler', [
+    ({'match': {}}, 'compile_match'),
+    ({'expression': {}}, 'compile_expression')
+])
+def test_item_values_logger_rules(mocker, logger, rule, compiler):
+    mocker.patch.object(Lexicon, compiler)
+    transformer = Transformer({'age': rule}, None, logger)
     target = MagicMock()
-    transformer.transformations = transformations
     values = transformer.item_values(target)
-    Lexicon.static.assert_called_with(transformations['age'], target)
-    assert values['age'] == Lexicon.static()
+    getattr(Lexicon, compiler).assert_called_with(rule, logger)
+    getattr(Lexicon, compiler)().assert_called_with(target)
+    assert values['age'] == getattr(Lexicon, compiler)()()
 
 
-def test_item_values_expression(mocker, transformer, logger):
-    mocker.patch.object(Lexicon, 'expression')
-    transformations = {
-        'age': {
-            'expression': {}
-        }
-    }
-    target = MagicMock()
-    transformer.transformations = transformations
-    values = transformer.item_values(target)
-    Lexicon.expression.assert_called_with(transformations['age'], target,
-                                          logger)
-    assert values['age'] == Lexicon.expression()
+def test_item_values_match_none(mocker, logger):
+    mocker.patch.object(Lexicon, 'compile_match')
+    Lexicon.compile_match.return_value = lambda target: None
+    transformer = Transformer({'age': {'match': {}}}, None, logger)
+    assert transformer.item_values(MagicMock()) is None
 
 
-def test_item_values_factor(mocker, transformer, logger):
-    mocker.patch.object(Lexicon, 'factor')
-    transformations = {
-        'age': {
-            'factor': {}
-        }
-    }
-    target = MagicMock()
-    transformer.transformations = transformations
-    values = transformer.item_values(target)
-    Lexicon.factor.assert_called_with(transformations['age'], target)
-    assert values['age'] == Lexicon.factor()
+def test_item_values_static_none(mocker, logger):
+    transformer = Transformer({'age': {'static': None}}, None, logger)
+    assert transformer.item_values(MagicMock()) == {'age': None}
 
 
 def test_transform(mocker, transformer):
@@ -151,19 +146,275 @@ def test_transform_none(mocker, transformer):
 def test_sync(mocker, transformer, logger):
     mocker.patch.object(Transformer, 'item_values')
     mocker.patch.object(Transformer, '_set_values')
-    mocker.patch.object(Lexicon, 'sync')
     target = MagicMock()
     result = transformer.sync(target)
     Transformer.item_values.assert_called_with(target)
-    Lexicon.sync.assert_called_with('match', target, logger)
+    transformer.sync_match.assert_called_with(target)
     assert Transformer._set_values.call_count == 1
     assert result == transformer.model.get()
     assert result.save.call_count == 1
+    assert transformer.updated == 1
+
+
+def test_sync_no_values(mocker, transformer):
+    mocker.patch.object(Transformer, 'item_values', return_value=None)
+    assert transformer.sync(MagicMock()) is None
+    assert transformer.model.get.call_count == 0
+
+
+class Users(Model):
+    pass
+
+
+class Profiles(Model):
+    name = CharField()
+    city = CharField()
+    n = CharField()
+    user = ForeignKeyField(Users)
+
+
+@fixture
+def digests(mocker):
+    mocker.patch.object(Tracker, 'digests', return_value={})
+    mocker.patch.object(Tracker, 'sign')
+
+
+@fixture
+def profiles(logger):
+    transformations = {'name': 'a', 'city': 'b', 'n': 'c', 'user_id': 'd'}
+    return Transformer(transformations, Profiles, logger)
+
+
+def test_sync_digest(mocker, transformer, digests, profiles):
+    mocker.patch.object(Transformer, 'item_values',
+                        return_value={'name': 'a'})
+    transformer.digest = True
+    target = MagicMock(id=7)
+    transformer.sync(target)
+    digest = profiles.hash_values({'name': 'a'})
+    Tracker.digests.assert_called_with('tracked', [7])
+    Tracker.sign.assert_called_with('tracked', 7, transformer.sync_match(),
+                                    digest)
+    assert transformer.model.get().save.call_count == 1
+
+
+def test_sync_digest_unchanged(mocker, transformer, digests, profiles):
+    mocker.patch.object(Transformer, 'item_values',
+                        return_value={'name': 'a'})
+    Tracker.digests.return_value = {7: profiles.hash_values({'name': 'a'})}
+    transformer.digest = True
+    assert transformer.sync(MagicMock(id=7)) is None
+    assert transformer.model.get.call_count == 0
+    assert Tracker.sign.call_count == 0
+    assert transformer.skipped == 1
+    assert transformer.updated == 0
+
+
+def test_hash_values(profiles):
+    digest = profiles.hash_values({'name': 'a', 'city': 'b'})
+    assert digest == profiles.hash_values({'city': 'b', 'name': 'a'})
+    assert digest != profiles.hash_values({'name': 'a', 'city': 'c'})
+    assert len(digest) == 16
+
+
+def test_hash_values_item(profiles):
+    digest = profiles.hash_values({'user': Users(id=1)})
+    assert digest == profiles.hash_values({'user': Users(id=1)})
+    assert digest == profiles.hash_values({'user': 1})
+    assert digest != profiles.hash_values({'user': Users(id=2)})
+
+
+def test_hash_values_unknown(profiles):
+    digest = profiles.hash_values({'other': 'a'})
+    assert digest == profiles.hash_values({'other': 'a'})
+    assert digest != profiles.hash_values({'other': 'b'})
+
+
+def test_resolve(profiles):
+    assert profiles.fields == {'name': Profiles.name, 'city': Profiles.city,
+                               'n': Profiles.n, 'user': Profiles.user}
+
+
+def test_compile_column(profiles):
+    target = MagicMock(a='x', b='y', c=3, d=1)
+    assert profiles.item_values(target) == {'name': 'x', 'city': 'y', 'n': 3,
+                                            'user': 1}
+
+
+def test_resolve_unknown(logger):
+    transformer = Transformer({'other': 'a'}, Profiles, logger)
+    assert transformer.fields == {}
 
 
 def test_sync_none(mocker, transformer, logger):
     mocker.patch.object(Transformer, 'item_values')
     mocker.patch.object(Transformer, '_set_values')
-    mocker.patch.object(Lexicon, 'sync')
-    Lexicon.sync.return_value = None
+    transformer.sync_match.return_value = None
     assert transformer.sync(MagicMock()) is None
+
+
+@fixture
+def batch_transformer(mocker, transformations, logger, match):
+    mocker.patch.object(Lexicon, 'compile_sync')
+    mocker.patch.object(Lexicon, 'compile_sync_many')
+    model = MagicMock()
+    model._meta.primary_key.name = 'id'
+    model._meta.primary_key.db_column = 'id'
+    return Transformer(transformations, model, logger, match=match,
+                       batch=2)
+
+
+def test_init_batch(logger):
+    assert Transformer(None, None, logger, batch=10).batch == 10
+
+
+def test_init_loader(logger):
+    transformer = Transformer(None, None, logger, loader='copy')
+    assert transformer.loader.method == 'copy'
+    assert transformer.batch == Transformer.default_batch
+
+
+def test_init_loader_batch(logger):
+    transformer = Transformer(None, None, logger, batch=10, loader='copy')
+    assert transformer.batch == 10
+
+
+def test_init_loader_default(logger):
+    assert Transformer(None, None, logger).loader.method == 'insert'
+
+
+def test_init_loader_unknown(logger):
+    with raises(ValueError):
+        Transformer(None, None, logger, loader='unknown')
+
+
+def test_transform_many(mocker, batch_transformer):
+    mocker.patch.object(Loader, 'load')
+    Loader.load.side_effect = [[1, 2], [3]]
+    targets = [MagicMock(), MagicMock(), MagicMock()]
+    result = list(batch_transformer.transform_many(targets))
+    assert Loader.load.call_count == 2
+    assert [target for target, item in result] == targets
+    assert result[2][1].id == 3
+
+
+def test_transform_many_none(mocker, batch_transformer):
+    mocker.patch.object(Transformer, 'item_values', return_value=None)
+    mocker.patch.object(Loader, 'load')
+    result = list(batch_transformer.transform_many([MagicMock()]))
+    assert result == []
+    assert Loader.load.call_count == 0
+
+
+def test_load_many(mocker, batch_transformer):
+    mocker.patch.object(Transformer, 'item_values')
+    mocker.patch.object(Loader, 'load', return_value=[5])
+    target = MagicMock()
+    result = list(batch_transformer.load_many([(target, {'name': 'a'}),
+                                               (MagicMock(), None)]))
+    Loader.load.assert_called_with([{'name': 'a'}])
+    assert result[0][0] == target
+    assert result[0][1].id == 5
+    assert Transformer.item_values.call_count == 0
+
+
+def test_update(mocker, batch_transformer):
+    case = mocker.patch('magnivore.Transformer.case')
+    model = batch_transformer.model
+    field = model._meta.fields['name']
+    updates = {1: {'name': 'a'}, 2: {'name': 'b'}}
+    batch_transformer._update(updates)
+    cases = [(1, field.db_value('a')), (2, field.db_value('b'))]
+    case.assert_called_with(model._meta.primary_key, cases)
+    model.update.assert_called_with({field: case()})
+    assert model.update().where().execute.call_count == 1
+
+
+def test_update_postgres(mocker, batch_transformer):
+    case = mocker.patch('magnivore.Transformer.case')
+    cast = mocker.patch('magnivore.Transformer.cast')
+    model = batch_transformer.model
+    model._meta.database = MagicMock(spec=PostgresqlDatabase)
+    field = model._meta.fields['name']
+    batch_transformer._update({1: {'name': 'a'}})
+    cast.assert_called_with(case(), field.get_column_type())
+    model.update.assert_called_with({field: cast()})
+
+
+def test_sync_many(mocker, batch_transformer, logger):
+    mocker.patch.object(Transformer, '_update')
+    mocker.patch.object(Transformer, 'item_values')
+    batch_transformer.sync_matches.side_effect = [[1, 2], [None, 3]]
+    targets = [MagicMock(), MagicMock(), MagicMock(), MagicMock()]
+    batch_transformer.sync_many(targets)
+    batch_transformer.sync_matches.assert_called_with(targets[2:])
+    assert batch_transformer.sync_matches.call_count == 2
+    assert batch_transformer.sync_match.call_count == 0
+    Transformer._update.assert_called_with({3: Transformer.item_values()})
+    assert Transformer._update.call_count == 2
+
+
+def test_sync_many_no_values(mocker, batch_transformer):
+    mocker.patch.object(Transformer, '_update')
+    mocker.patch.object(Transformer, 'item_values', return_value=None)
+    batch_transformer.sync_many([MagicMock()])
+    assert Transformer._update.call_count == 0
+
+
+def test_sync_values(mocker, batch_transformer):
+    mocker.patch.object(Transformer, 'item_values')
+    batch_transformer.sync_match.return_value = 1
+    target = MagicMock(id=7)
+    result = batch_transformer.sync_values(target)
+    Transformer.item_values.assert_called_with(target)
+    assert result == (1, Transformer.item_values(), 7)
+
+
+def test_sync_values_none(mocker, batch_transformer):
+    mocker.patch.object(Transformer, 'item_values')
+    batch_transformer.sync_match.return_value = None
+    assert batch_transformer.sync_values(MagicMock()) is None
+    assert Transformer.item_values.call_count == 0
+
+
+def test_update_many(mocker, batch_transformer):
+    mocker.patch.object(Transformer, '_update')
+    batch_transformer.update_many([(1, {'name': 'a'}, 10), None,
+                                   (2, None, 20), (3, {'name': 'c'}, 30)])
+    Transformer._update.assert_called_with({1: {'name': 'a'},
+                                            3: {'name': 'c'}})
+    assert Transformer._update.call_count == 1
+    assert batch_transformer.updated == 2
+
+
+def test_update_many_digest(mocker, batch_transformer, digests, profiles):
+    mocker.patch.object(Transformer, '_update')
+    Tracker.digests.return_value = {10: profiles.hash_values({'n': 'a'})}
+    batch_transformer.digest = True
+    batch_transformer.update_many([(1, {'n': 'a'}, 10), (2, {'n': 'b'}, 20)])
+    Tracker.digests.assert_called_with('tracked', [10, 20])
+    Transformer._update.assert_called_with({2: {'n': 'b'}})
+    Tracker.sign.assert_called_with('tracked', 20, 2,
+                                    profiles.hash_values({'n': 'b'}))
+    assert batch_transformer.updated == 1
+    assert batch_transformer.skipped == 1
+
+
+def test_update_many_unchanged(mocker, batch_transformer, digests, profiles):
+    mocker.patch.object(Transformer, '_update')
+    Tracker.digests.return_value = {10: profiles.hash_values({'n': 'a'})}
+    batch_transformer.digest = True
+    batch_transformer.update_many([(1, {'n': 'a'}, 10)])
+    assert Transformer._update.call_count == 0
+
+
+def test_init_allocate(logger):
+    transformer = Transformer(None, None, logger, allocate=True)
+    assert transformer.loader.allocate is True
+    assert transformer.loader.allocator.block_size == 1000
+    assert transformer.batch == Transformer.default_batch
+
+
+def test_init_allocate_block_size(logger):
+    transformer = Transformer(None, None, logger, allocate=500)
+    assert transformer.loader.allocator.block_size == 500
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from magnivore.Tracker import database
+from magnivore.Watermark import Watermark
+
+from peewee import CharField, IntegerField
+
+from pytest import fixture
+
+
+@fixture
+def watermark(mocker):
+    mocker.patch.object(Watermark, 'get')
+    mocker.patch.object(Watermark, 'insert_many')
+    mocker.patch.object(Watermark, 'buffers', threading.local())
+
+
+def test_watermark():
+    assert isinstance(Watermark.ruleset, CharField)
+    assert Watermark.ruleset.unique is True
+    assert isinstance(Watermark.value, CharField)
+    assert Watermark.value.null is True
+    assert Watermark._meta.database == database
+
+
+def test_watermark_find(watermark):
+    Watermark.get.return_value = Watermark(ruleset='profiles:0', value='42')
+    assert Watermark.find('profiles:0', IntegerField()) == 42
+
+
+def test_watermark_find_none(watermark):
+    Watermark.get.side_effect = Watermark.DoesNotExist
+    assert Watermark.find('profiles:0', IntegerField()) is None
+
+
+def test_watermark_advance(watermark):
+    Watermark.advance('profiles:0', 10)
+    Watermark.advance('profiles:0', 20)
+    assert Watermark.buffer() == {'profiles:0': {'ruleset': 'profiles:0',
+                                                 'value': '20'}}
+
+
+def test_watermark_flush(watermark):
+    Watermark.advance('profiles:0', 10)
+    Watermark.flush()
+    rows = [{'ruleset': 'profiles:0', 'value': '10'}]
+    Watermark.insert_many.assert_called_with(rows)
+    assert Watermark.insert_many().upsert().execute.call_count == 1
+    assert Watermark.buffer() == {}
+
+
+def test_watermark_flush_empty(watermark):
+    Watermark.flush()
+    assert Watermark.insert_many.call_count == 0